@@ -0,0 +1,45 @@
+"""
+Options and fixtures of the benchmark suite: a local stub of the API shared
+by all the benchmarks and the number of observations of each run.
+"""
+
+import pytest
+
+import mecoda_nat.mecoda_nat as mecoda_nat
+from stub_server import StubNatusfera
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("mecoda_nat benchmarks")
+    group.addoption(
+        "--sizes", default="1000,10000,100000",
+        help="comma separated numbers of observations of each benchmark")
+    group.addoption(
+        "--stub-latency", type=float, default=0.0,
+        help="seconds the stub waits before each answer")
+    group.addoption(
+        "--photo-size", type=int, default=1_000,
+        help="bytes of each photo served by the stub")
+
+
+def pytest_generate_tests(metafunc):
+    if "size" in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption("sizes").split(",")]
+        metafunc.parametrize("size", sizes)
+
+
+@pytest.fixture(scope="session")
+def stub(request):
+    config = request.config
+    sizes = [int(size) for size in config.getoption("sizes").split(",")]
+    with StubNatusfera(
+        total=max(sizes),
+        latency=config.getoption("stub_latency"),
+        photo_size=config.getoption("photo_size"),
+    ) as stub:
+        mpatch = pytest.MonkeyPatch()
+        mpatch.setattr(mecoda_nat, "API_URL", stub.url)
+        # the stub serves every page, not only the first 20,000 results
+        mpatch.setattr(mecoda_nat, "MAX_PAGES", -(-max(sizes) // mecoda_nat.PER_PAGE))
+        yield stub
+        mpatch.undo()
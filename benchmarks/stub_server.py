@@ -0,0 +1,164 @@
+"""
+Local HTTP server that imitates the Natusfera endpoints used by the
+benchmarks, serving synthetic data with a configurable latency.
+
+    with StubNatusfera(total=10_000, latency=0.005) as stub:
+        mecoda_nat.mecoda_nat.API_URL = stub.url
+        ...
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+DWC_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<dwr:SimpleDarwinRecordSet'
+    ' xmlns:dwr="http://rs.tdwg.org/dwc/xsd/simpledarwincore/"'
+    ' xmlns:dwc="http://rs.tdwg.org/dwc/terms/">\n'
+)
+DWC_FOOTER = "</dwr:SimpleDarwinRecordSet>\n"
+DWC_RECORD = (
+    "<dwr:SimpleDarwinRecord>"
+    "<dwc:occurrenceID>https://natusfera.gbif.es/observations/{id}</dwc:occurrenceID>"
+    "<dwc:basisOfRecord>HumanObservation</dwc:basisOfRecord>"
+    "<dwc:institutionCode>iNaturalist</dwc:institutionCode>"
+    "<dwc:datasetName>iNaturalist research-grade observations</dwc:datasetName>"
+    "<dwc:catalogNumber>{id}</dwc:catalogNumber>"
+    "<dwc:eventDate>2021-03-15</dwc:eventDate>"
+    "<dwc:decimalLatitude>41.{id}</dwc:decimalLatitude>"
+    "<dwc:decimalLongitude>2.{id}</dwc:decimalLongitude>"
+    "<dwc:scientificName>Quercus ilex</dwc:scientificName>"
+    "<dwc:taxonRank>species</dwc:taxonRank>"
+    "<dwc:recordedBy>user{user}</dwc:recordedBy>"
+    "</dwr:SimpleDarwinRecord>\n"
+)
+
+
+def observation(id_: int, url: str = "") -> dict:
+    """Raw observation as returned by observations.json, photos under `url`."""
+    return {
+        "id": id_,
+        "captive": False,
+        "created_at": "2021-03-15T16:10:39+02:00",
+        "updated_at": "2021-03-16T10:44:44+02:00",
+        "observed_on": "2021-03-15",
+        "description": "Pavo real en su\r\nhábitat natural",
+        "iconic_taxon_id": 3,
+        "taxon": {
+            "id": 2850 + id_ % 50,
+            "name": "Thalassoma pavo",
+            "ancestry": "1/2/10/11/82/1049/1048",
+        },
+        "latitude": f"{41 + (id_ % 1000) / 1000:.6f}",
+        "longitude": f"{2 + (id_ % 700) / 1000:.6f}",
+        "place_guess": "Barcelona,\r\nCatalunya",
+        "quality_grade": "research",
+        "user_id": id_ % 97,
+        "user_login": f"user{id_ % 97}",
+        "photos": [{
+            "id": 10 * id_,
+            "large_url": f"{url}/photos/{id_}/large/a.jpg",
+            "medium_url": f"{url}/photos/{id_}/medium/a.jpg",
+            "small_url": f"{url}/photos/{id_}/small/a.jpg",
+        }],
+        "num_identification_agreements": 2,
+        "num_identification_disagreements": 0,
+        "identifications_count": 2,
+        "id_please": False,
+    }
+
+
+def dwc_document(ids) -> bytes:
+    records = "".join(DWC_RECORD.format(id=id_, user=id_ % 97) for id_ in ids)
+    return (DWC_HEADER + records + DWC_FOOTER).encode()
+
+
+class StubNatusfera:
+    """
+    Serves `total` synthetic observations (ids 1 to total) through
+    observations.json and observations.dwc, paginated by `per_page` and
+    `page`, plus photos of `photo_size` bytes under /photos/.
+    Every answer is delayed by `latency` seconds.
+
+    The tests override single paths ("/path?query", unquoted): `pages`
+    maps them to a json document or bytes answered with a 200, `answers`
+    queues (status, headers, body) answers given once each. `requests`
+    lists the paths requested.
+    """
+
+    def __init__(self, total: int = 1000, latency: float = 0.0, photo_size: int = 50_000):
+        self.total = total
+        self.latency = latency
+        self.photo = b"\xff" * photo_size
+        self.pages = {}
+        self.answers = {}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                path = unquote(self.path)
+                stub.requests.append(path)
+                time.sleep(stub.latency)
+                status, headers, body = stub.respond(path)
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                    headers = {"Content-Type": "application/json", **headers}
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def _page_ids(self, query):
+        per_page = int(query.get("per_page", ["200"])[0])
+        page = int(query.get("page", ["1"])[0])
+        start = (page - 1) * per_page + 1
+        return range(start, min(start + per_page, self.total + 1))
+
+    def respond(self, path):
+        """(status, headers, body) of the request of `path`."""
+        if self.answers.get(path):
+            return self.answers[path].pop(0)
+        if path in self.pages:
+            return 200, {}, self.pages[path]
+        url = urlparse(path)
+        body, content_type = self.answer(url.path, parse_qs(url.query))
+        return 200 if body is not None else 404, {"Content-Type": content_type}, body or b""
+
+    def answer(self, path, query):
+        if path == "/observations.json":
+            page = [observation(id_, self.url) for id_ in self._page_ids(query)]
+            return json.dumps(page).encode(), "application/json"
+        if path == "/observations.dwc":
+            if "id" in query:
+                ids = [int(id_) for id_ in query["id"][0].split(",")]
+            else:
+                ids = self._page_ids(query)
+            return dwc_document(ids), "application/xml"
+        if path.startswith("/photos/"):
+            return self.photo, "image/jpeg"
+        return None, "text/plain"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
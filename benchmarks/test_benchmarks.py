@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Throughput and peak memory of the main functions of the library against
+the local stub of the API, with pytest-benchmark. Each benchmark runs for
+every size of --sizes (1k, 10k and 100k observations by default) and
+records the peak of memory allocated, measured in a separate run, in the
+extra_info of its results.
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:10%
+    pytest benchmarks --sizes=1000 --stub-latency=0.005 --photo-size=50000
+"""
+
+import shutil
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mecoda_nat.mecoda_nat as mecoda_nat
+from mecoda_nat import Observation, load_taxon_tree
+from mecoda_nat.spatial import SpatialIndex
+from stub_server import observation
+
+pytest.importorskip("pytest_benchmark")
+
+ROUNDS = 3
+BARCELONA = (41.39, 2.17)
+POLYGON = [(41, 0.5), (42.5, 1.5), (41.5, 3.5), (41.8, 2.0), (40.5, 2.5)]
+
+
+def run(benchmark, function, setup=lambda: ((), {}), rounds=ROUNDS):
+    """
+    Times `function` with the arguments returned by `setup`, called before
+    each round, and records its peak of memory in MB. tracemalloc slows
+    down the allocations, so the peak is measured in its own run.
+    """
+    args, kwargs = setup()
+    tracemalloc.start()
+    function(*args, **kwargs)
+    benchmark.extra_info["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+    tracemalloc.stop()
+    return benchmark.pedantic(function, setup=setup, rounds=rounds, iterations=1)
+
+
+@pytest.fixture(scope="session")
+def raw_pages():
+    """Raw observations of each size, built once for the session."""
+    cache = {}
+
+    def raw(size, url=""):
+        if (size, url) not in cache:
+            cache[size, url] = [observation(id_, url) for id_ in range(1, size + 1)]
+        return cache[size, url]
+
+    return raw
+
+
+def points(size):
+    """Random observations in the Iberian Peninsula."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "latitude": rng.uniform(36, 43.5, size),
+        "longitude": rng.uniform(-9, 3.3, size),
+        "id_old": np.arange(size),
+        "species_guess": "Thalassoma pavo",
+    })
+
+
+@pytest.mark.parametrize("validate", [True, False])
+def test_get_obs(benchmark, stub, size, validate):
+    result = run(
+        benchmark, mecoda_nat.get_obs,
+        lambda: ((), {"num_max": size, "max_workers": 8, "validate": validate}),
+    )
+    assert len(result) == size
+
+
+@pytest.mark.parametrize("validate", [True, False])
+def test_build_observations(benchmark, raw_pages, size, validate):
+    observations = raw_pages(size)
+    result = run(
+        benchmark, mecoda_nat._build_observations,
+        lambda: ((observations,), {"validate": validate}),
+    )
+    assert len(result) == size
+
+
+@pytest.mark.parametrize("source", ["raw", "models"])
+def test_get_dfs(benchmark, raw_pages, size, source):
+    observations = raw_pages(size)
+    if source == "models":
+        observations = mecoda_nat._build_observations(observations, validate=False)
+    df_observations, df_photos = run(
+        benchmark, mecoda_nat.get_dfs, lambda: ((observations,), {}))
+    assert len(df_observations) == len(df_photos) == size
+
+
+def test_get_taxon_columns(benchmark, size):
+    tree = load_taxon_tree()
+    ids = np.random.default_rng(0).choice(tree.ids, size)
+    ancestries = pd.Series(
+        ["/".join(map(str, tree.ancestors(id_) + [id_])) for id_ in ids.tolist()])
+
+    def setup():
+        return (pd.DataFrame({"id": range(size), "taxon_ancestry": ancestries}),), {}
+
+    run(benchmark, mecoda_nat._get_taxon_columns, setup)
+
+
+def test_get_dwc(benchmark, stub, size):
+    observations = [Observation(id=id_) for id_ in range(1, size + 1)]
+    df = run(
+        benchmark, mecoda_nat.get_dwc,
+        lambda: ((observations,), {"chunk_size": 100, "max_workers": 16}),
+    )
+    assert len(df) == size
+
+
+def test_download_photos(benchmark, stub, raw_pages, tmp_path, size):
+    _, df_photos = mecoda_nat.get_dfs(raw_pages(size, stub.url))
+    directory = tmp_path / "photos"
+
+    def setup():
+        shutil.rmtree(directory, ignore_errors=True)
+        return (df_photos,), {"directorio": str(directory), "max_workers": 16}
+
+    result = run(benchmark, mecoda_nat.download_photos, setup, rounds=1)
+    assert (result["status"] == "downloaded").all()
+
+
+@pytest.mark.parametrize("query", ["radius", "polygon"])
+def test_spatial_index(benchmark, size, query):
+    df = points(size)
+
+    def search(df):
+        index = SpatialIndex(df)
+        if query == "radius":
+            return index.radius(*BARCELONA, 50)
+        return index.polygon(POLYGON)
+
+    run(benchmark, search, lambda: ((df,), {}))
+
+
+@pytest.mark.filterwarnings("ignore:CartoDB tiles")
+@pytest.mark.parametrize("view, kwargs", [
+    ("create_markercluster", {"fast": True}),
+    ("create_markercluster", {"cell_size": 0.1}),
+    ("create_heatmap", {}),
+    ("create_heatmap", {"binned": True}),
+])
+def test_views(benchmark, size, view, kwargs):
+    views = pytest.importorskip("mecoda_nat.views")
+    df = points(size)
+
+    def render(df):
+        html = getattr(views, view)(df, **kwargs).get_root().render()
+        benchmark.extra_info["html_mb"] = round(len(html) / 2**20, 2)
+
+    run(benchmark, render, lambda: ((df,), {}))
@@ -21,7 +21,7 @@ setup(
     url="https://github.com/pynomaly/mecoda-nat",
     packages=find_packages("src"),
     package_dir={"": "src"},
-    package_data={"mecoda_nat": ["py.typed"]},
+    package_data={"mecoda_nat": ["py.typed", "data/taxon_tree.csv", "data/taxon_tree.npz"]},
     py_modules=[splitext(basename(path))[0] for path in glob("src/*.py")],
     python_requires=">=3.6",
     classifiers=[
@@ -38,4 +38,5 @@ setup(
         "Natural Language :: English",
     ],
     install_requires=["pydantic", "requests", "pandas", "flat-table", ],
+    extras_require={"parquet": ["pyarrow"], "aio": ["aiohttp"]},
 )
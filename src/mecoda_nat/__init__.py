@@ -1,4 +1,12 @@
 from .models import Observation, Project, Photo, ICONIC_TAXON, TAXONS
-from .mecoda_nat import get_obs, get_project, get_count_by_taxon, get_dfs, download_photos
+from .mecoda_nat import get_obs, iter_obs, get_obs_sharded, get_project, get_count_by_taxon, get_dfs, download_photos
+from .client import NatusferaClient, get_client, set_client
+from .cache import ResponseCache
+from .metrics import Metrics
+from .ratelimit import RateLimiter
+from .store import ObservationStore, sync_obs, query_obs
+from .export import to_arrow, to_parquet, read_parquet
+from .spatial import SpatialIndex
+from .taxa import TaxonTree, load_taxon_tree
 
-__all__ = ["Observation", "Project", "get_obs", "get_project", "get_count_by_taxon", "Photo", "ICONIC_TAXON", "TAXONS", "get_dfs", "download_photos"]
+__all__ = ["Observation", "Project", "get_obs", "iter_obs", "get_obs_sharded", "get_project", "get_count_by_taxon", "Photo", "ICONIC_TAXON", "TAXONS", "get_dfs", "download_photos", "NatusferaClient", "get_client", "set_client", "ResponseCache", "Metrics", "RateLimiter", "ObservationStore", "sync_obs", "query_obs", "to_arrow", "to_parquet", "read_parquet", "SpatialIndex", "TaxonTree", "load_taxon_tree"]
@@ -0,0 +1,486 @@
+from contextlib import asynccontextmanager, suppress
+from typing import Any, Dict, List, Optional, Tuple, Union
+import asyncio
+import json
+import os
+import time
+import pandas as pd
+from requests.structures import CaseInsensitiveDict
+from . import mecoda_nat
+from .cache import endpoint
+from .client import RETRY_STATUS
+from .metrics import Metrics
+from .ratelimit import RateLimiter, retry_after_seconds
+from .mecoda_nat import (
+    MAX_PAGES,
+    MAX_WORKERS,
+    PER_PAGE,
+    _build_observations,
+    _build_url,
+    _cache_identifications,
+    _cached_identifications,
+    _cached_place_ids,
+    _clean_dwc,
+    _identification_columns,
+    _identification_info,
+    _is_complete,
+    _parse_dwc,
+    _photo_result,
+    _photo_summary,
+    _photo_targets,
+    _place_ids,
+    _place_url,
+    _raise_for_error,
+)
+from .models import Observation, Project
+
+# Async version of the API functions, on aiohttp (pip install mecoda-nat[aio]).
+# The functions share the arguments and results of their synchronous
+# counterparts and take an optional AsyncNatusferaClient; without it each
+# call opens and closes its own.
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError("The async API requires aiohttp")
+    return aiohttp
+
+
+class AsyncResponse:
+    """Answer of AsyncNatusferaClient.get, with its body already read."""
+
+    def __init__(self, url: str, status_code: int, headers: Dict[str, str], content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class AsyncNatusferaClient:
+    """
+    Async counterpart of NatusferaClient on an aiohttp session, opened in
+    the running loop on first use. All the queries that share a client
+    share its pool of at most `limit` connections, `limit_per_host` to
+    the same server, and at most `max_concurrency` requests in flight.
+    Failed requests with a status in RETRY_STATUS, and connection errors,
+    are retried with exponential backoff, honoring `Retry-After`. Every
+    attempt to the API endpoints goes through the RateLimiter, as in
+    NatusferaClient.
+    Use it as `async with AsyncNatusferaClient() as client:`.
+    """
+
+    def __init__(
+        self,
+        limit: int = 16,
+        limit_per_host: int = 8,
+        max_concurrency: int = 16,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: Union[float, Tuple[float, float]] = (10, 60),
+        verify: bool = False,
+        metrics: Optional[Metrics] = None,
+        rate_limiter: Union[RateLimiter, bool] = True,
+    ):
+        _aiohttp()
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.verify = verify
+        self.metrics = metrics
+        if rate_limiter is True:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter or None
+        self._session = None
+        self._semaphore = None
+
+    def session(self):
+        if self._session is None:
+            aiohttp = _aiohttp()
+            connect, read = (
+                self.timeout if isinstance(self.timeout, tuple) else (self.timeout,) * 2)
+            ssl = {} if self.verify else {"ssl": False}
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host, **ssl),
+                timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    @asynccontextmanager
+    async def stream(self, url: str):
+        """
+        Opens a GET request, after its retries, and yields the aiohttp
+        response with its body still to be read. Each attempt takes one of
+        the `max_concurrency` slots, which is kept until the body of the
+        final answer is read and freed while waiting to retry.
+        """
+        session = self.session()
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            await self._semaphore.acquire()
+            try:
+                response, delay = await self._attempt(
+                    session, url, attempt, attempt == self.retries)
+            except BaseException:
+                self._semaphore.release()
+                raise
+            if response is not None:
+                break
+            self._semaphore.release()
+            await asyncio.sleep(delay)
+
+        num_bytes = [0]
+        try:
+            yield response
+            num_bytes[0] = response.content.total_bytes
+        finally:
+            response.release()
+            self._semaphore.release()
+            if self.metrics is not None:
+                self.metrics.on_request(
+                    endpoint(url) or "other", response.status,
+                    time.perf_counter() - start, num_bytes[0], attempt)
+
+    async def _attempt(self, session, url: str, attempt: int, last: bool):
+        """
+        Sends one attempt of a GET request, through the RateLimiter for the
+        API endpoints. Returns the response to keep, or None and the seconds
+        to wait before the next attempt.
+        """
+        aiohttp = _aiohttp()
+        limiter = self.rate_limiter if endpoint(url) is not None else None
+        started = await limiter.acquire_async() if limiter is not None else None
+        try:
+            response = await session.get(url)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if limiter is not None:
+                limiter.release(started)
+            if last:
+                raise
+            return None, self._backoff(attempt)
+        if limiter is not None:
+            limiter.release(
+                started, response.status, response.headers.get("Retry-After"))
+        if response.status not in RETRY_STATUS or last:
+            return response, None
+        delay = retry_after_seconds(response.headers.get("Retry-After"))
+        response.release()
+        return None, delay if delay is not None else self._backoff(attempt)
+
+    async def get(self, url: str) -> AsyncResponse:
+        """GET request whose body is read completely."""
+        async with self.stream(url) as response:
+            content = await response.read()
+            return AsyncResponse(url, response.status, dict(response.headers), content)
+
+    async def head(self, url: str) -> AsyncResponse:
+        """HEAD request, without retries, that reads the headers of `url`."""
+        session = self.session()
+        async with self._semaphore:
+            async with session.head(url, allow_redirects=True) as response:
+                return AsyncResponse(url, response.status, dict(response.headers), b"")
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff_factor * 2 ** attempt
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+@asynccontextmanager
+async def _client(client: Optional[AsyncNatusferaClient]):
+    if client is not None:
+        yield client
+    else:
+        async with AsyncNatusferaClient() as client:
+            yield client
+
+
+async def get_project(
+    project: Union[str, int], client: Optional[AsyncNatusferaClient] = None
+) -> List[Project]:
+    """Download information of a project from id or name"""
+    async with _client(client) as client:
+        if type(project) is int:
+            page = await client.get(f"{mecoda_nat.API_URL}/projects/{project}.json")
+            if page.status_code == 404:
+                print("Project ID not found")
+                raise ValueError(f"The {project} was not found")
+            return [Project(**page.json())]
+
+        elif type(project) is str:
+            page = await client.get(f"{mecoda_nat.API_URL}/projects/search.json?q={project}")
+            return [Project(**proj) for proj in page.json()]
+
+
+async def get_obs(
+    query: Optional[str] = None,
+    id_project: Optional[int] = None,
+    id_obs: Optional[int] = None,
+    user: Optional[str] = None,
+    taxon: Optional[str] = None,
+    taxon_id: Optional[int] = None,
+    place_id: Optional[Union[int, List[int]]] = None,
+    year: Optional[int] = None,
+    num_max: Optional[int] = None,
+    starts_on: Optional[str] = None,  # Must be observed on or after this date
+    ends_on: Optional[str] = None,  # Must be observed on or before this date
+    created_on: Optional[str] = None, # Day YYYY-MM-DD
+    max_workers: int = MAX_WORKERS,
+    validate: bool = True,
+    place_name: Optional[str] = None,
+    client: Optional[AsyncNatusferaClient] = None,
+) -> List[Observation]:
+    """
+    Async version of get_obs: up to `max_workers` pages, or places, of the
+    query are requested at the same time.
+    """
+    def place_url(place: Optional[int]) -> str:
+        return _build_url(
+            query, id_project, id_obs, user, taxon, taxon_id, place, year,
+            starts_on, ends_on, created_on,
+        )
+
+    async with _client(client) as client:
+        if place_name is None and not isinstance(place_id, (list, tuple)):
+            data = await _request(client, place_url(place_id), num_max, max_workers)
+            return _build_observations(data, validate)
+
+        place_ids = [] if place_id is None else (
+            [place_id] if isinstance(place_id, int) else list(place_id))
+        if place_name is not None:
+            place_ids += await get_place_ids(place_name, client)
+        place_ids = list(dict.fromkeys(place_ids))
+
+        semaphore = asyncio.Semaphore(max(1, max_workers))
+
+        async def fetch(place: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await _request(client, place_url(place), num_max, 1)
+
+        seen = set()
+        merged = []
+        for place, data in zip(place_ids, await asyncio.gather(*map(fetch, place_ids))):
+            for obs in data:
+                if obs.get("id") not in seen:
+                    seen.add(obs.get("id"))
+                    merged.append(
+                        obs if obs.get("place_id") is not None else {**obs, "place_id": place})
+        return _build_observations(merged[:num_max], validate)
+
+
+async def get_place_ids(
+    place_name: str, client: Optional[AsyncNatusferaClient] = None
+) -> List[int]:
+    """Async version of get_place_ids, sharing its cache."""
+    place_ids = _cached_place_ids(place_name)
+    if place_ids is None:
+        url = _place_url(place_name)
+        async with _client(client) as client:
+            page = await client.get(url)
+        place_ids = _place_ids(place_name, url, page)
+    return place_ids
+
+
+async def _request(
+    client: AsyncNatusferaClient,
+    arg_url: str,
+    num_max: Optional[int] = None,
+    max_workers: int = MAX_WORKERS,
+) -> List[Dict[str, Any]]:
+    """
+    Internal function that returns the raw observations of a query, up to
+    `num_max`. After the first page, the following ones are requested
+    `max_workers` at a time until a short page is found.
+    """
+    page = await client.get(arg_url)
+    if page.status_code == 404:
+        raise ValueError("Not found")
+    _raise_for_error(page.status_code, arg_url)
+    if page.status_code != 200:
+        return []
+    data = page.json()
+    if type(data) is dict:
+        return [data]
+
+    observations = list(data)
+    last_page = MAX_PAGES
+    if num_max is not None:
+        last_page = min(MAX_PAGES, -(-num_max // PER_PAGE))
+    next_page = 2
+    short = len(data) < PER_PAGE
+    while not short and next_page <= last_page:
+        pages = range(next_page, min(next_page + max(1, max_workers), last_page + 1))
+        for data in await asyncio.gather(
+            *(_get_page(client, f"{arg_url}&page={number}") for number in pages)
+        ):
+            observations.extend(data)
+            if len(data) < PER_PAGE:
+                short = True
+                break
+        next_page = pages[-1] + 1
+    if not short and next_page > MAX_PAGES:
+        print("WARNING: Only the first 20,000 results are displayed")
+
+    return observations[:num_max]
+
+
+async def _get_page(client: AsyncNatusferaClient, url: str) -> List[Dict[str, Any]]:
+    page = await client.get(url)
+    if page.status_code != 200:
+        _raise_for_error(page.status_code, url, always=True)
+    data = page.json()
+    if type(data) is not list:
+        data = []
+    return data
+
+
+async def extra_info(
+    df_observations: pd.DataFrame,
+    max_workers: int = 8,
+    use_cache: bool = True,
+    client: Optional[AsyncNatusferaClient] = None,
+) -> pd.DataFrame:
+    """
+    Async version of extra_info, sharing its cache of identifications:
+    up to `max_workers` observations are requested at the same time.
+    """
+    ids = df_observations["id"].drop_duplicates().to_list()
+    infos = _cached_identifications(ids) if use_cache else {}
+    missing = [id_num for id_num in ids if id_num not in infos]
+
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def fetch(id_num: int) -> List[Any]:
+        async with semaphore:
+            page = await client.get(f"{mecoda_nat.API_URL}/observations/{id_num}.json")
+        return _identification_info(page.json())
+
+    async with _client(client) as client:
+        fetched = dict(zip(missing, await asyncio.gather(*map(fetch, missing))))
+    _cache_identifications(fetched)
+    infos.update(fetched)
+
+    return _identification_columns(df_observations, infos)
+
+
+async def get_dwc(
+    observations: List,
+    chunk_size: int = 1,
+    max_workers: int = 8,
+    client: Optional[AsyncNatusferaClient] = None,
+) -> pd.DataFrame:
+    """
+    Async version of get_dwc: up to `max_workers` requests at the same time.
+    The documents are parsed in a thread, outside of the event loop.
+    """
+    id_obs = [observation.id for observation in observations]
+    chunk_size = max(1, chunk_size)
+    urls = [
+        f"{mecoda_nat.API_URL}/observations.dwc"
+        f"?id={','.join(map(str, id_obs[i:i + chunk_size]))}"
+        for i in range(0, len(id_obs), chunk_size)
+    ]
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    loop = asyncio.get_running_loop()
+
+    async def read(url: str) -> pd.DataFrame:
+        async with semaphore:
+            page = await client.get(url)
+        return await loop.run_in_executor(None, _parse_dwc, page.content)
+
+    async with _client(client) as client:
+        frames = await asyncio.gather(*map(read, urls))
+    if not frames:
+        return pd.DataFrame()
+
+    return _clean_dwc(pd.concat(frames))
+
+
+async def download_photos(
+    df_photos: pd.DataFrame,
+    directorio: Optional[str] = "natusfera_photos",
+    size: str = "medium",
+    max_workers: int = 8,
+    max_per_host: int = 4,
+    overwrite: bool = False,
+    client: Optional[AsyncNatusferaClient] = None,
+) -> pd.DataFrame:
+    """
+    Async version of download_photos, with the same resuming of interrupted
+    downloads and summary of the outcome of each photo. The files are
+    prepared and written in the default executor of the loop.
+    """
+    loop = asyncio.get_running_loop()
+    urls, paths, hosts = await loop.run_in_executor(
+        None, _photo_targets, df_photos, directorio, size, overwrite)
+    workers = asyncio.Semaphore(max(1, max_workers))
+    semaphores = {host: asyncio.Semaphore(max_per_host) for host in set(hosts.values())}
+
+    async def download(url, path):
+        if not isinstance(url, str):
+            return _photo_result(path, url, "failed", error="missing url")
+        async with workers, semaphores[hosts[url]]:
+            return await _download_photo(client, url, path)
+
+    start = time.perf_counter()
+    async with _client(client) as client:
+        results = await asyncio.gather(*map(download, urls, paths))
+    elapsed = time.perf_counter() - start
+
+    return _photo_summary(df_photos, directorio, list(results), elapsed)
+
+
+async def _download_photo(client: AsyncNatusferaClient, url: str, path: str) -> Dict[str, Any]:
+    """
+    Internal function that downloads one photo into a temporary file that
+    is renamed when complete, so the folder never holds partial photos.
+    A photo already in the folder is skipped when a HEAD request confirms
+    its size.
+    """
+    aiohttp = _aiohttp()
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        if await loop.run_in_executor(None, os.path.exists, path):
+            with suppress(aiohttp.ClientError, asyncio.TimeoutError):
+                head = await client.head(url)
+                if await loop.run_in_executor(
+                        None, _is_complete, path, head.status_code, head.headers):
+                    return _photo_result(path, url, "skipped", start=start)
+
+        async with client.stream(url) as response:
+            if response.status != 200:
+                return _photo_result(
+                    path, url, "failed", error=f"HTTP {response.status}", start=start)
+
+            size = 0
+            out_file = await loop.run_in_executor(None, open, f"{path}.part", "wb")
+            try:
+                async for chunk in response.content.iter_chunked(65536):
+                    await loop.run_in_executor(None, out_file.write, chunk)
+                    size += len(chunk)
+            finally:
+                await loop.run_in_executor(None, out_file.close)
+            await loop.run_in_executor(None, os.replace, f"{path}.part", path)
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+        return _photo_result(path, url, "failed", error=str(e), start=start)
+
+    return _photo_result(path, url, "downloaded", size, start=start)
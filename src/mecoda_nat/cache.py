@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Persistent cache of the answers of the API
+
+# Seconds an answer is valid, by endpoint. Endpoints not listed are not cached.
+DEFAULT_TTL = {
+    "observations": 3600,
+    "dwc": 3600,
+    "projects": 86400,
+    "taxa": 86400,
+    "places": 7 * 86400,
+}
+DEFAULT_PATH = os.path.join("~", ".cache", "mecoda_nat", "responses.sqlite")
+
+# (read, write) mode of the caches in the current context, set by
+# ResponseCache.bypass and ResponseCache.refresh
+_MODE: ContextVar[Tuple[bool, bool]] = ContextVar("cache_mode", default=(True, True))
+
+
+def endpoint(url: str) -> Optional[str]:
+    """Name of the API endpoint of a url, as used in the TTL table."""
+    path = urlsplit(url).path
+    if path.endswith(".dwc"):
+        return "dwc"
+    for name in ["observations", "projects", "taxa", "places"]:
+        if path == f"/{name}" or path.startswith((f"/{name}.", f"/{name}/")):
+            return name
+    return None
+
+
+def normalize_url(url: str) -> str:
+    """Url with its query arguments sorted, so equal queries share a key."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{parts.scheme}://{parts.netloc}{parts.path}?{query}"
+
+
+class ResponseCache:
+    """
+    Stores successful API answers in a SQLite file keyed by normalized url.
+    Each answer expires after the TTL of its endpoint and, when the stored
+    content exceeds `max_bytes`, the least recently used answers are
+    evicted. Hits and misses are counted in `hits` and `misses`. The size
+    of the stored content is kept as a running total, loaded when the
+    cache is opened.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        ttl: Optional[Dict[str, float]] = None,
+        max_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.path = os.path.expanduser(path)
+        self.ttl = dict(DEFAULT_TTL, **(ttl or {}))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " url TEXT PRIMARY KEY, status INTEGER, headers TEXT,"
+                " content BLOB, size INTEGER, expires REAL, accessed REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def cacheable(self, url: str) -> bool:
+        return bool(self.ttl.get(endpoint(url)))
+
+    def get(self, url: str) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        """Stored (status, headers, content) of a url, if still valid."""
+        if not _MODE.get()[0]:
+            return None
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, content FROM responses"
+                " WHERE url = ? AND expires > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._db:
+                self._db.execute(
+                    "UPDATE responses SET accessed = ? WHERE url = ?", (now, key))
+        status, headers, content = row
+        return status, json.loads(headers), content
+
+    def set(self, url: str, status: int, headers: Dict[str, str], content: bytes):
+        if not _MODE.get()[1] or not self.cacheable(url):
+            return
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock, self._db:
+            replaced = self._db.execute(
+                "SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, status, json.dumps(dict(headers)), content,
+                    len(content), now + self.ttl[endpoint(url)], now,
+                ),
+            )
+            self._size += len(content) - (replaced[0] if replaced else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Removes the expired answers and then the least recently used ones."""
+        now = time.time()
+        expired = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses WHERE expires <= ?",
+            (now,)).fetchone()[0]
+        self._db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        self._size -= expired
+        for url, size in self._db.execute(
+            "SELECT url, size FROM responses ORDER BY accessed").fetchall():
+            if self._size <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self._size -= size
+
+    @contextmanager
+    def bypass(self):
+        """
+        Neither read nor store answers inside the block. The mode applies to
+        the current thread or task, and to the workers the library starts
+        from it; blocks can be nested.
+        """
+        token = _MODE.set((False, False))
+        try:
+            yield self
+        finally:
+            _MODE.reset(token)
+
+    @contextmanager
+    def refresh(self):
+        """
+        Download again the answers requested inside the block and store
+        them, with the same scope as bypass.
+        """
+        token = _MODE.set((False, _MODE.get()[1]))
+        try:
+            yield self
+        finally:
+            _MODE.reset(token)
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses")
+            self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def close(self):
+        self._db.close()
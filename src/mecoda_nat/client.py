@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Optional, Tuple, Union
+import io
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from .cache import ResponseCache, endpoint
+from .metrics import Metrics, response_retries, response_size
+from .ratelimit import LimitedRetry, RateLimiter
+
+# HTTP client shared by all the requests made to the Natusfera API
+
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class NatusferaClient:
+    """
+    Keeps a pooled `requests.Session` so that consecutive and concurrent
+    requests reuse open connections instead of paying a new TCP and TLS
+    handshake each time. Failed requests with a status in RETRY_STATUS
+    are retried with exponential backoff, honoring `Retry-After`.
+    With a `cache`, the answers of the API endpoints are served from it
+    while they are valid. With `metrics`, every request and processing
+    stage is recorded in it. The requests to the network go through a
+    RateLimiter, which adapts the requests in flight to the answers of the
+    API; `rate_limiter=True` creates one with the default limits and
+    `False` disables it. Concurrent functions can ask for more workers than
+    the limiter admits, the extra ones wait for their turn.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 10,
+        pool_maxsize: int = 16,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        timeout: Union[float, Tuple[float, float]] = (10, 60),
+        verify: bool = False,
+        cache: Optional[ResponseCache] = None,
+        metrics: Optional[Metrics] = None,
+        rate_limiter: Union[RateLimiter, bool] = True,
+    ):
+        self.timeout = timeout
+        self.verify = verify
+        self.cache = cache
+        self.metrics = metrics
+        if rate_limiter is True:
+            rate_limiter = RateLimiter()
+        self.rate_limiter = rate_limiter or None
+        self.session = requests.Session()
+        retry = LimitedRetry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        retry.rate_limiter = self.rate_limiter
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET request through the pooled session with the client defaults."""
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", self.verify)
+        return self._measure(self._get, url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        """HEAD request through the pooled session, limited as get but not cached."""
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", self.verify)
+        kwargs.setdefault("allow_redirects", True)
+        return self._measure(self._fetch, url, method="HEAD", **kwargs)
+
+    def _measure(self, send, url: str, **kwargs) -> requests.Response:
+        """Sends the request with `send` and records it in the metrics, if any."""
+        if self.metrics is None:
+            return send(url, **kwargs)
+
+        start = time.perf_counter()
+        response = send(url, **kwargs)
+        self.metrics.on_request(
+            endpoint(url) or "other",
+            response.status_code,
+            time.perf_counter() - start,
+            response_size(response, kwargs.get("stream", False)),
+            response_retries(response),
+            getattr(response, "from_cache", False),
+        )
+        return response
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        if self.cache is None or not self.cache.cacheable(url):
+            return self._fetch(url, **kwargs)
+
+        cached = self.cache.get(url)
+        if cached is not None:
+            return _cached_response(url, *cached)
+        response = self._fetch(url, **kwargs)
+        if response.status_code == 200:
+            # the stored body is already decoded
+            headers = {
+                key: value for key, value in response.headers.items()
+                if key.lower() not in ("content-encoding", "transfer-encoding")
+            }
+            self.cache.set(url, 200, headers, response.content)
+            if kwargs.get("stream"):
+                # the body was read to store it, serve it again from memory
+                return _cached_response(
+                    url, 200, headers, response.content, from_cache=False)
+        return response
+
+    def _fetch(self, url: str, method: str = "GET", **kwargs) -> requests.Response:
+        """
+        Request to the network. The requests to the API endpoints are made
+        within the limits of the rate limiter, each attempt with its own
+        slot, which is freed while waiting to retry; other urls, like those
+        of the photos, are not limited.
+        """
+        if self.rate_limiter is None or endpoint(url) is None:
+            return self.session.request(method, url, **kwargs)
+        with self.rate_limiter.request() as slot:
+            response = self.session.request(method, url, **kwargs)
+            slot["status"] = response.status_code
+            slot["retry_after"] = response.headers.get("Retry-After")
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor whose tasks run in a copy of the context of the
+    thread that submits them, so that the modes set with
+    ResponseCache.bypass and ResponseCache.refresh apply to the workers.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(copy_context().run, fn, *args, **kwargs)
+
+
+def _cached_response(url, status, headers, content, from_cache=True) -> requests.Response:
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = content
+    response._content_consumed = True
+    response.raw = io.BytesIO(content)
+    response.from_cache = from_cache
+    return response
+
+
+_client: Optional[NatusferaClient] = None
+
+
+def get_client() -> NatusferaClient:
+    """Return the client used by the library, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = NatusferaClient()
+    return _client
+
+
+def set_client(client: NatusferaClient):
+    """Replace the client used by the library, e.g. to tune pools or timeouts."""
+    global _client
+    _client = client
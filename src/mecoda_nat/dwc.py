@@ -0,0 +1,153 @@
+from typing import IO, Dict, Iterator, List, Optional, Sequence
+from xml.etree.ElementTree import iterparse
+import os
+import shutil
+import tempfile
+import pandas as pd
+from .export import to_arrow
+
+# Incremental parsing and writing of the DarwinCore documents of the API
+
+
+def iter_dwc_records(source: IO[bytes]) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Parse a DarwinCore document as its bytes are read from `source` and
+    yield each record as a dictionary {field: text}, with the namespace
+    prefixes removed. Every record is released once yielded, so memory does
+    not grow with the size of the document.
+    """
+    root = None
+    depth = 0
+    for event, elem in iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1:
+            record = {_local_name(key): value for key, value in elem.attrib.items()}
+            for child in elem:
+                record[_local_name(child.tag)] = child.text
+            yield record
+            root.clear()
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+class DwcColumns:
+    """
+    Column buffers filled record by record. A column that first appears
+    in a later record is backfilled with missing values.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, List[Optional[str]]] = {}
+        self.rows = 0
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def append(self, record: Dict[str, Optional[str]]):
+        for name in record:
+            if name not in self.columns:
+                self.columns[name] = [None] * self.rows
+        for name, values in self.columns.items():
+            values.append(record.get(name))
+        self.rows += 1
+
+    def to_frame(self, infer_types: bool = True) -> pd.DataFrame:
+        """
+        Dataframe with the buffered records. With `infer_types` the columns
+        of numbers and of true/false values are converted, as `pd.read_xml`
+        does, otherwise the values are kept as text.
+        """
+        df = pd.DataFrame(self.columns, columns=list(self.columns))
+        if infer_types:
+            for name in df.columns:
+                df[name] = _infer_type(df[name])
+        return df
+
+
+def _infer_type(values: pd.Series) -> pd.Series:
+    try:
+        return pd.to_numeric(values)
+    except (TypeError, ValueError):
+        pass
+    lowered = values.str.lower()
+    found = set(lowered.dropna())
+    if found and found <= {"true", "false"}:
+        return lowered.map({"true": True, "false": False})
+    return values
+
+
+class DwcWriter:
+    """
+    Writes dataframes of DarwinCore records to a CSV or Parquet file,
+    chosen by the extension of `path`. The fields of the records vary
+    between pages, so the frames are spooled to a temporary folder next to
+    `path` and close() writes the file with the union of their columns, in
+    order of appearance. With `columns` the layout is given instead and the
+    frames are written as they come. Parquet columns get the types of
+    export.arrow_schema, so the schema does not depend on the values of
+    each page.
+    """
+
+    def __init__(self, path: str, columns: Optional[Sequence[str]] = None):
+        if not path.endswith((".csv", ".parquet")):
+            raise ValueError("The output must be a .csv or .parquet file")
+        self.path = path
+        self.columns: List[str] = list(columns) if columns is not None else []
+        self._fixed = columns is not None
+        self._spool: Optional[str] = None
+        self._parts: List[str] = []
+        self._written = False
+        self._parquet = None
+
+    def write(self, df: pd.DataFrame):
+        if self._fixed:
+            self._append(df)
+            return
+        if self._spool is None:
+            self._spool = tempfile.mkdtemp(
+                prefix=".dwc-", dir=os.path.dirname(os.path.abspath(self.path)))
+        self.columns += [name for name in df.columns if name not in self.columns]
+        part = os.path.join(self._spool, f"{len(self._parts)}.pkl")
+        df.to_pickle(part)
+        self._parts.append(part)
+
+    def _append(self, df: pd.DataFrame):
+        df = df.reindex(columns=self.columns)
+
+        if self.path.endswith(".csv"):
+            df.to_csv(
+                self.path,
+                mode="a" if self._written else "w",
+                header=not self._written,
+                index=False,
+            )
+        else:
+            table = to_arrow(df, "dwc")
+            if self._parquet is None:
+                # to_arrow has already checked that pyarrow is installed
+                import pyarrow.parquet
+
+                self._parquet = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        self._written = True
+
+    def close(self):
+        if self._spool is not None:
+            try:
+                for part in self._parts:
+                    self._append(pd.read_pickle(part))
+            finally:
+                shutil.rmtree(self._spool, ignore_errors=True)
+                self._spool = None
+                self._parts = []
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
@@ -0,0 +1,231 @@
+from typing import Dict, List, Optional, Sequence
+import pandas as pd
+from .models import TAXON_LEVELS
+
+# Columnar export of the dataframes of observations, photos and DarwinCore
+# records to Arrow tables and Parquet files (requires pyarrow)
+
+# Type of each column by kind of dataframe. "category" columns are
+# dictionary encoded; columns not listed are stored as strings.
+COLUMN_TYPES: Dict[str, Dict[str, str]] = {
+    "observations": {
+        "id": "int64",
+        "captive": "bool",
+        "created_at": "timestamp",
+        "updated_at": "timestamp",
+        "observed_on": "timestamp",
+        "description": "string",
+        "iconic_taxon": "category",
+        "taxon_id": "int64",
+        "taxon_name": "string",
+        "latitude": "float64",
+        "longitude": "float64",
+        "place_name": "string",
+        "place_id": "int64",
+        "quality_grade": "category",
+        "user_id": "int64",
+        "user_login": "category",
+        "num_identification_agreements": "int64",
+        "num_identification_disagreements": "int64",
+        "identifications_count": "int64",
+        "id_please": "bool",
+        **{level: "category" for level in TAXON_LEVELS},
+    },
+    "photos": {
+        "id": "int64",
+        "photos.id": "int64",
+        "iconic_taxon": "category",
+        "taxon_name": "string",
+        "photos.medium_url": "string",
+        "user_login": "category",
+        "latitude": "float64",
+        "longitude": "float64",
+        "path": "string",
+    },
+    "dwc": {
+        "catalogNumber": "int64",
+        "decimalLatitude": "float64",
+        "decimalLongitude": "float64",
+        "coordinateUncertaintyInMeters": "float64",
+        "basisOfRecord": "category",
+        "institutionCode": "category",
+        "collectionCode": "category",
+        "datasetName": "category",
+        "license": "category",
+        "countryCode": "category",
+        "taxonRank": "category",
+        "recordedBy": "category",
+        **{level: "category" for level in TAXON_LEVELS},
+    },
+}
+# Column with the date from which the year partition is taken
+YEAR_COLUMNS = {"observations": "observed_on", "dwc": "eventDate"}
+PARTITION_TYPES = {"year": "int64"}
+# Texts that are missing values, as get_dfs formats the missing ids as "nan"
+MISSING_TEXTS = ["", "nan"]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The Arrow and Parquet functions require pyarrow")
+    return pyarrow
+
+
+def arrow_schema(kind: str, columns: Sequence[str] = ()):
+    """
+    Arrow schema of a kind of dataframe: "observations" or "photos" as
+    returned by get_dfs, or "dwc" as returned by get_dwc_from_query. The
+    observations and photos schemas always have their own columns, in
+    order, followed by the other `columns`; DwC frames have varying
+    fields, so their schema has the given `columns`. Other columns are
+    strings, except the year partition.
+    """
+    if kind not in COLUMN_TYPES:
+        raise ValueError(f"The kind must be one of {', '.join(COLUMN_TYPES)}")
+    pa = _pyarrow()
+    arrow_types = {
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "bool": pa.bool_(),
+        "string": pa.string(),
+        "timestamp": pa.timestamp("ns"),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+    }
+    types = COLUMN_TYPES[kind]
+    names = [] if kind == "dwc" else list(types)
+    names += [name for name in columns if name not in names]
+    return pa.schema(
+        [
+            (name, arrow_types[types.get(name, PARTITION_TYPES.get(name, "string"))])
+            for name in names
+        ]
+    )
+
+
+def to_arrow(df: pd.DataFrame, kind: str = "observations", errors: str = "raise"):
+    """
+    Function to convert a dataframe of observations, photos or DwC records
+    to an Arrow table with the stable schema of `arrow_schema`. Values that
+    do not fit the type of their column (e.g. an id that is not a whole
+    number) raise ValueError; with `errors="coerce"` they are stored as
+    nulls and their number is reported in a warning. The texts in
+    MISSING_TEXTS are missing values.
+    """
+    if errors not in ("raise", "coerce"):
+        raise ValueError("errors must be 'raise' or 'coerce'")
+    pa = _pyarrow()
+    schema = arrow_schema(kind, list(df.columns))
+    arrays = []
+    for field in schema:
+        if field.name in df.columns:
+            arrays.append(_arrow_column(pa, df[field.name], field, errors))
+        else:
+            arrays.append(pa.nulls(len(df), field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _arrow_column(pa, values: pd.Series, field, errors: str = "raise"):
+    arrow_type = field.type
+    if pa.types.is_dictionary(arrow_type):
+        return _arrow_column(pa, values, pa.field(field.name, pa.string())).dictionary_encode()
+    if pa.types.is_integer(arrow_type):
+        numbers = pd.to_numeric(values, errors="coerce")
+        numbers = numbers.where(numbers.round() == numbers)
+        values = _checked(field.name, values, numbers, errors).astype("Int64")
+    elif pa.types.is_floating(arrow_type):
+        values = _checked(
+            field.name, values, pd.to_numeric(values, errors="coerce"), errors)
+    elif pa.types.is_timestamp(arrow_type):
+        values = _checked(
+            field.name, values, pd.to_datetime(values, errors="coerce"), errors)
+    elif pa.types.is_boolean(arrow_type):
+        values = values.astype(object).where(values.notna(), None)
+    else:
+        values = values.astype("string")
+    return pa.array(values, type=arrow_type, from_pandas=True)
+
+
+def _checked(name: str, values: pd.Series, converted: pd.Series, errors: str) -> pd.Series:
+    """
+    Internal function that checks the values lost converting a column:
+    given in the frame, and not in MISSING_TEXTS, but missing once converted.
+    """
+    missing = values.isna() | values.map(lambda value: value in MISSING_TEXTS)
+    lost = ~missing & converted.isna()
+    if lost.any():
+        message = (
+            f"{lost.sum()} values of {name} do not fit its type,"
+            f" e.g. {values[lost].iloc[0]!r}"
+        )
+        if errors == "raise":
+            raise ValueError(message)
+        print(f"WARNING: {message}, they are stored as nulls")
+    return converted
+
+
+def to_parquet(
+    df: pd.DataFrame,
+    path: str,
+    kind: str = "observations",
+    partition_by: Optional[List[str]] = None,
+    errors: str = "raise",
+) -> str:
+    """
+    Function to write a dataframe of observations, photos or DwC records to
+    Parquet with the schema and `errors` of `to_arrow`. With `partition_by` (e.g.
+    ["year", "iconic_taxon"]) `path` is a directory with one subdirectory
+    per value; "year" is taken from the date of observation when the frame
+    does not have that column. Returns the path.
+    """
+    pa = _pyarrow()
+    table = to_arrow(df, kind, errors)
+    if not partition_by:
+        pa.parquet.write_table(table, path)
+        return path
+
+    for column in partition_by:
+        if column in table.column_names:
+            continue
+        if column != "year" or kind not in YEAR_COLUMNS:
+            raise ValueError(f"The {kind} frame has no {column} to partition by")
+        dates = df.get(YEAR_COLUMNS[kind], pd.Series(None, index=df.index, dtype=object))
+        years = pd.to_datetime(
+            dates.astype("string").str[:10], format="%Y-%m-%d", errors="coerce").dt.year
+        table = table.append_column(
+            "year", pa.array(years.astype("Int64"), type=pa.int64(), from_pandas=True))
+    pa.parquet.write_to_dataset(
+        table, path, partition_cols=partition_by, existing_data_behavior="delete_matching")
+    return path
+
+
+def read_parquet(
+    path: str,
+    kind: str = "observations",
+    columns: Optional[List[str]] = None,
+    filters=None,
+) -> pd.DataFrame:
+    """
+    Function to load a file or partitioned directory written by to_parquet,
+    memory-mapping the files, with the types of `arrow_schema`: the
+    dictionary encoded columns are loaded as categoricals. `columns` and
+    `filters` (e.g. [("year", "=", 2020)]) are passed to pyarrow, so only
+    the selected columns and partitions are read.
+    """
+    pa = _pyarrow()
+    import pyarrow.dataset
+
+    table = pa.parquet.read_table(
+        path,
+        columns=columns,
+        filters=filters,
+        memory_map=True,
+        # partitions without value (e.g. no date) are not loaded as
+        # dictionaries, which pyarrow cannot combine with nulls
+        partitioning=pyarrow.dataset.HivePartitioning.discover(infer_dictionary=False),
+    )
+    schema = arrow_schema(kind, table.column_names)
+    schema = pa.schema([field for field in schema if field.name in table.column_names])
+    return table.select(schema.names).cast(schema).to_pandas()
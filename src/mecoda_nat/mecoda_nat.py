@@ -1,20 +1,80 @@
-from datetime import date
-from .models import Project, Observation, TAXONS, ICONIC_TAXON, Photo
-from typing import List, Dict, Any, Union, Optional
+from datetime import date, datetime, timedelta
+from .models import Project, Observation, TAXONS, ICONIC_TAXON, TAXON_LEVELS, Photo
+from .cache import endpoint
+from .client import ContextThreadPoolExecutor, get_client
+from .dwc import DwcColumns, DwcWriter, iter_dwc_records
+from .taxa import load_taxon_tree
+from typing import List, Dict, Any, Iterator, Tuple, Union, Optional, get_args, get_origin, get_type_hints
 import requests
 from contextlib import suppress
 import urllib3
 import pandas as pd
+import io
 import os
 import shutil
+import threading
+import time
 import numpy as np
-import pkg_resources
+from functools import lru_cache
+from collections import OrderedDict, deque
+from urllib.parse import quote, urlparse
 
 
 urllib3.disable_warnings()
 
+
+def _field_types(model) -> Dict[str, Any]:
+    """
+    Internal function that returns the type of each field of a model, in
+    order and without Optional, read from its annotations so that it does
+    not depend on the version of pydantic.
+    """
+    hints = get_type_hints(model)
+    types = {}
+    for name in model.__annotations__:
+        args = [arg for arg in get_args(hints[name]) if arg is not type(None)]
+        types[name] = args[0] if get_origin(hints[name]) is Union and len(args) == 1 else hints[name]
+    return types
+
 # Variables
 API_URL = "https://natusfera.gbif.es"
+PER_PAGE = 200
+MAX_PAGES = 98  # the API does not serve results beyond the first 20,000
+MAX_WORKERS = 4  # pages requested concurrently
+PHOTO_SIZES = ["small", "medium", "large"]
+DWC_MAX_PAGES = 49
+SHARDS_START = date(1900, 1, 1)  # first day of the default date range of get_obs_sharded
+IDENTIFICATIONS_MAX = 100_000  # identification details kept by extra_info
+PLACES_MAX = 1_000  # place names whose ids are kept by get_place_ids
+
+OBSERVATION_TYPES = _field_types(Observation)
+PHOTO_TYPES = _field_types(Photo)
+# Columns of the observations dataframe, in the order of the model fields
+OBSERVATION_COLUMNS = [name for name in OBSERVATION_TYPES if name != "photos"]
+# Fields normalized by column by _columns_from_raw, by type in the model;
+# taxon_id is taken from the taxon of each observation instead
+INTEGER_FIELDS = [
+    name for name, type_ in OBSERVATION_TYPES.items() if type_ is int and name != "taxon_id"]
+FLOAT_FIELDS = [name for name, type_ in OBSERVATION_TYPES.items() if type_ is float]
+BOOLEAN_FIELDS = [name for name, type_ in OBSERVATION_TYPES.items() if type_ is bool]
+# Fields that construct keeps as they are given, checked by _needs_validation
+TEXT_FIELDS = [name for name, type_ in OBSERVATION_TYPES.items() if type_ is str]
+DATE_FIELDS = [name for name, type_ in OBSERVATION_TYPES.items() if type_ in (date, datetime)]
+# Strings accepted as booleans, as pydantic does
+BOOLEANS = {
+    **dict.fromkeys(["1", "on", "t", "true", "y", "yes"], True),
+    **dict.fromkeys(["0", "off", "f", "false", "n", "no"], False),
+}
+
+# Identification details by (API_URL, observation id), least recently used
+# first, filled by extra_info
+_IDENTIFICATIONS: "OrderedDict[Tuple[str, int], List[Any]]" = OrderedDict()
+_IDENTIFICATIONS_LOCK = threading.Lock()
+
+# Place ids by (API_URL, place name), least recently used first, filled by
+# get_place_ids
+_PLACES: "OrderedDict[Tuple[str, str], List[int]]" = OrderedDict()
+_PLACES_LOCK = threading.Lock()
 
 
 def get_project(project: Union[str, int]) -> List[Project]:
@@ -22,7 +82,7 @@ def get_project(project: Union[str, int]) -> List[Project]:
 
     if type(project) is int:
         url = f"{API_URL}/projects/{project}.json"
-        page = requests.get(url, verify=False)
+        page = get_client().get(url)
 
         if page.status_code == 404:
             print("Project ID not found")
@@ -33,7 +93,7 @@ def get_project(project: Union[str, int]) -> List[Project]:
 
     elif type(project) is str:
         url = f"{API_URL}/projects/search.json?q={project}"
-        page = requests.get(url, verify=False)
+        page = get_client().get(url)
         resultado = [Project(**proj) for proj in page.json()]
         return resultado
 
@@ -45,20 +105,27 @@ def get_obs(
     user: Optional[str] = None,
     taxon: Optional[str] = None,
     taxon_id: Optional[int] = None,
-    place_id: Optional[int] = None,
+    place_id: Optional[Union[int, List[int]]] = None,
     year: Optional[int] = None,
     num_max: Optional[int] = None,
     starts_on: Optional[str] = None,  # Must be observed on or after this date
     ends_on: Optional[str] = None,  # Must be observed on or before this date
-    created_on: Optional[str] = None # Day YYYY-MM-DD
+    created_on: Optional[str] = None, # Day YYYY-MM-DD
+    max_workers: int = MAX_WORKERS,
+    validate: bool = True,
+    place_name: Optional[str] = None,
 ) -> List[Observation]:
     """
-    Function to extract the observations and that supports different filters
+    Function to extract the observations and that supports different filters.
+    Once the first page shows there are more results, up to `max_workers`
+    pages are requested concurrently. `validate=False` skips the validation
+    of each observation, as in iter_obs. `place_id` can be a list of places
+    and `place_name` is resolved to the ids of the places with that name;
+    the observations of all the places are merged, see iter_obs.
     """
 
-    print("Generating list of observations:")
-
-    url = _build_url(
+    observations = []
+    for batch in iter_obs(
         query,
         id_project,
         id_obs,
@@ -67,16 +134,262 @@ def get_obs(
         taxon_id,
         place_id,
         year,
+        num_max,
         starts_on,
         ends_on,
         created_on,
-    )
-
-    observations = _request(url, num_max)
+        max_workers,
+        by_page=True,
+        validate=validate,
+        place_name=place_name,
+    ):
+        observations.extend(batch)
 
     return observations
 
 
+def iter_obs(
+    query: Optional[str] = None,
+    id_project: Optional[int] = None,
+    id_obs: Optional[int] = None,
+    user: Optional[str] = None,
+    taxon: Optional[str] = None,
+    taxon_id: Optional[int] = None,
+    place_id: Optional[Union[int, List[int]]] = None,
+    year: Optional[int] = None,
+    num_max: Optional[int] = None,
+    starts_on: Optional[str] = None,  # Must be observed on or after this date
+    ends_on: Optional[str] = None,  # Must be observed on or before this date
+    created_on: Optional[str] = None, # Day YYYY-MM-DD
+    max_workers: int = MAX_WORKERS,
+    by_page: bool = False,
+    raw: bool = False,
+    validate: bool = True,
+    place_name: Optional[str] = None,
+) -> Iterator[Union[Observation, Dict[str, Any], List]]:
+    """
+    Generator with the same filters as get_obs that yields the observations
+    as the pages arrive, or a list of observations per page with
+    `by_page=True`. Only the pages in flight are kept in memory.
+    With `raw=True` it yields the dictionaries returned by the API instead
+    of Observation objects, which get_dfs converts directly.
+    With `validate=False` the observations of each page are validated by
+    column and built without per-record validation, which is faster and
+    lighter for bulk workloads.
+    With a list of `place_id`s or a `place_name`, the places are requested
+    concurrently, up to `max_workers` at a time, and their observations are
+    merged without repetitions, place by place; each observation has the
+    place_id it was found in, unless the API gives its own.
+    """
+    def place_url(place: Optional[int]) -> str:
+        return _build_url(
+            query,
+            id_project,
+            id_obs,
+            user,
+            taxon,
+            taxon_id,
+            place,
+            year,
+            starts_on,
+            ends_on,
+            created_on,
+        )
+
+    if place_name is None and not isinstance(place_id, (list, tuple)):
+        batches = _iter_request(place_url(place_id), num_max, max_workers, raw, validate)
+    else:
+        place_ids = [] if place_id is None else (
+            [place_id] if isinstance(place_id, int) else list(place_id))
+        if place_name is not None:
+            place_ids += get_place_ids(place_name)
+        batches = _iter_places(
+            place_url, list(dict.fromkeys(place_ids)), num_max, max_workers, raw, validate)
+
+    for batch in batches:
+        if by_page:
+            yield batch
+        else:
+            yield from batch
+
+
+def get_place_ids(place_name: str) -> List[int]:
+    """
+    Function to obtain the ids of the places whose name matches
+    `place_name`. The answers are cached, so each name is only requested
+    once per session. Failed requests are not cached.
+    """
+    place_ids = _cached_place_ids(place_name)
+    if place_ids is None:
+        url = _place_url(place_name)
+        page = get_client().get(url)
+        place_ids = _place_ids(place_name, url, page)
+    return place_ids
+
+
+def _place_url(place_name: str) -> str:
+    return f"{API_URL}/places.json?q={quote(place_name, safe='')}"
+
+
+def _cached_place_ids(place_name: str) -> Optional[List[int]]:
+    """
+    Internal function that returns the ids of a place name already
+    requested to the current API_URL, or None.
+    """
+    with _PLACES_LOCK:
+        place_ids = _PLACES.get((API_URL, place_name))
+        if place_ids is None:
+            return None
+        _PLACES.move_to_end((API_URL, place_name))
+        return list(place_ids)
+
+
+def _place_ids(place_name: str, url: str, page) -> List[int]:
+    """
+    Internal function that takes the ids from an answer of places.json,
+    sync or async.
+    Only the ids of successful answers are cached, evicting the least
+    recently used names beyond PLACES_MAX.
+    """
+    _raise_for_error(page.status_code, url)
+    if page.status_code != 200:
+        return []
+    places = page.json()
+    if type(places) is not list:
+        return []
+    place_ids = [place["id"] for place in places if "id" in place]
+    with _PLACES_LOCK:
+        _PLACES[API_URL, place_name] = place_ids
+        _PLACES.move_to_end((API_URL, place_name))
+        while len(_PLACES) > PLACES_MAX:
+            _PLACES.popitem(last=False)
+    return list(place_ids)
+
+
+def _iter_places(
+    place_url,
+    place_ids: List[int],
+    num_max: Optional[int] = None,
+    max_workers: int = MAX_WORKERS,
+    raw: bool = False,
+    validate: bool = True,
+) -> Iterator[List[Observation]]:
+    """
+    Internal generator that downloads the observations of several places
+    in parallel and yields the observations of each place, in the order of
+    `place_ids`, without the ones already yielded for a previous place,
+    up to `num_max` in total.
+    """
+    build = _builder(raw, validate)
+
+    def fetch(place: int) -> List[Dict[str, Any]]:
+        return [
+            data if data.get("place_id") is not None else {**data, "place_id": place}
+            for batch in _iter_request(place_url(place), num_max, 1, raw=True)
+            for data in batch
+        ]
+
+    seen = set()
+    count = 0
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for data in executor.map(fetch, place_ids):
+            data = [obs for obs in data if obs.get("id") not in seen]
+            seen.update(obs.get("id") for obs in data)
+            if num_max is not None:
+                data = data[:num_max - count]
+            count += len(data)
+            yield build(data)
+            if num_max is not None and count >= num_max:
+                return
+
+
+def get_obs_sharded(
+    query: Optional[str] = None,
+    id_project: Optional[int] = None,
+    user: Optional[str] = None,
+    taxon: Optional[str] = None,
+    taxon_id: Optional[int] = None,
+    place_id: Optional[int] = None,
+    year: Optional[int] = None,
+    starts_on: Optional[str] = None,  # Must be observed on or after this date
+    ends_on: Optional[str] = None,  # Must be observed on or before this date
+    created_on: Optional[str] = None, # Day YYYY-MM-DD
+    max_workers: int = MAX_WORKERS,
+) -> List[Observation]:
+    """
+    Function to extract all the observations of a query beyond the limit of
+    20,000 results of the API. The observation dates are split in windows,
+    bisecting every window that reaches the page limit, and the windows are
+    downloaded in parallel. Observations without a date of observation are
+    not included, as they do not belong to any window.
+    """
+    if starts_on is None:
+        starts_on = date(year, 1, 1) if year is not None else SHARDS_START
+    if ends_on is None:
+        ends_on = date(year, 12, 31) if year is not None else date.today()
+
+    def window_url(d1: date, d2: date) -> str:
+        return _build_url(
+            query, id_project, None, user, taxon, taxon_id, place_id, year,
+            d1, d2, created_on,
+        )
+
+    windows = _plan_shards(
+        window_url, _as_date(starts_on), _as_date(ends_on), max_workers)
+
+    def fetch(window):
+        return [
+            obs for batch in _iter_request(window_url(*window), max_workers=1)
+            for obs in batch
+        ]
+
+    observations = {}
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for shard in executor.map(fetch, windows):
+            for obs in shard:
+                observations.setdefault(obs.id, obs)
+
+    return sorted(observations.values(), key=lambda obs: obs.id, reverse=True)
+
+
+def _plan_shards(
+    window_url, starts_on: date, ends_on: date, max_workers: int = MAX_WORKERS
+) -> List[Tuple[date, date]]:
+    """
+    Internal function that splits [starts_on, ends_on] in date windows whose
+    results fit in the pages served by the API. The last page of each
+    window is requested, all windows of a round at once, and the windows
+    where it is full are bisected for the next round. A probe that fails
+    after the retries of the client raises requests.HTTPError, as its
+    window could otherwise be taken as complete and lose its results.
+    """
+    planned = []
+    pending = [(starts_on, ends_on)]
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while pending:
+            probes = executor.map(
+                lambda window: _get_page(f"{window_url(*window)}&page={MAX_PAGES}"),
+                pending,
+            )
+            bisected = []
+            for (d1, d2), last_page in zip(pending, list(probes)):
+                if len(last_page) < PER_PAGE:
+                    planned.append((d1, d2))
+                elif d1 == d2:
+                    print(f"WARNING: Only the first 20,000 results of {d1} are displayed")
+                    planned.append((d1, d2))
+                else:
+                    middle = d1 + (d2 - d1) // 2
+                    bisected += [(d1, middle), (middle + timedelta(days=1), d2)]
+            pending = bisected
+
+    return sorted(planned)
+
+
+def _as_date(value: Union[str, date]) -> date:
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
 def _build_url(
     query: Optional[str] = None,
     id_project: Optional[int] = None,
@@ -133,227 +446,638 @@ def _build_url(
     return url
 
 
-def _build_observations(observations_data: List[Dict[str, Any]]) -> List[Observation]:
+def _build_observations(
+    observations_data: List[Dict[str, Any]], validate: bool = True
+) -> List[Observation]:
     """
     Inner function that takes a list of dictionaries and returns a list
-    of Observation objects.
+    of Observation objects. With `validate=False` the records are checked
+    column by column instead, see _construct_observations.
     """
-    observations = []
+    if not validate:
+        return _construct_observations(observations_data)
 
-    for data in observations_data:
+    return [Observation(**_normalize_observation(data)) for data in observations_data]
 
-        with suppress(KeyError):
-            if data["place_guess"] is not None:
-                data["place_name"] = data["place_guess"].replace(
-                    "\r\n", " ").strip()
 
-        with suppress(KeyError):
-            try:
-                data["taxon_id"] = int(data["taxon"]["id"])
-                data["taxon_name"] = data["taxon"]["name"]
-                data["taxon_ancestry"] = data["taxon"]["ancestry"]
-            except:
-                data["taxon_id"] = None
-                data["taxon_name"] = None
-                data["taxon_ancestry"] = None
+def _normalize_observation(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Internal function that returns the arguments of Observation for a raw
+    API observation in a single pass over its fields, without modifying it.
+    """
+    values = data.copy()
+    get = data.get
+
+    place_guess = get("place_guess")
+    if place_guess is not None:
+        values["place_name"] = place_guess.replace("\r\n", " ").strip()
+
+    (
+        values["taxon_id"], values["taxon_name"], values["taxon_ancestry"]
+    ) = _taxon_fields(get("taxon"))
+
+    if "photos" in data or "observation_photos" in data:
+        # validated into Photo objects with the observation
+        values["photos"] = [
+            {"id": id_, "large_url": large, "medium_url": medium, "small_url": small}
+            for id_, large, medium, small in _raw_photos(data)
+        ]
 
-        with suppress(KeyError):
-            lista_fotos = []
-            for observation_photo in data["photos"]:
-                lista_fotos.append(
-                    Photo(
-                        id=observation_photo["id"],
-                        large_url=observation_photo["large_url"],
-                        medium_url=observation_photo["medium_url"],
-                        small_url=observation_photo["small_url"],
-                    )
-                )
-            data["photos"] = lista_fotos
+    iconic_taxon = ICONIC_TAXON.get(get("iconic_taxon_id"))
+    if iconic_taxon is not None:
+        values["iconic_taxon"] = iconic_taxon
 
-        with suppress(KeyError):
-            lista_fotos = []
-            for observation_photo in data["observation_photos"]:
-                lista_fotos.append(
-                    Photo(
-                        id=observation_photo["id"],
-                        large_url=observation_photo["photo"]["large_url"],
-                        medium_url=observation_photo["photo"]["medium_url"],
-                        small_url=observation_photo["photo"]["small_url"],
-                    )
-                )
-            data["photos"] = lista_fotos
+    # removal of line breaks in the description field
+    description = get("description")
+    if description is not None:
+        values["description"] = description.replace("\r\n", " ")
 
-        with suppress(KeyError):
-            data["iconic_taxon"] = ICONIC_TAXON[data["iconic_taxon_id"]]
+    return values
 
-        # removal of line breaks in the description field
-        with suppress(KeyError):
-            if data["description"] is not None:
-                data["description"] = data["description"].replace("\r\n", " ")
 
-        observation = Observation(**data)
+def _construct_observations(observations_data: List[Dict[str, Any]]) -> List[Observation]:
+    """
+    Internal function that builds Observation objects for bulk workloads.
+    The records are normalized and validated a column at a time, raising
+    ValueError for the values pydantic would reject, and the models are
+    created with `construct`, skipping the validation of each record.
+    The records with values that construct would keep unconverted (see
+    _needs_validation) are validated one by one instead. The input
+    dictionaries are not modified.
+    """
+    columns, photos = _columns_from_raw(observations_data)
+    _validate_columns(observations_data, columns)
+    validated = _needs_validation(columns, photos)
+    for name in ["created_at", "updated_at"]:
+        columns[name] = _parse_column(name, columns[name], _parse_datetime)
+    columns["observed_on"] = _parse_column(
+        "observed_on", columns["observed_on"], date.fromisoformat)
+    photo = _constructor(Photo)
+    photo_fields = list(PHOTO_TYPES)
+    columns["photos"] = [
+        [photo(dict(zip(photo_fields, values))) for values in observation_photos]
+        for observation_photos in photos
+    ]
 
-        observations.append(observation)
+    observation = _constructor(Observation)
+    fields = list(OBSERVATION_TYPES)
+    return [
+        Observation(**_normalize_observation(data)) if validate
+        else observation(dict(zip(fields, values)))
+        for data, validate, values in zip(
+            observations_data, validated, zip(*(columns[name] for name in fields)))
+    ]
 
-    return observations
 
+def _needs_validation(columns: Dict[str, List], photos: List[List[tuple]]) -> List[bool]:
+    """
+    Internal function that tells, for each record normalized by
+    _columns_from_raw, if it has a value that pydantic would convert and
+    construct would not: a text field or a photo url that is not a
+    string, a date that is not a string nor a date, or a photo id that is
+    not an integer.
+    """
+    def other(values, types):
+        return [value is not None and not isinstance(value, types) for value in values]
+
+    checks = [other(columns[name], str) for name in TEXT_FIELDS]
+    checks += [other(columns[name], (str, date)) for name in DATE_FIELDS]
+    checks.append([
+        any(
+            id_ is not None and type(id_) is not int
+            or any(url is not None and not isinstance(url, str) for url in urls)
+            for id_, *urls in observation_photos
+        )
+        for observation_photos in photos
+    ])
+    return [any(row) for row in zip(*checks)]
+
+
+def _constructor(model):
+    """
+    Internal function that returns the `construct` of a model, without
+    validation, for dictionaries with every field of the model.
+    """
+    # every field is set, so all the instances can share the same set
+    fields_set = set(_field_types(model))
+    construct = getattr(model, "model_construct", None) or model.construct
+    return lambda values: construct(fields_set, **values)
 
-def _request(arg_url: str, num_max: Optional[int] = None) -> List[Observation]:
+
+def _validate_columns(observations_data: List[Dict[str, Any]], columns: Dict[str, List]):
     """
-    Internal function that performs the API request and returns
-    the list of Observation objects.
+    Internal function that checks the numeric and boolean columns normalized
+    by _columns_from_raw: a value given by the API that could not be
+    converted is an error, as it is for pydantic. Booleans given as 0 or 1
+    are converted.
     """
-    observations = []
-    n = 1
-    page = requests.get(arg_url, verify=False)
+    if any(value is None for value in columns["id"]):
+        raise ValueError("Observations without a valid id")
+    for name in INTEGER_FIELDS + FLOAT_FIELDS:
+        given = pd.Series([data.get(name) for data in observations_data], dtype=object)
+        invalid = given.notna() & pd.Series(columns[name], dtype=object).isna()
+        if invalid.any():
+            raise ValueError(f"Not a valid number in {name}: {given[invalid].iloc[0]!r}")
+    for name in BOOLEAN_FIELDS:
+        values = pd.Series(columns[name], dtype=object)
+        invalid = values.notna() & ~values.isin([True, False])
+        if invalid.any():
+            raise ValueError(f"Not a valid boolean in {name}: {values[invalid].iloc[0]!r}")
+        columns[name] = [None if value is None else bool(value) for value in columns[name]]
+
+
+def _parse_column(name: str, values: List[Any], parse) -> List[Any]:
+    try:
+        return [parse(value) if isinstance(value, str) else value for value in values]
+    except ValueError as error:
+        raise ValueError(f"Not a valid date in {name}: {error}") from None
+
+
+def _parse_datetime(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _iter_request(
+    arg_url: str,
+    num_max: Optional[int] = None,
+    max_workers: int = MAX_WORKERS,
+    raw: bool = False,
+    validate: bool = True,
+) -> Iterator[List[Observation]]:
+    """
+    Internal generator that performs the API request and yields the
+    Observation objects of each page, up to `num_max` in total, or the
+    raw observations with `raw=True`.
+    """
+    build = _builder(raw, validate)
+    metrics = get_client().metrics
+    page = get_client().get(arg_url)
 
     if page.status_code == 404:
         raise ValueError("Not found")
+    _raise_for_error(page.status_code, arg_url)
 
-    elif page.status_code == 200:
-        if type(page.json()) is dict:
-            observations.extend(_build_observations([page.json()]))
+    if page.status_code == 200:
+        data = _page_json(page)
+        if type(data) is dict:
+            yield build([data])
         else:
-            while len(page.json()) == 200:
-                observations.extend(_build_observations(page.json()))
-                n += 1
-                if n > 98:
-                    print("WARNING: Only the first 20,000 results are displayed")
-                    break
-                if num_max is not None and len(observations) >= num_max:
-                    break
-                url = f"{arg_url}&page={n}"
-                page = requests.get(url, verify=False)
-                print(f"Number of elements: {len(observations)}")
+            count = 0
+            for data in _iter_pages(arg_url, data, num_max, max_workers):
+                if metrics is not None:
+                    metrics.on_page(endpoint(arg_url) or "other", len(data))
+                observations = build(data)
+                if num_max is not None:
+                    observations = observations[:num_max - count]
+                count += len(observations)
+                yield observations
+                if num_max is not None and count >= num_max:
+                    return
+
+
+def _builder(raw: bool = False, validate: bool = True):
+    """
+    Internal function that returns the function that converts a page of raw
+    observations: kept as they are, validated or built column by column.
+    """
+    if raw:
+        return list
+    if validate:
+        return lambda data: _timed("build_observations", _build_observations, data)
+    return lambda data: _timed("construct_observations", _construct_observations, data)
 
-            observations.extend(_build_observations(page.json()))
 
-            if num_max:
-                observations = observations[:num_max]
+def _timed(stage: str, function, data):
+    """
+    Internal function that returns `function(data)`, recording its time and
+    the number of records of `data` as a stage in the metrics of the
+    client, when it has them.
+    """
+    metrics = get_client().metrics
+    if metrics is None:
+        return function(data)
+    start = time.perf_counter()
+    result = function(data)
+    metrics.on_stage(stage, time.perf_counter() - start, len(data))
+    return result
+
+
+def _page_json(page: requests.Response):
+    """Internal function that parses a JSON answer as the parse stage."""
+    metrics = get_client().metrics
+    if metrics is None:
+        return page.json()
+    start = time.perf_counter()
+    data = page.json()
+    records = len(data) if type(data) is list else 1
+    metrics.on_stage("parse", time.perf_counter() - start, records)
+    return data
 
-        print(f"Number of elements: {len(observations)}")
 
-    return observations
+def _iter_pages(
+    arg_url: str,
+    first_page: List[Dict[str, Any]],
+    num_max: Optional[int] = None,
+    max_workers: int = MAX_WORKERS,
+):
+    """
+    Internal generator that yields the raw pages of a paginated query in
+    order. The following pages are fetched by a pool of `max_workers`
+    threads that keeps a window of requests ahead of the page being
+    consumed; pending requests are cancelled as soon as a short page is
+    found or `num_max` results have been covered.
+    """
+    yield first_page
+    if len(first_page) < PER_PAGE:
+        return
+
+    last_page = MAX_PAGES
+    if num_max is not None:
+        last_page = min(MAX_PAGES, -(-num_max // PER_PAGE))
+
+    max_workers = max(1, max_workers)
+    next_page = 2
+    pending = deque()
+    executor = ContextThreadPoolExecutor(max_workers=max_workers)
+    fetch = _get_page
+    limiter = get_client().rate_limiter
+    if limiter is not None:
+        # the requests still waiting for the rate limiter are dropped
+        # when the query ends
+        stop = threading.Event()
+
+        def fetch(url):
+            with limiter.cancel_on(stop):
+                return _get_page(url)
+    try:
+        while next_page <= last_page and len(pending) < max_workers:
+            pending.append(executor.submit(fetch, f"{arg_url}&page={next_page}"))
+            next_page += 1
+
+        page_number = 1
+        while pending:
+            data = pending.popleft().result()
+            page_number += 1
+            yield data
+            if len(data) < PER_PAGE:
+                return
+            if next_page <= last_page:
+                pending.append(
+                    executor.submit(fetch, f"{arg_url}&page={next_page}"))
+                next_page += 1
+
+        if page_number == MAX_PAGES:
+            print("WARNING: Only the first 20,000 results are displayed")
+    finally:
+        for future in pending:
+            future.cancel()
+        if limiter is not None:
+            stop.set()
+        executor.shutdown(wait=False)
+
+
+def _get_page(url: str) -> List[Dict[str, Any]]:
+    """
+    Internal function that downloads one page of observations. An answer
+    other than 200 raises requests.HTTPError, as it would end the query
+    early; a 200 answer that is not a list is treated as an empty page.
+    """
+    page = get_client().get(url)
+    if page.status_code != 200:
+        _raise_for_error(page.status_code, url, always=True)
+    data = _page_json(page)
+    if type(data) is not list:
+        data = []
+    return data
+
+
+def _raise_for_error(status_code: int, url: str, always: bool = False):
+    """
+    Internal function that raises requests.HTTPError for an answer of the
+    API that is still overloaded or failing (429 or 5xx) after the retries
+    of the client, or for any answer other than 200 with `always=True`.
+    """
+    if always or status_code == 429 or status_code >= 500:
+        raise requests.HTTPError(f"HTTP {status_code} for url: {url}")
 
 
-def get_dfs(observations) -> pd.DataFrame:
+def get_dfs(
+    observations: List[Union[Observation, Dict[str, Any]]]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Function to extract dataframe from observations and dataframe from photos.
+    Takes Observation objects or the raw observations of the API, as yielded
+    by iter_obs with raw=True, which avoids building the models at all.
+    The frames are built column by column with vectorized conversions.
     """
-    df = pd.DataFrame([obs.dict() for obs in observations])
-    df["taxon_id"] = df["taxon_id"].astype(float).apply(lambda x: f"{x:.0f}")
+    metrics = get_client().metrics
+    start = time.perf_counter()
+    observations = list(observations)
+    if observations and isinstance(observations[0], dict):
+        columns, photos = _columns_from_raw(observations)
+    else:
+        columns, photos = _columns_from_models(observations)
 
-    df_observations = df.drop(["photos"], axis=1)
-    df_observations["created_at"] = (
-        df_observations["created_at"].apply(
-            lambda x: x.date()).astype("datetime64[ns]")
-    )
-    df_observations["updated_at"] = (
-        df_observations["updated_at"].apply(
-            lambda x: x.date()).astype("datetime64[ns]")
-    )
-    df_observations["observed_on"] = df_observations["observed_on"].astype(
-        "datetime64[ns]"
-    )
-    _get_taxon_columns(df_observations)
+    df = pd.DataFrame(columns, columns=OBSERVATION_COLUMNS)
+    df_observations = df.copy()
+    df_observations["taxon_id"] = _format_ids(df["taxon_id"])
+    for column in ["created_at", "updated_at", "observed_on"]:
+        df_observations[column] = _to_day(df[column])
+    _timed("taxon_columns", _get_taxon_columns, df_observations)
 
+    owners, photo_ids, photo_urls = _photo_columns(photos)
     df_photos = df[
-        [
-            "id",
-            "photos",
-            "iconic_taxon",
-            "taxon_name",
-            "user_login",
-            "latitude",
-            "longitude",
+        ["id", "iconic_taxon", "taxon_name", "user_login", "latitude", "longitude"]
+    ].take(owners).reset_index(drop=True)
+    df_photos.insert(1, "photos.id", _format_ids(pd.Series(photo_ids, dtype=object)))
+    df_photos.insert(4, "photos.medium_url", photo_urls)
+    df_photos["path"] = (
+        df_photos["id"].astype(str) + "_" + df_photos["photos.id"] + ".jpg"
+    )
+
+    if metrics is not None:
+        metrics.on_stage("get_dfs", time.perf_counter() - start, len(observations))
+    return df_observations, df_photos
+
+
+def _columns_from_models(observations: List[Observation]):
+    """
+    Internal function that reads the attributes of Observation objects
+    into one list per column, plus the photos of each observation.
+    """
+    columns = {
+        name: [getattr(obs, name) for obs in observations]
+        for name in OBSERVATION_COLUMNS
+    }
+    # ISO strings keep the day of each date in its own time zone and are
+    # much cheaper for pandas than time zone aware datetimes
+    for name in ["created_at", "updated_at", "observed_on"]:
+        columns[name] = [
+            value.isoformat() if value is not None else None
+            for value in columns[name]
         ]
-    ]
-    df_photos = df_photos.explode("photos").reset_index(drop=True)
-    df_photos["photos.id"] = df_photos.photos.str.get("id")
-    df_photos["photos.medium_url"] = df_photos.photos.str.get("medium_url")
-    df_photos = df_photos[
+    photos = [
         [
-            "id",
-            "photos.id",
-            "iconic_taxon",
-            "taxon_name",
-            "photos.medium_url",
-            "user_login",
-            "latitude",
-            "longitude",
+            (photo.id, photo.large_url, photo.medium_url, photo.small_url)
+            for photo in obs.photos
         ]
+        for obs in observations
     ]
-    df_photos["photos.id"] = (
-        df_photos["photos.id"].astype(float).apply(lambda x: f"{x:.0f}")
-    )
-    df_photos["path"] = (
-        df_photos["id"].astype(str) + "_" +
-        df_photos["photos.id"].astype(str) + ".jpg"
-    )
+    return columns, photos
 
-    return df_observations, df_photos
 
+def _columns_from_raw(observations: List[Dict[str, Any]]):
+    """
+    Internal function that normalizes raw API observations into one list
+    per column, with the same values _build_observations would produce,
+    plus the photos of each observation as (id, large, medium, small) urls.
+    """
+    columns = {
+        name: [data.get(name) for data in observations]
+        for name in OBSERVATION_COLUMNS
+    }
+
+    taxa = [_taxon_fields(data.get("taxon")) for data in observations]
+    (
+        columns["taxon_id"], columns["taxon_name"], columns["taxon_ancestry"]
+    ) = map(list, zip(*taxa)) if taxa else ([], [], [])
+
+    iconic_taxon = pd.Series(
+        [data.get("iconic_taxon_id") for data in observations], dtype=object
+    ).map(ICONIC_TAXON)
+    columns["iconic_taxon"] = (
+        iconic_taxon.fillna(pd.Series(columns["iconic_taxon"], dtype=object))
+        .tolist()
+    )
 
-def _get_taxon_columns(df_obs: pd.DataFrame):
-    file_path = pkg_resources.resource_filename(
-        "mecoda_nat", "data/taxon_tree.csv")
-    df_taxon = pd.read_csv(file_path)
-    df_obs["taxon_ancestry"] = df_obs["taxon_ancestry"].apply(
-        lambda x: _get_dict_taxon(x, df_taxon)
+    place_guess = pd.Series(
+        [data.get("place_guess") for data in observations], dtype=object)
+    place_name = (
+        place_guess.str.replace("\r\n", " ", regex=False).str.strip()
+        .where(place_guess.notna(), pd.Series(columns["place_name"], dtype=object))
     )
+    columns["place_name"] = _none_for_missing(place_name)
+
+    description = pd.Series(columns["description"], dtype=object)
+    columns["description"] = _none_for_missing(
+        description.str.replace("\r\n", " ", regex=False)
+        .where(description.notna()))
+
+    for name in INTEGER_FIELDS + FLOAT_FIELDS:
+        values = pd.to_numeric(
+            pd.Series(columns[name], dtype=object), errors="coerce")
+        if name in INTEGER_FIELDS:
+            # pydantic truncates the decimals of integer fields
+            values = np.trunc(values).astype("Int64")
+        columns[name] = _none_for_missing(values)
+    for name in BOOLEAN_FIELDS:
+        columns[name] = [
+            BOOLEANS.get(value.lower(), value) if isinstance(value, str) else value
+            for value in columns[name]
+        ]
 
-    for level in ["kingdom", "phylum", "class", "order", "family", "genus"]:
-        df_obs[level] = df_obs.taxon_ancestry.str.get(level)
-    df_obs.drop(columns=["taxon_ancestry"], inplace=True)
+    photos = [_raw_photos(data) for data in observations]
+    return columns, photos
 
 
-def _get_dict_taxon(ancestry_string, df_taxon):
+def _taxon_fields(taxon: Optional[Dict[str, Any]]):
     try:
-        data = {}
-        list_ancestries = ancestry_string.split("/")
-        for ancestry in list_ancestries:
-            if int(ancestry) != 1:
-                rank = df_taxon[df_taxon["id"] == int(ancestry)]["rank"].item()
-                name = df_taxon[df_taxon["id"] == int(ancestry)]["name"].item()
-                data[rank] = name
-    except:
-        data = None
+        return int(taxon["id"]), taxon["name"], taxon["ancestry"]
+    except (KeyError, TypeError, ValueError):
+        return None, None, None
 
-    return data
+
+def _raw_photos(data: Dict[str, Any]):
+    """
+    Internal function that returns the (id, large, medium, small) urls of
+    the photos of a raw observation, from observation_photos when they are
+    complete and from photos otherwise.
+    """
+    if "observation_photos" in data:
+        with suppress(KeyError):
+            return [
+                (
+                    photo["id"], photo["photo"]["large_url"],
+                    photo["photo"]["medium_url"], photo["photo"]["small_url"],
+                )
+                for photo in data["observation_photos"]
+            ]
+    return [
+        (
+            photo.get("id"), photo.get("large_url"),
+            photo.get("medium_url"), photo.get("small_url"),
+        )
+        for photo in data.get("photos", [])
+    ]
 
 
-def extra_info(df_observations) -> pd.DataFrame:
+def _photo_columns(photos_by_observation):
     """
-    Function to obtain extra information of each observation of a selection
-    (very expensive at the API level)
-    """
-    ids = df_observations["id"].to_list()
-    dic = {}
-
-    for id_num in ids:
-        url = f"{API_URL}/observations/{id_num}.json"
-        page = requests.get(url, verify=False)
-
-        idents = page.json()["identifications"]
-        if len(idents) > 0:
-            user_identification = idents[0]["user"]["login"]
-            first_taxon_name = idents[0]["taxon"]["name"]
-            last_taxon_name = idents[len(idents) - 1]["taxon"]["name"]
-            dic[id_num] = [user_identification,
-                           first_taxon_name, last_taxon_name]
-        else:
-            dic[id_num] = [0, 0, 0]
+    Internal function that flattens the photos of each observation into the
+    position of its observation, its id and its url. Observations without
+    photos keep one row with missing values, as DataFrame.explode does.
+    """
+    owners, photo_ids, photo_urls = [], [], []
+    for position, photos in enumerate(photos_by_observation):
+        photos = photos or [(None, None, None, None)]
+        owners.extend([position] * len(photos))
+        for photo_id, _, photo_url, _ in photos:
+            photo_ids.append(photo_id)
+            photo_urls.append(photo_url)
+    return owners, photo_ids, photo_urls
+
+
+def _none_for_missing(values: pd.Series) -> List[Any]:
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+def _format_ids(ids: pd.Series) -> pd.Series:
+    """
+    Internal function that formats numeric ids as strings without decimals,
+    with "nan" for the missing ones.
+    """
+    numbers = pd.to_numeric(ids, errors="coerce").round().astype("Int64")
+    return pd.Series(
+        np.where(numbers.isna(), "nan", numbers.astype(str)), index=ids.index)
 
-    df_observations["first_identification"] = df_observations["id"].apply(
-        lambda x: str(dic[x][0])
+
+def _to_day(values: pd.Series) -> pd.Series:
+    """
+    Internal function that converts ISO date or datetime strings to the day
+    in their own time zone, as datetime64 without time.
+    """
+    return pd.to_datetime(
+        values.astype(object).astype(str).str[:10], format="%Y-%m-%d", errors="coerce")
+
+
+def _get_taxon_columns(df_obs: pd.DataFrame):
+    """
+    Internal function that replaces the taxon_ancestry column with one column
+    per taxonomic level (kingdom to genus).
+    """
+    df_levels = _resolve_ancestries(df_obs["taxon_ancestry"])
+    for level in TAXON_LEVELS:
+        df_obs[level] = df_levels[level].to_numpy()
+    df_obs.drop(columns=["taxon_ancestry"], inplace=True)
+
+
+@lru_cache(maxsize=None)
+def _load_taxon_index() -> pd.DataFrame:
+    """
+    Internal function that loads the taxon tree once per process and
+    returns the name and rank of the taxa indexed by taxon id.
+    """
+    tree = load_taxon_tree()
+    return pd.DataFrame(
+        {"name": tree.names, "rank": tree.ranks(tree.ids)},
+        index=pd.Index(tree.ids.astype("int64"), name="id"),
     )
-    df_observations["first_taxon_name"] = df_observations["id"].apply(
-        lambda x: str(dic[x][1])
+
+
+def _resolve_ancestries(ancestries: pd.Series) -> pd.DataFrame:
+    """
+    Internal function that expands ancestry strings ("1/2/10/11") into a
+    dataframe with one column per taxonomic level, aligned with the input.
+    Each distinct ancestry is resolved once, in a single batched lookup.
+    Ancestries with an unknown or malformed id resolve to missing values.
+    """
+    df_taxon = _load_taxon_index()
+    unique = pd.Series(ancestries.dropna().unique(), dtype=object)
+
+    parts = unique.str.split("/").explode()
+    parts = pd.DataFrame({
+        "ancestry": unique.reindex(parts.index).to_numpy(),
+        "id": pd.to_numeric(parts, errors="coerce").to_numpy(),
+    })
+    parts = parts[parts["id"] != 1]
+    found = parts["id"].isin(df_taxon.index)
+    invalid = parts.loc[~found, "ancestry"].unique()
+
+    parts = parts[found & ~parts["ancestry"].isin(invalid)]
+    ids = parts["id"].astype("int64")
+    parts = parts.assign(
+        rank=df_taxon["rank"].reindex(ids).to_numpy(),
+        name=df_taxon["name"].reindex(ids).to_numpy(),
     )
-    df_observations["last_taxon_name"] = df_observations["id"].apply(
-        lambda x: str(dic[x][2])
+    parts = parts[parts["rank"].isin(TAXON_LEVELS)]
+    df_levels = (
+        parts.drop_duplicates(["ancestry", "rank"], keep="last")
+        .pivot(index="ancestry", columns="rank", values="name")
+        .reindex(columns=TAXON_LEVELS)
+        .astype(object)
     )
 
+    return df_levels.reindex(ancestries.to_numpy()).set_index(ancestries.index)
+
+
+def extra_info(
+    df_observations: pd.DataFrame,
+    max_workers: int = 8,
+    use_cache: bool = True,
+) -> pd.DataFrame:
+    """
+    Function to obtain extra information of each observation of a selection
+    (very expensive at the API level). The observations are requested
+    concurrently and their identification details are cached, so the ids
+    already seen in this session are not requested again.
+    """
+    ids = df_observations["id"].drop_duplicates().to_list()
+    infos = _cached_identifications(ids) if use_cache else {}
+    missing = [id_num for id_num in ids if id_num not in infos]
+
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        fetched = dict(zip(missing, executor.map(_get_identification_info, missing)))
+    _cache_identifications(fetched)
+    infos.update(fetched)
+
+    return _identification_columns(df_observations, infos)
+
+
+def _cached_identifications(ids: List[int]) -> Dict[int, List[Any]]:
+    """
+    Internal function that returns the identification details of the ids
+    already requested to the current API_URL.
+    """
+    infos = {}
+    with _IDENTIFICATIONS_LOCK:
+        for id_num in ids:
+            info = _IDENTIFICATIONS.get((API_URL, id_num))
+            if info is not None:
+                _IDENTIFICATIONS.move_to_end((API_URL, id_num))
+                infos[id_num] = info
+    return infos
+
+
+def _cache_identifications(infos: Dict[int, List[Any]]):
+    """
+    Internal function that stores identification details of the current
+    API_URL, evicting the least recently used beyond IDENTIFICATIONS_MAX.
+    """
+    with _IDENTIFICATIONS_LOCK:
+        for id_num, info in infos.items():
+            _IDENTIFICATIONS[API_URL, id_num] = info
+            _IDENTIFICATIONS.move_to_end((API_URL, id_num))
+        while len(_IDENTIFICATIONS) > IDENTIFICATIONS_MAX:
+            _IDENTIFICATIONS.popitem(last=False)
+
+
+def _identification_columns(
+    df_observations: pd.DataFrame, infos: Dict[int, List[Any]]
+) -> pd.DataFrame:
+    """
+    Internal function that adds the identification details of the
+    observations to their dataframe, with the columns that compare them.
+    """
+    df_info = pd.DataFrame.from_dict(
+        infos,
+        orient="index",
+        columns=["first_identification", "first_taxon_name", "last_taxon_name"],
+    ).astype(str)
+    df_info = df_info.reindex(df_observations["id"])
+
+    for column in df_info.columns:
+        df_observations[column] = df_info[column].to_numpy()
+
     df_observations["first_taxon_match"] = np.where(
         df_observations["first_taxon_name"] == df_observations["last_taxon_name"],
         "True",
@@ -368,28 +1092,181 @@ def extra_info(df_observations) -> pd.DataFrame:
     return df_observations
 
 
+def _get_identification_info(id_num: int) -> List[Any]:
+    """
+    Internal function that returns the user of the first identification and
+    the first and last identified taxon names of an observation.
+    """
+    url = f"{API_URL}/observations/{id_num}.json"
+    page = get_client().get(url)
+    return _identification_info(page.json())
+
+
+def _identification_info(data: Dict[str, Any]) -> List[Any]:
+    idents = data["identifications"]
+    if len(idents) > 0:
+        user_identification = idents[0]["user"]["login"]
+        first_taxon_name = idents[0]["taxon"]["name"]
+        last_taxon_name = idents[len(idents) - 1]["taxon"]["name"]
+        return [user_identification, first_taxon_name, last_taxon_name]
+    else:
+        return [0, 0, 0]
+
+
 def download_photos(
-    df_photos: pd.DataFrame, 
-    directorio: Optional[str] = "natusfera_photos"
-):
+    df_photos: pd.DataFrame,
+    directorio: Optional[str] = "natusfera_photos",
+    size: str = "medium",
+    max_workers: int = 8,
+    max_per_host: int = 4,
+    overwrite: bool = False,
+) -> pd.DataFrame:
     """
-    Function to download the photos resulting from the query.
+    Function to download the photos resulting from the query in small,
+    medium or large size. The downloads run concurrently, with at most
+    `max_per_host` connections to the same server. Photos already in the
+    folder whose size matches the Content-Length of a HEAD request are
+    skipped, so an interrupted download is resumed by calling the function
+    again; `overwrite=True` empties the
+    folder first. Returns a dataframe with the outcome of each photo, with
+    the totals of the download in its `attrs`.
     """
-    # Create the folder, if it exists overwrite it
-    if os.path.exists(directorio):
-        shutil.rmtree(directorio)
-    os.makedirs(directorio)
+    urls, paths, hosts = _photo_targets(df_photos, directorio, size, overwrite)
+    semaphores = {
+        host: threading.Semaphore(max_per_host) for host in set(hosts.values())}
+
+    def download(url, path):
+        if not isinstance(url, str):
+            return _photo_result(path, url, "failed", error="missing url")
+        with semaphores[hosts[url]]:
+            return _download_photo(url, path)
+
+    start = time.perf_counter()
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(executor.map(download, urls, paths))
+    elapsed = time.perf_counter() - start
 
-    # Iterate through the df_photos query result and download the photos in medium size
-    for i, row in df_photos.iterrows():
-        response = requests.get(row["photos.medium_url"], stream=True, verify=False)
-        if response.status_code == 200:
-            with open(f"{directorio}/{row['path']}", "wb") as out_file:
-                shutil.copyfileobj(response.raw, out_file)
-        del response
+    return _photo_summary(df_photos, directorio, results, elapsed)
+
+
+def _photo_summary(
+    df_photos: pd.DataFrame, directorio: str, results: List[Dict[str, Any]], elapsed: float
+) -> pd.DataFrame:
+    """
+    Internal function that returns the outcome of the downloads of
+    download_photos, with the number of photos of each status, the
+    megabytes downloaded and the throughput in its `attrs`, and adds the
+    absolute path of each photo to df_photos.
+    """
+    summary = pd.DataFrame(
+        results, columns=["path", "url", "status", "bytes", "seconds", "error"])
+    downloaded = summary[summary["status"] == "downloaded"]
+    megabytes = downloaded["bytes"].sum() / 1e6
+    for status in ["downloaded", "skipped", "failed"]:
+        summary.attrs[status] = int((summary["status"] == status).sum())
+    summary.attrs["megabytes"] = megabytes
+    summary.attrs["elapsed"] = elapsed
+    summary.attrs["throughput_mb_s"] = megabytes / elapsed if elapsed else 0.0
 
     # Even using .loc, we get a SettingWithCopyWarning message
-    df_photos.loc[:, "abs_path"] = os.path.abspath(f"{directorio}/{df_photos['path']}")
+    df_photos.loc[:, "abs_path"] = os.path.abspath(directorio) + os.sep + df_photos["path"]
+
+    return summary
+
+
+def _photo_targets(df_photos: pd.DataFrame, directorio: str, size: str, overwrite: bool):
+    """
+    Internal function that prepares the folder of download_photos and
+    returns the url and path of each photo, and the server of each url.
+    """
+    if size not in PHOTO_SIZES:
+        raise ValueError(f"size must be one of {PHOTO_SIZES}")
+
+    # Create the folder, empty it only when asked to
+    if overwrite and os.path.exists(directorio):
+        shutil.rmtree(directorio)
+    os.makedirs(directorio, exist_ok=True)
+
+    urls = _photo_urls(df_photos, size)
+    paths = [os.path.join(directorio, path) for path in df_photos["path"]]
+    hosts = {url: urlparse(url).netloc for url in urls.dropna().unique()}
+    return urls, paths, hosts
+
+
+def _photo_urls(df_photos: pd.DataFrame, size: str) -> pd.Series:
+    """
+    Internal function that returns the url of each photo in the given size,
+    derived from the medium one when the dataframe has no column for it.
+    The medium photo is kept, with a warning, when its url has no
+    "/medium/" to replace.
+    """
+    column = f"photos.{size}_url"
+    if column in df_photos.columns:
+        return df_photos[column]
+    medium = df_photos["photos.medium_url"]
+    if size == "medium":
+        return medium
+    missing = (~medium.str.contains("/medium/", regex=False, na=True)).sum()
+    if missing:
+        print(f"WARNING: {missing} photos have no {size} url, they are downloaded in medium size")
+    return medium.str.replace("/medium/", f"/{size}/", regex=False)
+
+
+def _download_photo(url: str, path: str) -> Dict[str, Any]:
+    """
+    Internal function that downloads one photo into a temporary file that
+    is renamed when complete, so the folder never holds partial photos.
+    A photo already in the folder is skipped when a HEAD request confirms
+    its size.
+    """
+    start = time.perf_counter()
+    try:
+        if os.path.exists(path):
+            with suppress(requests.RequestException):
+                head = get_client().head(url)
+                if _is_complete(path, head.status_code, head.headers):
+                    return _photo_result(path, url, "skipped", start=start)
+
+        with get_client().get(url, stream=True) as response:
+            if response.status_code != 200:
+                return _photo_result(
+                    path, url, "failed", error=f"HTTP {response.status_code}",
+                    start=start)
+
+            size = 0
+            with open(f"{path}.part", "wb") as out_file:
+                for chunk in response.iter_content(chunk_size=65536):
+                    out_file.write(chunk)
+                    size += len(chunk)
+            os.replace(f"{path}.part", path)
+    except (requests.RequestException, OSError) as e:
+        return _photo_result(path, url, "failed", error=str(e), start=start)
+
+    return _photo_result(path, url, "downloaded", size, start=start)
+
+
+def _is_complete(path: str, status_code: int, headers) -> bool:
+    """
+    Internal function that tells if the file at `path` has the size given
+    by the Content-Length of the answer to a HEAD request for its url. A
+    file whose size is unknown is not complete.
+    """
+    try:
+        expected = int(headers["Content-Length"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return status_code == 200 and os.path.getsize(path) == expected
+
+
+def _photo_result(path, url, status, size=0, error=None, start=None) -> Dict[str, Any]:
+    return {
+        "path": path,
+        "url": url,
+        "status": status,
+        "bytes": size,
+        "seconds": time.perf_counter() - start if start is not None else 0.0,
+        "error": error,
+    }
 
 
 def get_count_by_taxon() -> Dict:
@@ -397,7 +1274,7 @@ def get_count_by_taxon() -> Dict:
     Function that returns the number of observations recorded for each taxonomic family.
     """
     url = f"{API_URL}/taxa.json"
-    page = requests.get(url, verify=False)
+    page = get_client().get(url)
     taxa = page.json()
     count = {}
     for taxon in taxa:
@@ -406,25 +1283,45 @@ def get_count_by_taxon() -> Dict:
 
 
 # Darwin Core Format
-def get_dwc(observations: List) -> pd.DataFrame:
+def get_dwc(
+    observations: List,
+    chunk_size: int = 1,
+    max_workers: int = 8,
+) -> pd.DataFrame:
     """
     Function to get dataframe with DarwinCore Format.
     Take a list of Observation objects to get ids.
+    The ids are requested concurrently, `chunk_size` ids per request as a
+    comma separated list where the API accepts it, and the resulting
+    frames are concatenated in a single step.
     """
-    df_total = pd.DataFrame()
     id_obs = [observation.id for observation in observations]
-    for id_ob in id_obs:
-        url = f"{API_URL}/observations.dwc?id={id_ob}"
-        df = pd.read_xml(url, parser="etree")
-        df_total = pd.concat([df_total, df])
-
-    # clean fields
-    df_total["institutionCode"] = "Natusfera"
-    df_total["datasetName"] = df_total["datasetName"].str.replace(
-        "iNaturalist", "Natusfera"
-    )
+    chunk_size = max(1, chunk_size)
+    urls = [
+        f"{API_URL}/observations.dwc?id={','.join(map(str, id_obs[i:i + chunk_size]))}"
+        for i in range(0, len(id_obs), chunk_size)
+    ]
+
+    with ContextThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        frames = list(executor.map(_read_dwc, urls))
+    if not frames:
+        return pd.DataFrame()
+    df_total = pd.concat(frames)
+
+    return _clean_dwc(df_total)
+
+
+def _read_dwc(url: str) -> pd.DataFrame:
+    """
+    Internal function that downloads a DarwinCore document and parses it
+    into a dataframe with one row per record.
+    """
+    page = get_client().get(url)
+    return _parse_dwc(page.content)
 
-    return df_total
+
+def _parse_dwc(content: bytes) -> pd.DataFrame:
+    return pd.read_xml(io.BytesIO(content), parser="etree")
 
 
 def get_dwc_from_query(
@@ -436,8 +1333,16 @@ def get_dwc_from_query(
     year: Optional[int] = None,
     start_on: Optional[date] = None,
     ends_on: Optional[date] = None,
-) -> str:
-
+    output: Optional[str] = None,
+) -> Union[pd.DataFrame, str, None]:
+    """
+    Function to get dataframe with DarwinCore Format from the observations
+    that match the filters. Each page is parsed while it downloads and only
+    its records are held in memory. With `output` (a .csv or .parquet path)
+    the pages are appended to that file instead of building a dataframe,
+    and the path is returned. A page that fails after the retries of the
+    client raises requests.HTTPError instead of ending the export.
+    """
     base_url = _build_url_dwc(
         id_obs,
         user_id,
@@ -449,24 +1354,52 @@ def get_dwc_from_query(
         ends_on,
     )
 
-    df_total = pd.DataFrame()
+    writer = DwcWriter(output) if output is not None else None
+    frames = []
+    try:
+        for i in range(1, DWC_MAX_PAGES + 1):
+            url = f"{base_url}&page={i}"
+            columns = DwcColumns()
+            with get_client().get(url, stream=True) as page:
+                if page.status_code != 200:
+                    _raise_for_error(page.status_code, url, always=True)
+                page.raw.decode_content = True
+                for record in iter_dwc_records(page.raw):
+                    columns.append(record)
+
+            if len(columns) == 0:
+                break
+            df = _clean_dwc(columns.to_frame(infer_types=writer is None))
+            if writer is not None:
+                writer.write(df)
+            else:
+                frames.append(df)
 
-    for i in range(1, 50):
-        url = f"{base_url}&page={i}"
+            # a page shorter than the page size is the last one
+            if len(columns) < PER_PAGE:
+                break
+    finally:
+        if writer is not None:
+            writer.close()
 
-        try:
-            df = pd.read_xml(url, parser="etree")
-            df_total = pd.concat([df_total, df])
-        except:
-            # clean fields
-            if len(df_total) > 1:
-                df_total["institutionCode"] = "Natusfera"
-                df_total["datasetName"] = df_total["datasetName"].str.replace(
-                    "iNaturalist", "Natusfera"
-                )
-            else:
-                df_total = None
-            return df_total
+    if writer is not None:
+        return output
+    if not frames:
+        return None
+    return pd.concat(frames)
+
+
+def _clean_dwc(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Internal function that replaces the references to iNaturalist with
+    Natusfera in the DarwinCore fields.
+    """
+    df["institutionCode"] = "Natusfera"
+    if "datasetName" in df.columns:
+        df["datasetName"] = df["datasetName"].str.replace(
+            "iNaturalist", "Natusfera"
+        )
+    return df
 
 
 def _build_url_dwc(
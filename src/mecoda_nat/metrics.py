@@ -0,0 +1,182 @@
+from bisect import bisect_left
+from typing import Any, Dict, Sequence
+import threading
+
+# Instrumentation of the requests to the API and of the processing stages,
+# enabled by giving a Metrics object to the client
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Collects the requests made by the client, by endpoint: latency
+    histogram, status codes, bytes received, retries and answers served
+    from the cache; the pages of observations fetched; and the calls,
+    records and seconds of each processing stage (parse, build_observations,
+    construct_observations, get_dfs, taxon_columns). It is enabled with
+    `NatusferaClient(metrics=Metrics())`; without it nothing is measured.
+    The on_* methods receive every event and can be overridden to forward
+    them elsewhere. Safe to share between threads.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests: Dict[str, Dict[str, Any]] = {}
+            self._pages: Dict[str, Dict[str, int]] = {}
+            self._stages: Dict[str, Dict[str, float]] = {}
+
+    def on_request(
+        self,
+        endpoint: str,
+        status: int,
+        seconds: float,
+        num_bytes: int,
+        retries: int = 0,
+        cached: bool = False,
+    ):
+        """One answer of the API, after its retries."""
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            requests = self._requests.get(endpoint)
+            if requests is None:
+                requests = self._requests[endpoint] = {
+                    "count": 0, "status": {}, "bytes": 0, "retries": 0,
+                    "cache_hits": 0, "seconds": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                }
+            requests["count"] += 1
+            requests["status"][status] = requests["status"].get(status, 0) + 1
+            requests["bytes"] += num_bytes
+            requests["retries"] += retries
+            requests["cache_hits"] += cached
+            requests["seconds"] += seconds
+            requests["buckets"][bucket] += 1
+
+    def on_page(self, endpoint: str, records: int):
+        """One page of results of a paginated query."""
+        with self._lock:
+            pages = self._pages.setdefault(endpoint, {"pages": 0, "records": 0})
+            pages["pages"] += 1
+            pages["records"] += records
+
+    def on_stage(self, stage: str, seconds: float, records: int):
+        """One call of a processing stage over `records` records."""
+        with self._lock:
+            stages = self._stages.setdefault(
+                stage, {"calls": 0, "records": 0, "seconds": 0.0})
+            stages["calls"] += 1
+            stages["records"] += records
+            stages["seconds"] += seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Snapshot of the metrics: {"requests": {endpoint: ...}, "pages":
+        {endpoint: ...}, "stages": {stage: ...}}. The latency histogram of
+        each endpoint is cumulative, by upper bound, as in Prometheus.
+        """
+        with self._lock:
+            requests = {}
+            for endpoint, values in self._requests.items():
+                cumulative, histogram = 0, {}
+                for bound, count in zip(self.buckets + (float("inf"),), values["buckets"]):
+                    cumulative += count
+                    histogram[bound] = cumulative
+                requests[endpoint] = {
+                    **{key: value for key, value in values.items() if key != "buckets"},
+                    "status": dict(values["status"]),
+                    "latency": histogram,
+                }
+            return {
+                "requests": requests,
+                "pages": {key: dict(value) for key, value in self._pages.items()},
+                "stages": {key: dict(value) for key, value in self._stages.items()},
+            }
+
+    def to_prometheus(self, prefix: str = "mecoda_nat") -> str:
+        """Metrics in the Prometheus text exposition format."""
+        metrics = self.as_dict()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            if not samples:
+                return
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for suffix, labels, value in samples:
+                labels = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                lines.append(f"{prefix}_{name}{suffix}{{{labels}}} {_number(value)}")
+
+        requests = metrics["requests"]
+        family("requests_total", "counter", "Answers of the API.", [
+            ("", {"endpoint": endpoint, "status": status}, count)
+            for endpoint, values in requests.items()
+            for status, count in values["status"].items()
+        ])
+        family("request_seconds", "histogram", "Latency of the requests.", [
+            sample
+            for endpoint, values in requests.items()
+            for sample in [
+                ("_bucket", {"endpoint": endpoint, "le": _bound(bound)}, count)
+                for bound, count in values["latency"].items()
+            ] + [
+                ("_sum", {"endpoint": endpoint}, values["seconds"]),
+                ("_count", {"endpoint": endpoint}, values["count"]),
+            ]
+        ])
+        for name, key, help_text in [
+            ("response_bytes_total", "bytes", "Bytes received."),
+            ("retries_total", "retries", "Retried requests."),
+            ("cache_hits_total", "cache_hits", "Answers served from the cache."),
+        ]:
+            family(name, "counter", help_text, [
+                ("", {"endpoint": endpoint}, values[key])
+                for endpoint, values in requests.items()
+            ])
+        for name, key, help_text in [
+            ("pages_total", "pages", "Pages of results fetched."),
+            ("page_records_total", "records", "Records in the pages fetched."),
+        ]:
+            family(name, "counter", help_text, [
+                ("", {"endpoint": endpoint}, values[key])
+                for endpoint, values in metrics["pages"].items()
+            ])
+        for name, key, help_text in [
+            ("stage_calls_total", "calls", "Calls of each processing stage."),
+            ("stage_records_total", "records", "Records processed by each stage."),
+            ("stage_seconds_total", "seconds", "Seconds spent in each stage."),
+        ]:
+            family(name, "counter", help_text, [
+                ("", {"stage": stage}, values[key])
+                for stage, values in metrics["stages"].items()
+            ])
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else _number(bound)
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def response_size(response, stream: bool = False) -> int:
+    """Bytes of the body of a response, without reading a streamed body."""
+    if not stream or response._content_consumed:
+        return len(response.content or b"")
+    try:
+        return int(response.headers.get("Content-Length", 0))
+    except ValueError:
+        return 0
+
+
+def response_retries(response) -> int:
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    return len(getattr(retries, "history", ()) or ())
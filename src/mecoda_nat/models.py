@@ -38,6 +38,9 @@ ICONIC_TAXON = {
     16: 'chromista'
 }
 
+# Taxonomic levels of the columns of the observations dataframe
+TAXON_LEVELS = ["kingdom", "phylum", "class", "order", "family", "genus"]
+
 class Project(BaseModel):
     id: int
     title: str
@@ -77,6 +80,7 @@ class Observation(BaseModel):
     latitude: Optional[float] = None
     longitude: Optional[float] = None
     place_name: Optional[str] = None
+    place_id: Optional[int] = None
     quality_grade: Optional[str] = None 
     user_id: Optional[int] = None
     user_login: Optional[str] = None
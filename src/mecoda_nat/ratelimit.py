@@ -0,0 +1,250 @@
+from contextlib import contextmanager, suppress
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+import asyncio
+import threading
+import time
+from urllib3.util.retry import Retry
+
+# Adaptive limit of the requests made to the API, shared by all the threads
+# (or tasks) that use the same client
+
+# Seconds between the checks of cancel_on while a request waits
+CANCEL_POLL = 0.05
+# Answers that signal that the API is overloaded
+CONGESTION_STATUS = [429, 500, 502, 503, 504]
+
+
+class RequestCancelled(Exception):
+    """The request was dropped while it waited for the rate limiter."""
+
+
+class RateLimiter:
+    """
+    Token bucket of `rate` requests per second, with bursts of up to
+    `burst`, combined with an adaptive limit of requests in flight (AIMD):
+    the limit grows by about one request per round of healthy answers, up
+    to `max_concurrency`, and is multiplied by `decrease` on an answer in
+    CONGESTION_STATUS, a failed request or a latency above
+    `latency_factor` times the usual one, at most once per round. A
+    `Retry-After` pauses every request until then. Safe to share between
+    threads and, through acquire_async, coroutines of one event loop.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = 25.0,
+        burst: int = 50,
+        concurrency: int = 4,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        decrease: float = 0.5,
+        latency_factor: float = 4.0,
+        min_latency: float = 0.5,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.min_latency = min_latency
+        self.concurrency = float(min(max(concurrency, min_concurrency), max_concurrency))
+        self.in_flight = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._latency: Optional[float] = None
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        # (loop, event) of the coroutines waiting in acquire_async
+        self._async_waiters = []
+
+    def _wait(self, now: float) -> Optional[float]:
+        """
+        Seconds to wait before a request can start, None when it has to
+        wait for another request to finish, or 0 after taking its slot.
+        """
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.concurrency):
+            return None
+        if self.rate is not None and self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        if self.rate is not None:
+            self._tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def acquire(self) -> float:
+        """
+        Waits for a slot and returns the time the request starts. Raises
+        RequestCancelled if the event of cancel_on is set meanwhile.
+        """
+        cancelled = getattr(self._local, "cancelled", None)
+        with self._condition:
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    raise RequestCancelled()
+                wait = self._wait(time.monotonic())
+                if wait == 0:
+                    return time.monotonic()
+                if cancelled is not None:
+                    wait = min(wait if wait is not None else CANCEL_POLL, CANCEL_POLL)
+                self._condition.wait(wait)
+
+    @contextmanager
+    def cancel_on(self, event: threading.Event):
+        """The requests of this thread within the block stop waiting when `event` is set."""
+        self._local.cancelled = event
+        try:
+            yield
+        finally:
+            self._local.cancelled = None
+
+    async def acquire_async(self) -> float:
+        """
+        acquire for coroutines, without blocking the event loop. A
+        coroutine waiting for a slot is woken up when one is released.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                wait = self._wait(time.monotonic())
+                if wait == 0:
+                    return time.monotonic()
+                waiter = (loop, asyncio.Event())
+                self._async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._condition:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def release(
+        self,
+        started: float,
+        status: Optional[int] = None,
+        retry_after: Optional[str] = None,
+    ):
+        """
+        Frees the slot of a request started at `started` and adapts the
+        limit to its answer; `status=None` is a failed request.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            seconds = now - started
+            if status is None or status in CONGESTION_STATUS or self._slow(seconds):
+                self._congestion(now, retry_after)
+            else:
+                self._latency = seconds if self._latency is None else (
+                    0.9 * self._latency + 0.1 * seconds)
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._notify()
+
+    def _notify(self):
+        """Wakes up the threads and coroutines waiting for a slot."""
+        self._condition.notify_all()
+        for loop, event in self._async_waiters:
+            with suppress(RuntimeError):  # the loop is already closed
+                loop.call_soon_threadsafe(event.set)
+        self._async_waiters.clear()
+
+    def _slow(self, seconds: float) -> bool:
+        return self._latency is not None and seconds > max(
+            self.min_latency, self.latency_factor * self._latency)
+
+    def _congestion(self, now: float, retry_after: Optional[str]):
+        delay = retry_after_seconds(retry_after)
+        if delay is not None:
+            self._paused_until = max(self._paused_until, now + delay)
+        # the answers of the requests in flight reflect the previous limit
+        if now - self._decreased_at >= (self._latency or 0):
+            self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease)
+            self._decreased_at = now
+
+    @contextmanager
+    def request(self):
+        """
+        Holds a slot while the block runs. The block sets the status of the
+        answer with `slot["status"] = ...` and its Retry-After, if any.
+        """
+        slot = {"started": self.acquire(), "status": None, "retry_after": None}
+        self._local.slot = slot
+        try:
+            yield slot
+        finally:
+            self._local.slot = None
+            if slot["started"] is not None:
+                self.release(slot["started"], slot["status"], slot["retry_after"])
+
+    @contextmanager
+    def pause(self, status: Optional[int] = None, retry_after: Optional[str] = None):
+        """
+        Frees the slot that this thread holds in `request` while the block
+        runs, e.g. while waiting to retry, reporting the answer of the
+        attempt, and waits for a new one afterwards.
+        """
+        slot = getattr(self._local, "slot", None)
+        if slot is None:
+            yield
+            return
+        self.release(slot["started"], status, retry_after)
+        slot["started"] = None
+        yield
+        slot["started"] = self.acquire()
+
+    def state(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "latency": self._latency,
+                "paused_for": max(0.0, self._paused_until - time.monotonic()),
+            }
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait given by a Retry-After header, in seconds or as a date."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LimitedRetry(Retry):
+    """
+    Retry of urllib3 that, within RateLimiter.request, reports each retried
+    answer to the RateLimiter and frees its slot while waiting to retry.
+    """
+
+    rate_limiter: Optional[RateLimiter] = None
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def sleep(self, response=None):
+        if self.rate_limiter is None:
+            return super().sleep(response)
+        # without a response the attempt failed
+        status = response.status if response is not None else None
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        with self.rate_limiter.pause(status, retry_after):
+            super().sleep(response)
@@ -0,0 +1,153 @@
+from typing import Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+# Spatial queries over the latitude and longitude of the observations frame
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great circle distance in km between points given in degrees, vectorized."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def points_in_polygon(lats, lons, polygon: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """
+    Mask of the points inside a polygon given as a sequence of (lat, lon)
+    vertices, by ray casting: one vectorized pass over the points per edge.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    vertices = np.asarray(polygon, dtype=float)
+    inside = np.zeros(len(lats), dtype=bool)
+    for (lat1, lon1), (lat2, lon2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        crosses = (lats < lat1) != (lats < lat2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lon_cross = lon1 + (lats - lat1) * (lon2 - lon1) / (lat2 - lat1)
+        inside ^= crosses & (lons < lon_cross)
+    return inside
+
+
+class SpatialIndex:
+    """
+    Grid index over the `latitude` and `longitude` columns of a dataframe,
+    such as the observations frame of get_dfs. The points are sorted by
+    cell of `cell_size` degrees, so a query only checks the points of the
+    cells it overlaps, with vectorized NumPy operations. Rows without
+    coordinates are not indexed. Queries return the matching rows in their
+    original order. Areas that cross the antimeridian are searched on both
+    sides of it.
+    """
+
+    def __init__(self, df: pd.DataFrame, cell_size: float = 0.5):
+        self.df = df
+        self.cell_size = cell_size
+        lats = df["latitude"].to_numpy(dtype=float)
+        lons = df["longitude"].to_numpy(dtype=float)
+        positions = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+
+        rows, columns = self._cell(lats[positions], lons[positions])
+        self._columns = int(np.ceil(360 / cell_size)) + 1
+        keys = rows * self._columns + columns
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._positions = positions[order]
+        self._lats = lats[self._positions]
+        self._lons = lons[self._positions]
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _cell(self, lats, lons):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_size).astype(np.int64)
+        columns = np.floor((np.asarray(lons) + 180) / self.cell_size).astype(np.int64)
+        return rows, columns
+
+    def _candidates(self, min_lat, min_lon, max_lat, max_lon) -> np.ndarray:
+        """
+        Indexes, in the sorted arrays, of the points of the cells in a box.
+        The longitudes may go beyond ±180 degrees, the box is then split at
+        the antimeridian.
+        """
+        return np.concatenate([
+            self._box_candidates(min_lat, lon1, max_lat, lon2)
+            for lon1, lon2 in _lon_ranges(min_lon, max_lon)
+        ])
+
+    def _box_candidates(self, min_lat, min_lon, max_lat, max_lon) -> np.ndarray:
+        (row1, row2), (column1, column2) = self._cell(
+            [min_lat, max_lat], [min_lon, max_lon])
+        rows = np.arange(row1, row2 + 1)
+        starts = np.searchsorted(self._keys, rows * self._columns + column1, "left")
+        ends = np.searchsorted(self._keys, rows * self._columns + column2, "right")
+        lengths = ends - starts
+        # concatenated ranges [start, end) of every row of cells
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def _rows(self, candidates: np.ndarray, mask: np.ndarray) -> pd.DataFrame:
+        return self.df.iloc[np.sort(self._positions[candidates[mask]])]
+
+    def bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> pd.DataFrame:
+        """
+        Rows inside a bounding box, limits included. A box with `min_lon`
+        greater than `max_lon` crosses the antimeridian.
+        """
+        if min_lon > max_lon:
+            max_lon += 360
+        candidates = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        lats = self._lats[candidates]
+        lons = _unwrap(self._lons[candidates], min_lon)
+        mask = (lats >= min_lat) & (lats <= max_lat) & (lons <= max_lon)
+        return self._rows(candidates, mask)
+
+    def radius(self, lat: float, lon: float, km: float) -> pd.DataFrame:
+        """Rows within `km` of a point, by haversine distance."""
+        dlat = km / KM_PER_DEGREE
+        cos_lat = np.cos(np.radians(min(abs(lat) + dlat, 90)))
+        dlon = 180 if cos_lat < 1e-9 else min(km / (KM_PER_DEGREE * cos_lat), 180)
+        candidates = self._candidates(
+            max(lat - dlat, -90), lon - dlon, min(lat + dlat, 90), lon + dlon)
+        distances = haversine(lat, lon, self._lats[candidates], self._lons[candidates])
+        return self._rows(candidates, distances <= km)
+
+    def polygon(self, polygon: Sequence[Tuple[float, float]]) -> pd.DataFrame:
+        """
+        Rows inside a polygon given as a sequence of (lat, lon) vertices.
+        An edge that spans more than 180 degrees of longitude is taken to
+        cross the antimeridian.
+        """
+        vertices = np.array(polygon, dtype=float)
+        vertices[:, 1] = np.degrees(np.unwrap(np.radians(vertices[:, 1])))
+        (min_lat, min_lon), (max_lat, max_lon) = vertices.min(axis=0), vertices.max(axis=0)
+        candidates = self._candidates(min_lat, min_lon, max_lat, max_lon)
+        mask = points_in_polygon(
+            self._lats[candidates], _unwrap(self._lons[candidates], min_lon), vertices)
+        return self._rows(candidates, mask)
+
+
+def _lon_ranges(min_lon: float, max_lon: float):
+    """
+    Ranges of longitudes within ±180 degrees of the range from `min_lon` to
+    `max_lon`, which may go beyond them: two when it crosses the
+    antimeridian.
+    """
+    if max_lon - min_lon >= 360:
+        return [(-180, 180)]
+    min_lon = (min_lon + 180) % 360 - 180
+    max_lon = (max_lon + 180) % 360 - 180
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180), (-180, max_lon)]
+
+
+def _unwrap(lons: np.ndarray, min_lon: float) -> np.ndarray:
+    """Longitudes moved by whole turns to the 360 degrees from `min_lon`."""
+    return min_lon + (lons - min_lon) % 360
@@ -0,0 +1,541 @@
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Any, Tuple, Union
+from urllib.parse import quote
+import json
+import os
+import sqlite3
+import threading
+from .client import get_client
+from .models import Observation
+from .mecoda_nat import (
+    _as_date, _build_url, _iter_request, MAX_PAGES, MAX_WORKERS, PER_PAGE, SHARDS_START,
+)
+
+# Local store of observations, kept up to date with incremental syncs
+
+# Columns of the observations table used to filter, with their indexes
+INDEXED_COLUMNS = {
+    "taxon_id": "INTEGER",
+    "user_id": "INTEGER",
+    "user_login": "TEXT",
+    "observed_on": "TEXT",
+    "iconic_taxon": "TEXT",
+    "latitude": "REAL",
+    "longitude": "REAL",
+}
+INDEXES = {
+    "taxon_id": "taxon_id",
+    "user_id": "user_id",
+    "user_login": "user_login",
+    "observed_on": "observed_on",
+    "iconic_taxon": "iconic_taxon",
+    "location": "latitude, longitude",
+}
+# Filters of get_obs that the store cannot evaluate: the observations they
+# returned are recorded as members of the query
+REMOTE_FILTERS = ["query", "id_project", "place_id"]
+SCHEMA_VERSION = 1
+
+
+class ObservationStore:
+    """
+    SQLite file with the observations downloaded from the API, one row per
+    observation id, and the watermark reached by each synced query.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS observations ("
+                " id INTEGER PRIMARY KEY, updated_at TEXT, data TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                " query TEXT PRIMARY KEY, updated_at TEXT, last_id INTEGER,"
+                " synced_at TEXT)"
+            )
+            self._migrate()
+
+    def _migrate(self):
+        """
+        Bring a store created by a previous version to SCHEMA_VERSION.
+        Version 1 adds the indexed filter columns, filled from the stored
+        observations, and the members and coverage tables.
+        """
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            existing = {
+                row[1] for row in self._db.execute("PRAGMA table_info(observations)")}
+            for name, sql_type in dict(
+                INDEXED_COLUMNS, created_on="TEXT", taxon_ancestry="TEXT"
+            ).items():
+                if name not in existing:
+                    self._db.execute(f"ALTER TABLE observations ADD COLUMN {name} {sql_type}")
+            for name, columns in INDEXES.items():
+                self._db.execute(
+                    f"CREATE INDEX IF NOT EXISTS observations_{name}"
+                    f" ON observations ({columns})"
+                )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS members ("
+                " key TEXT, id INTEGER, PRIMARY KEY (key, id)) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                " filters TEXT, starts_on TEXT, ends_on TEXT, fetched_at TEXT)"
+            )
+            rows = self._db.execute("SELECT data FROM observations").fetchall()
+            self._db.executemany(
+                "UPDATE observations SET taxon_id = ?, user_id = ?, user_login = ?,"
+                " observed_on = ?, iconic_taxon = ?, latitude = ?, longitude = ?,"
+                " created_on = ?, taxon_ancestry = ? WHERE id = ?",
+                [
+                    _row(obs)[3:] + (obs.id,)
+                    for obs in (Observation.parse_raw(data) for data, in rows)
+                ],
+            )
+        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+
+    def upsert(self, observations: Iterable[Observation]) -> int:
+        """Insert the observations, replacing the stored ones with the same id."""
+        rows = [_row(obs) for obs in observations]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO observations (id, updated_at, data, taxon_id,"
+                " user_id, user_login, observed_on, iconic_taxon, latitude, longitude,"
+                " created_on, taxon_ancestry) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def get(self, id_obs: int) -> Optional[Observation]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data FROM observations WHERE id = ?", (id_obs,)).fetchone()
+        return Observation.parse_raw(row[0]) if row else None
+
+    def observations(self) -> List[Observation]:
+        """All the stored observations, in descending order of id like the API."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT data FROM observations ORDER BY id DESC").fetchall()
+        return [Observation.parse_raw(data) for data, in rows]
+
+    def watermark(self, query: str) -> Optional[Dict[str, Any]]:
+        """Last `updated_at` seen by a synced query, if any."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT updated_at, synced_at FROM watermarks WHERE query = ?",
+                (query,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"updated_at": row[0], "synced_at": row[1]}
+
+    def set_watermark(self, query: str, updated_at: Optional[str]):
+        # last_id is not used, the column is kept for the existing stores
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?, NULL, ?)",
+                (query, updated_at, datetime.now().isoformat()),
+            )
+
+    def add_members(self, key: str, ids: Iterable[int]):
+        """Record the ids returned by a query with filters the store cannot evaluate."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO members VALUES (?, ?)", [(key, id_) for id_ in ids])
+
+    def prune_members(
+        self,
+        filters: Dict[str, Any],
+        ids: Iterable[int],
+        starts_on: Optional[date] = None,
+        ends_on: Optional[date] = None,
+    ):
+        """
+        Given `ids`, the complete answer of the API to a query with filters
+        the store cannot evaluate, drop the members recorded for it that are
+        no longer returned, e.g. observations removed from a project.
+        """
+        key = _members_key(filters)
+        if key is None:
+            return
+        conditions, args = _conditions(filters, starts_on, ends_on)
+        kept = set(ids)
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT id FROM observations WHERE " + " AND ".join(conditions), args
+            ).fetchall()
+            self._db.executemany(
+                "DELETE FROM members WHERE key = ? AND id = ?",
+                [(key, id_) for id_, in rows if id_ not in kept],
+            )
+
+    def coverage(
+        self, max_age: Optional[float] = None
+    ) -> List[Tuple[Dict[str, Any], Optional[date], Optional[date]]]:
+        """
+        Filters and range of observation dates of the queries downloaded in
+        full, in the last `max_age` seconds if given; a range without limits
+        covers also the observations without date.
+        """
+        sql, args = "SELECT filters, starts_on, ends_on FROM coverage", []
+        if max_age is not None:
+            sql += " WHERE fetched_at >= ?"
+            args.append((datetime.now() - timedelta(seconds=max_age)).isoformat())
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [
+            (
+                json.loads(filters),
+                date.fromisoformat(d1) if d1 else None,
+                date.fromisoformat(d2) if d2 else None,
+            )
+            for filters, d1, d2 in rows
+        ]
+
+    def add_coverage(self, filters: Dict[str, Any], starts_on: Optional[date], ends_on: Optional[date]):
+        """Record a query downloaded in full now, replacing a previous download of it."""
+        row = (
+            json.dumps(filters, sort_keys=True),
+            starts_on.isoformat() if starts_on else None,
+            ends_on.isoformat() if ends_on else None,
+        )
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM coverage WHERE filters = ? AND starts_on IS ? AND ends_on IS ?",
+                row,
+            )
+            self._db.execute(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?)", row + (datetime.now().isoformat(),))
+
+    def select(
+        self,
+        filters: Dict[str, Any],
+        starts_on: Optional[date] = None,
+        ends_on: Optional[date] = None,
+        num_max: Optional[int] = None,
+    ) -> List[Observation]:
+        """
+        Stored observations that match the filters of get_obs, in descending
+        order of id. The filters in REMOTE_FILTERS are answered with the
+        members recorded for them.
+        """
+        conditions, args = _conditions(filters, starts_on, ends_on)
+        sql = "SELECT data FROM observations"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id DESC"
+        if num_max is not None:
+            sql += " LIMIT ?"
+            args.append(num_max)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [Observation.parse_raw(data) for data, in rows]
+
+    def close(self):
+        self._db.close()
+
+
+def _conditions(
+    filters: Dict[str, Any], starts_on: Optional[date], ends_on: Optional[date]
+) -> Tuple[List[str], List[Any]]:
+    """SQL conditions, and their arguments, of the filters of get_obs."""
+    conditions, args = [], []
+    if filters.get("user") is not None:
+        conditions.append("user_login = ?")
+        args.append(filters["user"])
+    if filters.get("taxon") is not None:
+        conditions.append("iconic_taxon = ?")
+        args.append(filters["taxon"].lower())
+    if filters.get("taxon_id") is not None:
+        # the API includes the descendants of the taxon
+        conditions.append("(taxon_id = ? OR '/' || taxon_ancestry || '/' LIKE ?)")
+        args += [filters["taxon_id"], f"%/{filters['taxon_id']}/%"]
+    if filters.get("year") is not None:
+        conditions.append("observed_on >= ? AND observed_on <= ?")
+        args += [f"{filters['year']}-01-01", f"{filters['year']}-12-31"]
+    if filters.get("created_on") is not None:
+        conditions.append("created_on = ?")
+        args.append(str(filters["created_on"]))
+    if starts_on is not None:
+        conditions.append("observed_on >= ?")
+        args.append(starts_on.isoformat())
+    if ends_on is not None:
+        conditions.append("observed_on <= ?")
+        args.append(ends_on.isoformat())
+    key = _members_key(filters)
+    if key is not None:
+        conditions.append("id IN (SELECT id FROM members WHERE key = ?)")
+        args.append(key)
+    return conditions, args
+
+
+def _row(obs: Observation) -> tuple:
+    return (
+        obs.id,
+        obs.updated_at.isoformat() if obs.updated_at else None,
+        obs.json(),
+        obs.taxon_id,
+        obs.user_id,
+        obs.user_login,
+        obs.observed_on.isoformat() if obs.observed_on else None,
+        obs.iconic_taxon,
+        obs.latitude,
+        obs.longitude,
+        obs.created_at.date().isoformat() if obs.created_at else None,
+        obs.taxon_ancestry,
+    )
+
+
+def _members_key(filters: Dict[str, Any]) -> Optional[str]:
+    remote = {name: filters[name] for name in REMOTE_FILTERS if filters.get(name) is not None}
+    return json.dumps(remote, sort_keys=True) if remote else None
+
+
+def sync_obs(
+    store: ObservationStore,
+    query: Optional[str] = None,
+    id_project: Optional[int] = None,
+    user: Optional[str] = None,
+    taxon: Optional[str] = None,
+    taxon_id: Optional[int] = None,
+    place_id: Optional[int] = None,
+    year: Optional[int] = None,
+    starts_on: Optional[str] = None,
+    ends_on: Optional[str] = None,
+    max_workers: int = MAX_WORKERS,
+    full: bool = False,
+) -> List[Observation]:
+    """
+    Function to mirror a query of get_obs into a local store. The first
+    sync downloads every page; the next ones only ask the API for the
+    observations updated since the last `updated_at` seen, and merge them
+    into the store by id. Returns the new or updated observations.
+    The answers are always requested from the API, not from the response
+    cache of the client. The changes do not tell which observations left a
+    project or query, so only a full download, the first one or one with
+    `full=True`, drops them from it.
+    A sync that reaches the limit of 20,000 results of the API stores them
+    but does not move the watermark, as older changes were not served;
+    such a query has to be split (e.g. by year) to be mirrored completely.
+    """
+    url = _build_url(
+        query, id_project, None, user, taxon, taxon_id, place_id, year,
+        starts_on, ends_on,
+    )
+    previous = store.watermark(url)
+    watermark = previous or {"updated_at": None, "last_id": None}
+    full = full or watermark["updated_at"] is None
+
+    request_url = url
+    if not full:
+        request_url = f"{url}&updated_since={quote(watermark['updated_at'])}"
+
+    filters = _filters(query, id_project, user, taxon, taxon_id, place_id, year)
+    changed = _download(store, request_url, filters, max_workers)
+    if len(changed) >= MAX_PAGES * PER_PAGE:
+        print("WARNING: The sync reached the limit of the API, its watermark is not moved")
+        return changed
+    # the query is complete again as of now
+    window = _window(starts_on, ends_on)
+    store.add_coverage(filters, *window)
+    if full:
+        store.prune_members(filters, [obs.id for obs in changed], *window)
+
+    updated = [obs.updated_at for obs in changed if obs.updated_at is not None]
+    if watermark["updated_at"] is not None:
+        updated.append(datetime.fromisoformat(watermark["updated_at"]))
+    store.set_watermark(url, max(updated, key=_utc).isoformat() if updated else None)
+
+    return changed
+
+
+def _utc(value: datetime) -> datetime:
+    """Aware datetime in UTC, taking the naive ones as UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def query_obs(
+    store: ObservationStore,
+    query: Optional[str] = None,
+    id_project: Optional[int] = None,
+    id_obs: Optional[int] = None,
+    user: Optional[str] = None,
+    taxon: Optional[str] = None,
+    taxon_id: Optional[int] = None,
+    place_id: Optional[int] = None,
+    year: Optional[int] = None,
+    num_max: Optional[int] = None,
+    starts_on: Optional[str] = None,  # Must be observed on or after this date
+    ends_on: Optional[str] = None,  # Must be observed on or before this date
+    created_on: Optional[str] = None, # Day YYYY-MM-DD
+    max_workers: int = MAX_WORKERS,
+    offline: bool = False,
+    max_age: Optional[float] = None,
+    refresh: bool = False,
+) -> List[Observation]:
+    """
+    Function with the filters of get_obs that answers from a local store.
+    The ranges of observation dates that no previous download of the query
+    covers are requested from the API and stored first, unless `offline`.
+    A download covers the queries that add filters the store can evaluate
+    (user, taxon, taxon_id, year, created_on) to it; a query without dates
+    needs a download without dates, which also has the undated observations.
+    With `max_age` (seconds) the downloads older than that do not count,
+    and `refresh=True` downloads the whole query again; the downloads skip
+    the response cache of the client. With `num_max`, at most that many
+    observations are downloaded for each range, and a range cut short is
+    not recorded as covered.
+    """
+    if id_obs is not None:
+        observation = store.get(id_obs)
+        if observation is None and not offline:
+            url = _build_url(id_obs=id_obs)
+            for batch in _iter_request(url, max_workers=max_workers):
+                store.upsert(batch)
+            observation = store.get(id_obs)
+        return [observation] if observation is not None else []
+
+    filters = _filters(query, id_project, user, taxon, taxon_id, place_id, year, created_on)
+    starts_on = _as_date(starts_on) if starts_on is not None else None
+    ends_on = _as_date(ends_on) if ends_on is not None else None
+
+    if not offline:
+        coverage = [] if refresh else store.coverage(max_age)
+        for d1, d2 in _uncovered(coverage, filters, starts_on, ends_on):
+            url = _build_url(
+                query, id_project, None, user, taxon, taxon_id, place_id, year,
+                d1, d2, created_on,
+            )
+            downloaded = _download(store, url, filters, max_workers, num_max)
+            # a window over the limit of the API or num_max is not complete
+            if len(downloaded) < MAX_PAGES * PER_PAGE and (
+                num_max is None or len(downloaded) < num_max
+            ):
+                store.add_coverage(filters, d1, d2)
+                store.prune_members(filters, [obs.id for obs in downloaded], d1, d2)
+
+    return store.select(filters, starts_on, ends_on, num_max)
+
+
+def _filters(
+    query=None, id_project=None, user=None, taxon=None, taxon_id=None,
+    place_id=None, year=None, created_on=None,
+) -> Dict[str, Any]:
+    filters = {
+        "query": query,
+        "id_project": id_project,
+        "user": user,
+        "taxon": taxon.title() if taxon is not None else None,
+        "taxon_id": taxon_id,
+        "place_id": place_id,
+        "year": year,
+        "created_on": str(created_on) if created_on is not None else None,
+    }
+    return {name: value for name, value in filters.items() if value is not None}
+
+
+def _download(
+    store: ObservationStore,
+    url: str,
+    filters: Dict[str, Any],
+    max_workers: int,
+    num_max: Optional[int] = None,
+) -> List[Observation]:
+    """
+    Internal function that stores up to `num_max` observations of a query,
+    requested from the API and not from the response cache, recording them
+    as members of its filters the store cannot evaluate.
+    """
+    key = _members_key(filters)
+    downloaded = []
+    with _from_api():
+        for batch in _iter_request(url, num_max=num_max, max_workers=max_workers):
+            store.upsert(batch)
+            if key is not None:
+                store.add_members(key, [obs.id for obs in batch])
+            downloaded.extend(batch)
+    return downloaded
+
+
+@contextmanager
+def _from_api():
+    """
+    Internal context manager in which the answers of the response cache of
+    the client, if any, are requested again and stored.
+    """
+    cache = get_client().cache
+    if cache is None:
+        yield
+        return
+    with cache.refresh():
+        yield
+
+
+def _window(
+    starts_on: Optional[Union[str, date]], ends_on: Optional[Union[str, date]]
+) -> Tuple[Optional[date], Optional[date]]:
+    """Range of observation dates of a query, None for a query without dates."""
+    if starts_on is None and ends_on is None:
+        return None, None
+    return (
+        _as_date(starts_on) if starts_on is not None else SHARDS_START,
+        _as_date(ends_on) if ends_on is not None else date.today(),
+    )
+
+
+def _covers(covered: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    return all(
+        filters.get(name) == value for name, value in covered.items()
+    ) and all(covered.get(name) == filters.get(name) for name in REMOTE_FILTERS)
+
+
+def _uncovered(
+    coverage: List[Tuple[Dict[str, Any], Optional[date], Optional[date]]],
+    filters: Dict[str, Any],
+    starts_on: Optional[date],
+    ends_on: Optional[date],
+) -> List[Tuple[Optional[date], Optional[date]]]:
+    """
+    Internal function that returns the ranges of observation dates of a
+    query that are not in the coverage of the store.
+    """
+    ranges = []
+    for covered, d1, d2 in coverage:
+        if not _covers(covered, filters):
+            continue
+        if d1 is None:
+            return []
+        ranges.append((d1, d2))
+
+    start, end = _window(starts_on, ends_on)
+    if start is None:
+        return [(None, None)]
+    gaps = []
+    for d1, d2 in sorted(ranges):
+        if d2 < start:
+            continue
+        if d1 > end:
+            break
+        if d1 > start:
+            gaps.append((start, d1 - timedelta(days=1)))
+        start = d2 + timedelta(days=1)
+        if start > end:
+            return gaps
+    gaps.append((start, end))
+    return gaps
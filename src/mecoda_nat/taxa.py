@@ -0,0 +1,193 @@
+from functools import lru_cache
+from typing import List, Optional
+import io
+import numpy as np
+import pandas as pd
+
+# Taxon tree of the API, prebuilt from data/taxon_tree.csv into NumPy arrays
+
+TREE_FILE = "taxon_tree.npz"
+
+
+class TaxonTree:
+    """
+    Taxon tree held in NumPy arrays sorted by taxon id: the parent, rank
+    and name of each taxon, the ancestry as given by the API and a
+    preorder of the tree, so that the descendants of a taxon are one slice.
+    Taxa whose parent is not in the tree are roots.
+    """
+
+    def __init__(self, arrays):
+        self.ids = arrays["ids"]
+        self.parents = arrays["parents"]
+        self.rank_names = arrays["rank_names"].tolist()
+        self.rank_codes = arrays["rank_codes"]
+        self._names = arrays["names"].tobytes()
+        self._name_offsets = arrays["name_offsets"]
+        self._ancestry = arrays["ancestry"]
+        self._ancestry_offsets = arrays["ancestry_offsets"]
+        self._preorder = arrays["preorder"]
+        self._preorder_position = arrays["preorder_position"]
+        self._subtree_sizes = arrays["subtree_sizes"]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id_taxon: int) -> bool:
+        return self.position(id_taxon) >= 0
+
+    def positions(self, ids) -> np.ndarray:
+        """Positions of taxon ids in the arrays, -1 for unknown ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        positions[positions == len(self.ids)] = 0
+        return np.where(self.ids[positions] == ids, positions, -1)
+
+    def position(self, id_taxon: int) -> int:
+        return int(self.positions([id_taxon])[0])
+
+    def _known(self, id_taxon: int) -> int:
+        position = self.position(id_taxon)
+        if position < 0:
+            raise KeyError(id_taxon)
+        return position
+
+    def name(self, id_taxon: int) -> str:
+        position = self._known(id_taxon)
+        start, end = self._name_offsets[position:position + 2]
+        return self._names[start:end - 1].decode()
+
+    @property
+    def names(self) -> List[str]:
+        """Names of all the taxa, in the order of `ids`."""
+        return _split_names(self._names, self._name_offsets)
+
+    def rank(self, id_taxon: int) -> Optional[str]:
+        return self.rank_names[self.rank_codes[self._known(id_taxon)]] or None
+
+    def ranks(self, ids) -> np.ndarray:
+        """Ranks of taxon ids, vectorized, None for unknown ids or without rank."""
+        positions = self.positions(ids)
+        ranks = np.array(self.rank_names, dtype=object)[self.rank_codes[positions]]
+        ranks[(positions < 0) | (ranks == "")] = None
+        return ranks
+
+    def ancestors(self, id_taxon: int) -> List[int]:
+        """Ids of the ancestors of a taxon from the root, as in its ancestry."""
+        position = self._known(id_taxon)
+        start, end = self._ancestry_offsets[position:position + 2]
+        return self._ancestry[start:end].tolist()
+
+    def descendants(self, id_taxon: int) -> List[int]:
+        """Ids of all the taxa below a taxon, in preorder."""
+        start = self._preorder_position[self._known(id_taxon)]
+        end = start + self._subtree_sizes[start]
+        return self.ids[self._preorder[start + 1:end]].tolist()
+
+    def rank_at_level(self, id_taxon: int, level: str) -> Optional[int]:
+        """Id of the taxon or ancestor of a taxon with rank `level`, if any."""
+        for ancestor in [id_taxon] + self.ancestors(id_taxon)[::-1]:
+            if ancestor in self and self.rank(ancestor) == level:
+                return ancestor
+        return None
+
+
+def _split_names(names: bytes, offsets: np.ndarray) -> List[str]:
+    return names.decode().split("\n") if len(offsets) > 1 else []
+
+
+def build_taxon_tree(csv_path: str, npz_path: str):
+    """
+    Generate the binary taxon tree from the CSV of the API
+    (id, name, rank, ancestry with ids separated by "/"), as a compressed
+    .npz that is smaller than the CSV.
+    """
+    df = pd.read_csv(csv_path, dtype={"name": str, "rank": str, "ancestry": str})
+    df = df.sort_values("id", ignore_index=True)
+    ids = df["id"].to_numpy(dtype=np.int64)
+
+    ancestry = df["ancestry"].fillna("").str.split("/")
+    lengths = ancestry.str.len().where(df["ancestry"].notna(), 0).to_numpy()
+    flat = ancestry[df["ancestry"].notna()].explode().astype(np.int64).to_numpy()
+    ancestry_offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    last = np.where(lengths > 0, flat[np.maximum(ancestry_offsets[1:] - 1, 0)], -1)
+    parents = np.searchsorted(ids, last)
+    parents[parents == len(ids)] = 0
+    parents = np.where((last >= 0) & (ids[parents] == last), parents, -1)
+
+    rank_names, rank_codes = np.unique(df["rank"].fillna(""), return_inverse=True)
+
+    # names separated by new lines, with the offset where each one starts
+    encoded = [name.encode() for name in df["name"]]
+    name_offsets = np.concatenate([[0], np.cumsum([len(name) + 1 for name in encoded])])
+    names = b"\n".join(encoded)
+
+    preorder, subtree_sizes = _preorder(parents)
+    preorder_position = np.empty_like(preorder)
+    preorder_position[preorder] = np.arange(len(preorder))
+
+    np.savez_compressed(
+        npz_path,
+        ids=ids.astype(np.int32),
+        parents=parents.astype(np.int32),
+        rank_names=rank_names.astype(str),
+        rank_codes=rank_codes.astype(np.int8),
+        names=np.frombuffer(names, dtype=np.uint8),
+        name_offsets=name_offsets.astype(np.int32),
+        ancestry=flat.astype(np.int32),
+        ancestry_offsets=ancestry_offsets.astype(np.int32),
+        preorder=preorder.astype(np.int32),
+        preorder_position=preorder_position.astype(np.int32),
+        subtree_sizes=subtree_sizes.astype(np.int32),
+    )
+
+
+def _preorder(parents: np.ndarray):
+    """
+    Internal function that returns the positions of the taxa in preorder,
+    children by id, and the size of the subtree at each preorder position.
+    """
+    children = [[] for _ in range(len(parents))]
+    roots = []
+    for position, parent in enumerate(parents.tolist()):
+        (children[parent] if parent >= 0 else roots).append(position)
+
+    preorder = []
+    stack = roots[::-1]
+    while stack:
+        position = stack.pop()
+        preorder.append(position)
+        stack.extend(children[position][::-1])
+    preorder = np.array(preorder, dtype=np.int64)
+
+    sizes = np.ones(len(parents), dtype=np.int64)
+    for position in preorder[::-1].tolist():
+        if parents[position] >= 0:
+            sizes[parents[position]] += sizes[position]
+    return preorder, sizes[preorder]
+
+
+@lru_cache(maxsize=None)
+def load_taxon_tree() -> TaxonTree:
+    """Taxon tree shipped with the package, loaded once per process."""
+    data = _resource_bytes(TREE_FILE)
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        return TaxonTree({name: arrays[name] for name in arrays.files})
+
+
+def _resource_bytes(name: str) -> bytes:
+    try:
+        from importlib.resources import files
+    except ImportError:  # Python < 3.9
+        import pkgutil
+        return pkgutil.get_data("mecoda_nat", f"data/{name}")
+    return files("mecoda_nat").joinpath("data", name).read_bytes()
+
+
+if __name__ == "__main__":
+    import os
+
+    data = os.path.join(os.path.dirname(__file__), "data")
+    build_taxon_tree(
+        os.path.join(data, "taxon_tree.csv"), os.path.join(data, TREE_FILE))
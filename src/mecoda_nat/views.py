@@ -1,46 +1,115 @@
 #!/usr/bin/env python3
 
 import folium
-from folium.plugins import HeatMap, MarkerCluster
+from branca.element import MacroElement
+from jinja2 import Template
+from folium.plugins import FastMarkerCluster, HeatMap, MarkerCluster
 import pandas as pd
 import numpy as np
+from html import escape
 
-def create_heatmap(df):
-    df.dropna(subset = ['latitude', 'longitude'], inplace = True)
+# Size in pixels, at the zoom of the map, of the cells of a binned heatmap
+HEAT_CELL_PIXELS = 5
 
-    lats = df['latitude'].to_list()
-    lons = df['longitude'].to_list()
 
-    locations = list(zip(lats, lons))
+def create_heatmap(df, binned=False, zoom=5):
+    """
+    Heatmap of the observations. With `binned=True` the points are counted
+    in a grid whose cells measure HEAT_CELL_PIXELS at `zoom`, and the map
+    gets one weighted point per non-empty cell instead of every point.
+    Rows without coordinates are skipped, and the layer is empty when no
+    row has them. The dataframe is not modified.
+    """
+    lats, lons = _coordinates(df)
 
     attr = (
         'Tiles &copy; Esri &mdash; Source: Esri, i-cubed, USDA, USGS, AEX, GeoEye, Getmapping, Aerogrid, IGN, IGP, UPR-EGP, and the GIS User Community'
     )
     tiles = 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}'
     
-    #Define coordinates of where we want to center our map
-    center = [np.mean(lats), np.mean(lons)]
-    
-    map = folium.Map(center, tiles=tiles, attr=attr, zoom_start=5)
+    map = folium.Map(_center(lats, lons), tiles=tiles, attr=attr, zoom_start=zoom)
+
+    if binned and len(lats):
+        # degrees of longitude per pixel of a 256 pixel tile at this zoom
+        cell_size = HEAT_CELL_PIXELS * 360 / (256 * 2 ** zoom)
+        cell_lats, cell_lons, counts = grid_bins(lats, lons, cell_size)
+        locations = np.column_stack(
+            [cell_lats.round(6), cell_lons.round(6), counts / counts.max()])
+    else:
+        locations = np.column_stack([lats, lons])
 
     HeatMap(locations).add_to(map)
 
     return map
 
 
-def create_markercluster(df):
-    df.dropna(subset = ['latitude', 'longitude'], inplace = True)
+def _coordinates(df):
+    """
+    Latitudes and longitudes of the rows with both, as float arrays that
+    are views of float64 columns when no row is missing.
+    """
+    lats = df['latitude'].to_numpy(dtype=float)
+    lons = df['longitude'].to_numpy(dtype=float)
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    if not valid.all():
+        lats, lons = lats[valid], lons[valid]
+    return lats, lons
+
+
+def _center(lats, lons):
+    """Mean of the coordinates, or the origin when there are none."""
+    if not len(lats):
+        return [0, 0]
+    return [np.mean(lats), np.mean(lons)]
+
 
-    lats = df['latitude'].to_list()
-    lons = df['longitude'].to_list()
+# Marker drawn in the browser for each row [lat, lon, id, species] in fast
+# mode; the id and species are escaped in Python, as the popup is HTML
+MARKER_CALLBACK = """
+var callback = function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'bug', prefix: 'fa', markerColor: 'green'});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindPopup('Id: ' + row[2] + '\\n Especie:' + row[3]);
+    return marker;
+};
+"""
 
-    locations = list(zip(lats, lons))
+
+def create_markercluster(df, fast=False, cell_size=None):
+    """
+    Map with the observations clustered. The default adds one marker per
+    row from Python; with `fast=True` the rows are sent to the browser as
+    a compact array and the markers are created there. With `cell_size`
+    (in degrees) the points are binned in a grid and each non-empty cell
+    is drawn as one circle with its number of observations, so the size
+    of the map depends on the cells and not on the observations.
+    """
+    df = df.dropna(subset = ['latitude', 'longitude'])
+
+    lats = df['latitude'].to_numpy(dtype=float)
+    lons = df['longitude'].to_numpy(dtype=float)
 
     #Define coordinates of where we want to center our map
-    center = [np.mean(lats), np.mean(lons)]
+    center = _center(lats, lons)
     
     m = folium.Map(location=center, tiles="cartodb positron", zoom_start=1)
 
+    if cell_size is not None:
+        _add_grid(m, lats, lons, cell_size)
+        return m
+
+    if fast:
+        data = pd.DataFrame({
+            'latitude': lats,
+            'longitude': lons,
+            'id': df['id_old'].astype(str).map(escape).to_numpy(),
+            'species': df['species_guess'].fillna('').astype(str).map(escape).to_numpy(),
+        }).values.tolist()
+        FastMarkerCluster(data, callback=MARKER_CALLBACK).add_to(m)
+        return m
+
+    locations = list(zip(lats.tolist(), lons.tolist()))
+
     marker_cluster = MarkerCluster().add_to(m)
 
     for i in range(len(df)):
@@ -51,4 +120,57 @@ def create_markercluster(df):
             icon=folium.Icon(color="green", icon='bug', prefix='fa'),
         ).add_to(marker_cluster)
 
-    return m
\ No newline at end of file
+    return m
+
+
+def grid_bins(lats, lons, cell_size):
+    """
+    Bin points in a grid of `cell_size` degrees. Returns the mean latitude
+    and longitude and the number of points of each non-empty cell.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    cells = np.floor(np.column_stack([lats, lons]) / cell_size).astype(np.int64)
+    _, inverse, counts = np.unique(
+        cells, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    return (
+        np.bincount(inverse, weights=lats) / counts,
+        np.bincount(inverse, weights=lons) / counts,
+        counts,
+    )
+
+
+class GridCells(MacroElement):
+    """
+    Circles drawn in the browser from a compact array of grid cells
+    [lat, lon, count, radius], one per cell.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            (function(){
+                var data = {{ this.data|tojson }};
+                for (var i = 0; i < data.length; i++) {
+                    var cell = data[i];
+                    L.circleMarker([cell[0], cell[1]], {
+                        radius: cell[3], color: 'green', fill: true, fillOpacity: 0.6
+                    }).bindPopup(cell[2] + ' observations').addTo({{ this._parent.get_name() }});
+                }
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, data):
+        super().__init__()
+        self._name = "GridCells"
+        self.data = data
+
+
+def _add_grid(m, lats, lons, cell_size):
+    cell_lats, cell_lons, counts = grid_bins(lats, lons, cell_size)
+    radius = 4 + 3 * np.log10(counts)
+    data = np.column_stack([
+        cell_lats.round(6), cell_lons.round(6), counts, radius.round(1)]).tolist()
+    GridCells(data).add_to(m)
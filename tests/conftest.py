@@ -0,0 +1,20 @@
+"""
+Fixtures shared by the tests: a local stub of the API, the server the
+benchmarks run against, with no synthetic observations.
+"""
+
+import pytest
+
+from benchmarks.stub_server import StubNatusfera
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    """
+    Local HTTP server that answers the paths registered in `stub_api.pages`
+    ({"/path?query": json or bytes}) after `stub_api.latency` seconds, or
+    the (status, headers, body) answers queued in `stub_api.answers`.
+    """
+    with StubNatusfera(total=0) as stub:
+        monkeypatch.setattr("mecoda_nat.mecoda_nat.API_URL", stub.url)
+        yield stub
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import time
+import pandas as pd
+import pytest
+from mecoda_nat import Metrics, Observation, Project
+from mecoda_nat.mecoda_nat import _build_observations
+
+pytest.importorskip("aiohttp")
+from mecoda_nat import aio  # noqa: E402
+
+
+def test_aio_get_obs_overlaps_queries_on_one_client(stub_api) -> None:
+    stub_api.latency = 0.2
+    for year in [2018, 2019]:
+        stub_api.pages[f"/observations.json?year={year}&per_page=200"] = [
+            {"id": id_, "iconic_taxon_id": 3, "taxon": {"id": 7, "name": "Aves", "ancestry": "1/2"}}
+            for id_ in range(200)]
+        for page in range(2, 5):
+            size = 200 if page < 4 else 50
+            stub_api.pages[f"/observations.json?year={year}&per_page=200&page={page}"] = [
+                {"id": 200 * (page - 1) + id_} for id_ in range(size)]
+
+    async def main():
+        async with aio.AsyncNatusferaClient(metrics=Metrics()) as client:
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                aio.get_obs(year=2018, client=client),
+                aio.get_obs(year=2019, num_max=250, validate=False, client=client),
+            )
+            return results, time.perf_counter() - start, client.metrics
+
+    (first, second), elapsed, metrics = asyncio.run(main())
+
+    assert [obs.id for obs in first] == list(range(650))
+    assert first[:200] == _build_observations(
+        stub_api.pages["/observations.json?year=2018&per_page=200"])
+    assert [obs.id for obs in second] == list(range(250))
+    assert isinstance(second[0], Observation)
+    # seven pages fetched serially would take 1.4 seconds
+    assert elapsed < 1
+    # pages 2 to 5 of 2018 are requested together, 2019 needs two pages
+    assert metrics.as_dict()["requests"]["observations"]["count"] == 7
+
+
+def test_aio_get_obs_from_several_places(stub_api) -> None:
+    stub_api.pages["/places.json?q=Osona"] = [{"id": 30}, {"id": 31}]
+    stub_api.pages["/observations.json?place_id=30&per_page=200"] = [{"id": 5}, {"id": 4}]
+    stub_api.pages["/observations.json?place_id=31&per_page=200"] = [{"id": 4}, {"id": 2}]
+
+    result = asyncio.run(aio.get_obs(place_name="Osona"))
+
+    assert [(obs.id, obs.place_id) for obs in result] == [(5, 30), (4, 30), (2, 31)]
+
+
+def test_aio_get_project_retries_and_raises_when_not_found(stub_api) -> None:
+    stub_api.answers["/projects/806.json"] = [
+        (503, {"Retry-After": "0"}, b""),
+        (200, {}, json.dumps({"id": 806, "title": "urbamar"}).encode()),
+    ]
+    stub_api.answers["/projects/11.json"] = [(404, {}, b"{}")]
+
+    assert asyncio.run(aio.get_project(806)) == [Project(id=806, title="urbamar")]
+    assert stub_api.requests.count("/projects/806.json") == 2
+    with pytest.raises(ValueError):
+        asyncio.run(aio.get_project(11))
+
+
+def test_aio_client_frees_its_slot_while_waiting_to_retry(stub_api) -> None:
+    stub_api.answers["/projects/806.json"] = [
+        (503, {"Retry-After": "1"}, b""),
+        (200, {}, json.dumps({"id": 806}).encode()),
+    ]
+    stub_api.pages["/projects/11.json"] = {"id": 11}
+
+    async def main():
+        async with aio.AsyncNatusferaClient(
+                max_concurrency=1, rate_limiter=False) as client:
+            throttled = asyncio.ensure_future(client.get(f"{stub_api.url}/projects/806.json"))
+            await asyncio.sleep(0.2)
+            start = time.perf_counter()
+            other = await client.get(f"{stub_api.url}/projects/11.json")
+            elapsed = time.perf_counter() - start
+            return (await throttled).json(), other.json(), elapsed
+
+    throttled, other, elapsed = asyncio.run(main())
+
+    assert throttled == {"id": 806}
+    assert other == {"id": 11}
+    assert elapsed < 0.5
+
+
+def test_aio_extra_info_get_dwc_and_download_photos(stub_api, tmp_path) -> None:
+    for id_ in [1, 2]:
+        stub_api.pages[f"/observations/{id_}.json"] = {"identifications": [
+            {"user": {"login": "ana"}, "taxon": {"name": "Quercus"}},
+            {"user": {"login": "joan"}, "taxon": {"name": f"Quercus {id_}"}},
+        ]}
+        stub_api.pages[f"/observations.dwc?id={id_}"] = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<dwr:SimpleDarwinRecordSet'
+            ' xmlns:dwr="http://rs.tdwg.org/dwc/xsd/simpledarwincore/"'
+            ' xmlns:dwc="http://rs.tdwg.org/dwc/terms/">'
+            f'<dwr:SimpleDarwinRecord><dwc:catalogNumber>{id_}</dwc:catalogNumber>'
+            '</dwr:SimpleDarwinRecord></dwr:SimpleDarwinRecordSet>'
+        ).encode()
+        stub_api.pages[f"/photos/{id_}/medium/a.jpg"] = b"\xff" * 1000
+
+    df_obs = pd.DataFrame({"id": [1, 2, 1], "user_login": ["ana", "pau", "ana"]})
+    df_photos = pd.DataFrame({
+        "id": [1, 2],
+        "photos.medium_url": [f"{stub_api.url}/photos/{id_}/medium/a.jpg" for id_ in [1, 2]],
+        "path": ["1_10.jpg", "2_20.jpg"],
+    })
+
+    async def main():
+        async with aio.AsyncNatusferaClient() as client:
+            return await asyncio.gather(
+                aio.extra_info(df_obs, use_cache=False, client=client),
+                aio.get_dwc([Observation(id=1), Observation(id=2)], client=client),
+                aio.download_photos(df_photos, str(tmp_path / "photos"), client=client),
+            )
+
+    info, dwc, summary = asyncio.run(main())
+
+    assert info["last_taxon_name"].tolist() == ["Quercus 1", "Quercus 2", "Quercus 1"]
+    assert info["first_identification_match"].tolist() == ["True", "False", "True"]
+    assert dwc["catalogNumber"].tolist() == [1, 2]
+    assert summary["status"].tolist() == ["downloaded", "downloaded"]
+    assert (tmp_path / "photos" / "2_20.jpg").stat().st_size == 1000
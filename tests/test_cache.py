@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import pytest
+from mecoda_nat import (
+    get_count_by_taxon,
+    get_obs,
+    get_client,
+    set_client,
+    NatusferaClient,
+    ResponseCache,
+)
+from mecoda_nat.cache import endpoint, normalize_url
+from mecoda_nat.mecoda_nat import get_dwc_from_query
+
+API_URL = "https://natusfera.gbif.es"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    previous = get_client()
+    set_client(NatusferaClient(cache=cache))
+    yield cache
+    set_client(previous)
+    cache.close()
+
+
+def test_cache_serves_repeated_queries_offline(requests_mock, cache) -> None:
+    requests_mock.get(
+        f"{API_URL}/taxa.json", json=[{"name": "Fungi", "observations_count": 3}])
+
+    first = get_count_by_taxon()
+    requests_mock.get(f"{API_URL}/taxa.json", status_code=500)
+    second = get_count_by_taxon()
+
+    assert first == second == {"Fungi": 3}
+    assert requests_mock.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats()["entries"] == 1
+
+
+def test_cache_keys_ignore_argument_order() -> None:
+    assert normalize_url(f"{API_URL}/observations.json?year=2018&per_page=200") == (
+        normalize_url(f"{API_URL}/observations.json?per_page=200&year=2018"))
+    assert endpoint(f"{API_URL}/observations/project/806.json") == "observations"
+    assert endpoint(f"{API_URL}/observations.dwc?id=3") == "dwc"
+    assert endpoint(f"{API_URL}/attachments/local_photos/files/1/medium/a.jpg") is None
+
+
+def test_cache_expires_answers_by_endpoint_ttl(requests_mock, tmp_path) -> None:
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), ttl={"taxa": 0.05})
+    cache.set(f"{API_URL}/taxa.json", 200, {}, b"[]")
+    cache.set(f"{API_URL}/projects/806.json", 200, {}, b"{}")
+
+    assert cache.get(f"{API_URL}/taxa.json") is not None
+    time.sleep(0.1)
+    assert cache.get(f"{API_URL}/taxa.json") is None
+    assert cache.get(f"{API_URL}/projects/806.json") is not None
+
+
+def test_cache_evicts_least_recently_used(tmp_path) -> None:
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_bytes=25)
+    for year in [2018, 2019]:
+        cache.set(f"{API_URL}/observations.json?year={year}", 200, {}, b"x" * 10)
+    cache.get(f"{API_URL}/observations.json?year=2018")
+    cache.set(f"{API_URL}/observations.json?year=2020", 200, {}, b"x" * 10)
+
+    assert cache.get(f"{API_URL}/observations.json?year=2018") is not None
+    assert cache.get(f"{API_URL}/observations.json?year=2019") is None
+    assert cache.stats()["bytes"] == 20
+
+
+def test_cache_bypass_and_refresh(requests_mock, cache) -> None:
+    url = f"{API_URL}/observations.json?year=2018&per_page=200"
+    requests_mock.get(url, json=[{"id": 1}])
+    get_obs(year=2018)
+
+    requests_mock.get(url, json=[{"id": 2}])
+    with cache.bypass():
+        assert [obs.id for obs in get_obs(year=2018)] == [2]
+    assert [obs.id for obs in get_obs(year=2018)] == [1]
+    with cache.refresh():
+        assert [obs.id for obs in get_obs(year=2018)] == [2]
+    assert [obs.id for obs in get_obs(year=2018)] == [2]
+    assert requests_mock.call_count == 3
+
+
+def test_cache_modes_apply_to_their_thread_and_its_workers(requests_mock, cache) -> None:
+    url = f"{API_URL}/observations.json?year=2018&per_page=200"
+    requests_mock.get(url, json=[{"id": id_} for id_ in range(200)])
+    requests_mock.get(f"{url}&page=2", json=[{"id": 200}])
+    get_obs(year=2018)
+
+    requests_mock.get(f"{url}&page=2", json=[{"id": 201}])
+    with cache.bypass(), cache.refresh():
+        other = threading.Thread(target=lambda: results.append(get_obs(year=2018)))
+        results = []
+        other.start()
+        other.join()
+        assert get_obs(year=2018)[-1].id == 201
+    assert results[0][-1].id == 200
+    assert get_obs(year=2018)[-1].id == 200
+    assert cache.stats()["bytes"] == cache._size
+
+
+def test_cache_serves_streamed_dwc_pages(requests_mock, cache) -> None:
+    document = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<dwr:SimpleDarwinRecordSet'
+        ' xmlns:dwr="http://rs.tdwg.org/dwc/xsd/simpledarwincore/"'
+        ' xmlns:dwc="http://rs.tdwg.org/dwc/terms/">'
+        "<dwr:SimpleDarwinRecord><dwc:catalogNumber>7</dwc:catalogNumber>"
+        "</dwr:SimpleDarwinRecord></dwr:SimpleDarwinRecordSet>"
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=1", text=document)
+
+    first = get_dwc_from_query(year=2020)
+    second = get_dwc_from_query(year=2020)
+
+    assert first["catalogNumber"].to_list() == second["catalogNumber"].to_list() == [7]
+    assert requests_mock.call_count == 1
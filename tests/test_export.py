@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import os
+import pytest
+import pandas as pd
+from mecoda_nat import Observation, Photo, get_dfs, read_parquet, to_arrow, to_parquet
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def dfs():
+    observations = [
+        Observation(
+            id=3, observed_on="2020-05-01", iconic_taxon="fungi", quality_grade="research",
+            user_login="ana", user_id=1, taxon_id=48460, latitude=41.4, longitude=2.1,
+            photos=[Photo(id=30, medium_url="m30.jpg"), Photo(id=31, medium_url="m31.jpg")],
+        ),
+        Observation(id=2, observed_on="2021-06-01", iconic_taxon="aves", user_login="ana"),
+        Observation(id=1, iconic_taxon="fungi", user_login="joan"),
+    ]
+    return get_dfs(observations)
+
+
+def test_to_arrow_has_a_stable_schema(dfs) -> None:
+    df_obs, df_photos = dfs
+
+    table = to_arrow(df_obs)
+    empty = to_arrow(df_obs.iloc[:0].drop(columns=["genus"]))
+
+    assert table.schema == empty.schema
+    assert table.schema.field("taxon_id").type == pa.int64()
+    for name in ["iconic_taxon", "quality_grade", "user_login", "kingdom", "genus"]:
+        assert pa.types.is_dictionary(table.schema.field(name).type)
+    assert table.column("taxon_id").to_pylist() == [48460, None, None]
+    photos = to_arrow(df_photos, "photos")
+    assert photos.column("photos.id").to_pylist() == [30, 31, None, None]
+
+
+def test_to_parquet_round_trip(dfs, tmp_path) -> None:
+    df_obs, df_photos = dfs
+    path = str(tmp_path / "observations.parquet")
+
+    assert to_parquet(df_obs, path) == path
+    result = read_parquet(path)
+
+    assert result["id"].to_list() == [3, 2, 1]
+    assert result["iconic_taxon"].dtype == "category"
+    assert result["observed_on"].to_list()[:2] == [
+        pd.Timestamp(2020, 5, 1), pd.Timestamp(2021, 6, 1)]
+
+
+def test_to_parquet_partitions_by_year_and_iconic_taxon(dfs, tmp_path) -> None:
+    df_obs, df_photos = dfs
+    path = str(tmp_path / "observations")
+
+    to_parquet(df_obs, path, partition_by=["year", "iconic_taxon"])
+
+    assert sorted(os.listdir(path)) == [
+        "year=2020", "year=2021", "year=__HIVE_DEFAULT_PARTITION__"]
+    assert os.listdir(os.path.join(path, "year=2020")) == ["iconic_taxon=fungi"]
+    result = read_parquet(path, filters=[("year", "=", 2020)])
+    assert result["id"].to_list() == [3]
+    assert sorted(read_parquet(path)["id"]) == [1, 2, 3]
+    with pytest.raises(ValueError):
+        to_parquet(df_photos, str(tmp_path / "photos"), "photos", partition_by=["year"])
+
+
+def test_to_arrow_types_dwc_fields() -> None:
+    df = pd.DataFrame({
+        "catalogNumber": ["7", "8"],
+        "decimalLatitude": ["41.5", None],
+        "basisOfRecord": ["HumanObservation", "HumanObservation"],
+        "eventDate": ["2021-03-15", "2021-03-16"],
+    })
+
+    table = to_arrow(df, "dwc")
+
+    assert table.schema.names == list(df.columns)
+    assert table.column("catalogNumber").to_pylist() == [7, 8]
+    assert table.column("decimalLatitude").to_pylist() == [41.5, None]
+    assert pa.types.is_dictionary(table.schema.field("basisOfRecord").type)
+    assert table.schema.field("eventDate").type == pa.string()
+
+
+def test_to_arrow_reports_values_that_do_not_fit(capsys) -> None:
+    df = pd.DataFrame({"catalogNumber": ["7", "x", "8.5", "", None]})
+
+    with pytest.raises(ValueError, match="2 values of catalogNumber"):
+        to_arrow(df, "dwc")
+    table = to_arrow(df, "dwc", errors="coerce")
+
+    assert table.column("catalogNumber").to_pylist() == [7, None, None, None, None]
+    assert "2 values of catalogNumber" in capsys.readouterr().out
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import pytest
+from mecoda_nat import Metrics, NatusferaClient, get_client, get_dfs, get_obs, set_client
+
+API_URL = "https://natusfera.gbif.es"
+
+
+@pytest.fixture
+def metrics():
+    metrics = Metrics(buckets=[0.5, 60])
+    previous = get_client()
+    set_client(NatusferaClient(metrics=metrics))
+    yield metrics
+    set_client(previous)
+
+
+def test_metrics_record_requests_pages_and_stages(requests_mock, metrics) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200",
+        json=[{"id": id_} for id_ in range(200)],
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200&page=2",
+        json=[{"id": 200}],
+    )
+    requests_mock.get(f"{API_URL}/projects/11.json", status_code=404, text="{}")
+
+    observations = get_obs(year=2018, max_workers=1)
+    get_dfs(observations)
+    get_client().get(f"{API_URL}/projects/11.json")
+    result = metrics.as_dict()
+
+    requests = result["requests"]["observations"]
+    assert requests["count"] == 2
+    assert requests["status"] == {200: 2}
+    assert requests["bytes"] > 0
+    assert requests["latency"][60] == requests["latency"][float("inf")] == 2
+    assert result["requests"]["projects"]["status"] == {404: 1}
+    assert result["pages"] == {"observations": {"pages": 2, "records": 201}}
+    assert result["stages"]["parse"]["records"] == 201
+    assert result["stages"]["build_observations"]["calls"] == 2
+    assert result["stages"]["get_dfs"]["records"] == 201
+    assert result["stages"]["taxon_columns"]["calls"] == 1
+
+    text = metrics.to_prometheus()
+    assert '# TYPE mecoda_nat_request_seconds histogram' in text
+    assert 'mecoda_nat_requests_total{endpoint="projects",status="404"} 1' in text
+    assert 'mecoda_nat_request_seconds_bucket{endpoint="observations",le="+Inf"} 2' in text
+    assert 'mecoda_nat_request_seconds_count{endpoint="observations"} 2' in text
+    assert 'mecoda_nat_pages_total{endpoint="observations"} 2' in text
+
+    metrics.reset()
+    assert metrics.as_dict() == {"requests": {}, "pages": {}, "stages": {}}
+    assert metrics.to_prometheus() == ""
+
+
+def test_metrics_are_not_recorded_without_metrics(requests_mock) -> None:
+    requests_mock.get(f"{API_URL}/observations.json?per_page=200", json=[{"id": 1}])
+
+    assert get_client().metrics is None
+    assert [obs.id for obs in get_obs()] == [1]
@@ -1,19 +1,40 @@
 #!/usr/bin/env python3
 
 import datetime
+import io
+import json
+import os
+import re
+import time
 import pytest
+import requests
 import pandas as pd
 from mecoda_nat import (
     get_project,
     get_obs,
+    iter_obs,
+    get_obs_sharded,
     get_count_by_taxon,
     get_dfs,
+    download_photos,
     Project,
     Observation,
     Photo,
     TAXONS,
-    ICONIC_TAXON
+    ICONIC_TAXON,
+    NatusferaClient,
+    get_client,
+    set_client,
 )
+from mecoda_nat.mecoda_nat import (
+    _build_observations,
+    _get_taxon_columns,
+    extra_info,
+    get_dwc,
+    get_dwc_from_query,
+    _clean_dwc,
+)
+from mecoda_nat.dwc import DwcWriter
 
 API_URL = "https://natusfera.gbif.es"
 
@@ -438,7 +459,7 @@ def test_get_obs_from_place_name_returns_obs(requests_mock,) -> None:
         f"{API_URL}/observations.json?place_id=20&per_page=200&page=2",
         json=[{
             "id": id_, 
-            'updated_at': '2020-09-26T05:07:36-10:00',} for id_ in range(56)]
+            'updated_at': '2020-09-26T05:07:36-10:00',} for id_ in range(200, 256)]
         )
     requests_mock.get(
         f"{API_URL}/observations.json?place_id=67&per_page=200",
@@ -448,7 +469,7 @@ def test_get_obs_from_place_name_returns_obs(requests_mock,) -> None:
         f"{API_URL}/observations.json?place_id=1024&per_page=200",
         json=[{
             "id": id_, 
-            'updated_at': '2020-09-26T05:07:36-10:00',} for id_ in range(5)]
+            'updated_at': '2020-09-26T05:07:36-10:00',} for id_ in range(256, 261)]
         )
     
     result = get_obs(place_name="Barcelona")
@@ -462,6 +483,33 @@ def test_get_obs_from_place_name_returns_obs(requests_mock,) -> None:
 
     assert type(result[0].updated_at) == datetime.datetime
 
+def test_get_obs_from_several_places_merges_repeated_obs(requests_mock,) -> None:
+    places = requests_mock.get(
+        f"{API_URL}/places.json?q=Girona",
+        json=[{'id': 30}, {'id': 31}]
+        )
+    requests_mock.get(
+        f"{API_URL}/observations.json?place_id=30&per_page=200",
+        json=[{"id": id_} for id_ in [5, 4, 3]]
+        )
+    requests_mock.get(
+        f"{API_URL}/observations.json?place_id=31&per_page=200",
+        json=[{"id": id_, "place_id": 99} for id_ in [4, 2]]
+        )
+    requests_mock.get(
+        f"{API_URL}/observations.json?place_id=32&per_page=200",
+        json=[{"id": 1}]
+        )
+
+    result = get_obs(place_name="Girona", place_id=[32, 30])
+    again = get_obs(place_name="Girona", validate=False)
+
+    assert [(obs.id, obs.place_id) for obs in result] == [
+        (1, 32), (5, 30), (4, 30), (3, 30), (2, 99)]
+    assert [obs.id for obs in again] == [5, 4, 3, 2]
+    assert places.call_count == 1
+    assert [obs.id for obs in get_obs(place_id=[30, 31], num_max=4)] == [5, 4, 3, 2]
+
 # test para nombre de place_name que no devuelve nada
 def test_get_obs_from_place_name_returns_no_obs(requests_mock,) -> None:
     requests_mock.get(
@@ -473,6 +521,24 @@ def test_get_obs_from_place_name_returns_no_obs(requests_mock,) -> None:
     
     assert len(result) == 0
 
+def test_get_obs_from_place_name_encodes_it_and_caches_only_found_places(
+    requests_mock,
+) -> None:
+    places = requests_mock.get(
+        f"{API_URL}/places.json?q=Vic%20%26%20Osona%23",
+        [{"status_code": 404, "json": {}}, {"json": [{"id": 40}]}],
+        )
+    requests_mock.get(
+        f"{API_URL}/observations.json?place_id=40&per_page=200",
+        json=[{"id": 1}]
+        )
+
+    assert get_obs(place_name="Vic & Osona#") == []
+    assert [obs.id for obs in get_obs(place_name="Vic & Osona#")] == [1]
+    assert [obs.id for obs in get_obs(place_name="Vic & Osona#")] == [1]
+    assert places.call_count == 2
+    assert places.last_request.qs == {"q": ["vic & osona#"]}
+
 # test de uso de la función con taxon en minúsculas
 def test_get_obs_from_taxon_min_returns_info(requests_mock,) -> None:
     requests_mock.get(
@@ -632,3 +698,616 @@ def test_get_dfs_extrae_dfs(requests_mock,) -> None:
     
     #assert result_photo == expected_result_photo
 
+
+
+def test_get_taxon_columns_resolves_ancestry_levels() -> None:
+    df_obs = pd.DataFrame({
+        "id": [1, 2, 3, 4, 5],
+        "taxon_ancestry": [
+            "1/2/10/11/82/1049/1048",
+            "1/13/17/130/371/2958",
+            None,
+            "1/2/99999999",
+            "1/2/10/11/82/1049/1048",
+        ],
+    })
+
+    _get_taxon_columns(df_obs)
+
+    assert "taxon_ancestry" not in df_obs.columns
+    assert df_obs.loc[0, ["kingdom", "phylum", "class", "order", "family"]].to_list() == [
+        "Animalia", "Arthropoda", "Insecta", "Hemiptera", "Cicadellidae"]
+    assert pd.isna(df_obs.loc[0, "genus"])
+    assert df_obs.loc[1, "family"] == "Geoglossaceae"
+    assert df_obs.loc[2, ["kingdom", "genus"]].isna().all()
+    # an unknown id invalidates the whole ancestry
+    assert df_obs.loc[3, ["kingdom", "phylum"]].isna().all()
+    assert df_obs.loc[4, "order"] == "Hemiptera"
+
+
+def test_get_obs_fetches_pages_concurrently_in_order(stub_api,) -> None:
+    stub_api.latency = 0.2
+    stub_api.pages["/observations.json?year=2018&per_page=200"] = [
+        {"id": id_} for id_ in range(200)]
+    for page in range(2, 9):
+        size = 200 if page < 8 else 50
+        stub_api.pages[f"/observations.json?year=2018&per_page=200&page={page}"] = [
+            {"id": 200 * (page - 1) + id_} for id_ in range(size)]
+
+    start = time.perf_counter()
+    result = get_obs(year=2018, max_workers=8)
+    elapsed = time.perf_counter() - start
+
+    assert [obs.id for obs in result] == list(range(7 * 200 + 50))
+    # eight pages fetched serially would take 1.6 seconds
+    assert elapsed < 1
+
+
+def test_get_obs_with_num_max_stops_requesting_pages(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200",
+        json=[{"id": id_} for id_ in range(200)],
+    )
+    for page in range(2, 99):
+        requests_mock.get(
+            f"{API_URL}/observations.json?year=2018&per_page=200&page={page}",
+            json=[{"id": id_} for id_ in range(200 * (page - 1), 200 * page)],
+        )
+
+    result = get_obs(year=2018, num_max=450, max_workers=4)
+
+    assert [obs.id for obs in result] == list(range(450))
+    requested_pages = [
+        request.qs.get("page", ["1"])[0] for request in requests_mock.request_history]
+    assert sorted(requested_pages) == ["1", "2", "3"]
+
+
+def test_get_obs_raises_when_a_page_fails(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200",
+        json=[{"id": id_} for id_ in range(200)],
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200&page=2", status_code=503)
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200&page=3",
+        json=[{"id": 400}],
+    )
+
+    with pytest.raises(requests.HTTPError, match="503"):
+        get_obs(year=2018, max_workers=1)
+
+
+def test_api_calls_go_through_the_shared_client(requests_mock,) -> None:
+    class CountingClient(NatusferaClient):
+        calls = []
+
+        def get(self, url, **kwargs):
+            self.calls.append(url)
+            return super().get(url, **kwargs)
+
+    requests_mock.get(
+        f"{API_URL}/taxa.json", json=[{"name": "Fungi", "observations_count": 3}])
+    requests_mock.get(
+        f"{API_URL}/projects/806.json", json={"id": 806, "title": "urbamar"})
+    previous = get_client()
+    client = CountingClient(retries=1, timeout=5)
+    set_client(client)
+    try:
+        get_count_by_taxon()
+        get_project(806)
+    finally:
+        set_client(previous)
+
+    assert client.calls == [f"{API_URL}/taxa.json", f"{API_URL}/projects/806.json"]
+    assert get_client() is previous
+    adapter = client.session.get_adapter(API_URL)
+    assert adapter.max_retries.total == 1
+    assert 503 in adapter.max_retries.status_forcelist
+
+
+def test_iter_obs_yields_observations_as_pages_arrive(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200",
+        json=[{"id": id_} for id_ in range(200)],
+    )
+    for page in range(2, 99):
+        requests_mock.get(
+            f"{API_URL}/observations.json?year=2018&per_page=200&page={page}",
+            json=[{"id": id_} for id_ in range(200 * (page - 1), 200 * page)],
+        )
+
+    observations = iter_obs(year=2018, max_workers=2)
+    first = [next(observations) for _ in range(200)]
+    observations.close()
+
+    assert [obs.id for obs in first] == list(range(200))
+    # only the first page and the window of pages in flight were requested
+    assert requests_mock.call_count <= 3
+
+
+def test_iter_obs_by_page_yields_batches(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200",
+        json=[{"id": id_} for id_ in range(200)],
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2018&per_page=200&page=2",
+        json=[{"id": id_} for id_ in range(200, 260)],
+    )
+
+    batches = list(iter_obs(year=2018, num_max=230, by_page=True))
+
+    assert [len(batch) for batch in batches] == [200, 30]
+    assert batches[1][-1].id == 229
+
+
+def test_download_photos_resumes_and_reports_summary(requests_mock, tmp_path) -> None:
+    photo_url = "https://natusfera.gbif.es/attachments/local_photos/files/{}/{}/a.jpg"
+    for id_ in range(4):
+        requests_mock.get(
+            photo_url.format(id_, "small"),
+            content=b"x" * (10 + id_),
+            headers={"Content-Length": str(10 + id_)},
+        )
+        # the size of the last photo is unknown without downloading it
+        requests_mock.head(
+            photo_url.format(id_, "small"),
+            headers={"Content-Length": str(10 + id_)} if id_ < 3 else {},
+        )
+    requests_mock.get(photo_url.format(4, "small"), status_code=404)
+    df_photos = pd.DataFrame({
+        "photos.medium_url": [photo_url.format(id_, "medium") for id_ in range(5)],
+        "path": [f"{id_}_{id_}.jpg" for id_ in range(5)],
+    })
+    directory = tmp_path / "photos"
+    directory.mkdir()
+    (directory / "0_0.jpg").write_bytes(b"x" * 10)  # complete, from a previous run
+    (directory / "1_1.jpg").write_bytes(b"x" * 3)  # truncated
+    (directory / "3_3.jpg").write_bytes(b"x" * 13)  # unknown size
+
+    summary = download_photos(df_photos, str(directory), size="small", max_workers=3)
+
+    assert summary["status"].to_list() == [
+        "skipped", "downloaded", "downloaded", "downloaded", "failed"]
+    assert summary["bytes"].to_list() == [0, 11, 12, 13, 0]
+    assert [request.method for request in requests_mock.request_history].count("HEAD") == 3
+    assert summary.loc[4, "error"] == "HTTP 404"
+    assert (summary.attrs["downloaded"], summary.attrs["skipped"], summary.attrs["failed"]) == (
+        3, 1, 1)
+    assert (directory / "1_1.jpg").read_bytes() == b"x" * 11
+    assert not list(directory.glob("*.part"))
+    assert df_photos.loc[2, "abs_path"] == str(directory / "2_2.jpg")
+
+
+def test_download_photos_warns_when_a_size_cannot_be_derived(
+    requests_mock, tmp_path, capsys
+) -> None:
+    requests_mock.get("https://example.org/photo.jpg", content=b"x")
+    df_photos = pd.DataFrame({
+        "photos.medium_url": ["https://example.org/photo.jpg"], "path": ["1_1.jpg"]})
+
+    summary = download_photos(df_photos, str(tmp_path), size="large")
+
+    assert summary["status"].to_list() == ["downloaded"]
+    assert "WARNING: 1 photos have no large url" in capsys.readouterr().out
+
+
+def test_download_photos_rejects_unknown_size(tmp_path) -> None:
+    with pytest.raises(ValueError):
+        download_photos(pd.DataFrame(), str(tmp_path), size="huge")
+
+
+def test_extra_info_adds_identification_columns_and_caches(requests_mock,) -> None:
+    def identification(login, *names):
+        return [{"user": {"login": login}, "taxon": {"name": name}} for name in names]
+
+    requests_mock.get(
+        f"{API_URL}/observations/9001.json",
+        json={"identifications": identification("ana", "Quercus", "Quercus ilex")},
+    )
+    requests_mock.get(
+        f"{API_URL}/observations/9002.json",
+        json={"identifications": identification("joan", "Hedera")},
+    )
+    requests_mock.get(
+        f"{API_URL}/observations/9003.json", json={"identifications": []})
+    df_observations = pd.DataFrame({
+        "id": [9001, 9002, 9003, 9001],
+        "user_login": ["ana", "pere", "rosa", "ana"],
+    })
+
+    result = extra_info(df_observations.copy())
+
+    assert result["first_identification"].to_list() == ["ana", "joan", "0", "ana"]
+    assert result["last_taxon_name"].to_list() == [
+        "Quercus ilex", "Hedera", "0", "Quercus ilex"]
+    assert result["first_taxon_match"].to_list() == ["False", "True", "True", "False"]
+    assert result["first_identification_match"].to_list() == [
+        "True", "False", "False", "True"]
+    assert requests_mock.call_count == 3
+
+    again = extra_info(df_observations.iloc[[1, 2]].copy())
+
+    assert again["first_taxon_name"].to_list() == ["Hedera", "0"]
+    assert requests_mock.call_count == 3
+
+
+def test_extra_info_cache_is_bounded_and_keyed_by_api_url(requests_mock, monkeypatch) -> None:
+    monkeypatch.setattr("mecoda_nat.mecoda_nat.IDENTIFICATIONS_MAX", 1)
+    for url in [API_URL, "https://other.example"]:
+        for id_num in [9101, 9102]:
+            requests_mock.get(
+                f"{url}/observations/{id_num}.json", json={"identifications": []})
+    df_observations = pd.DataFrame({"id": [9101, 9102], "user_login": ["ana", "pere"]})
+
+    extra_info(df_observations.copy())
+    extra_info(df_observations.iloc[[1]].copy())
+    assert requests_mock.call_count == 2
+    extra_info(df_observations.iloc[[0]].copy())
+    assert requests_mock.call_count == 3
+
+    monkeypatch.setattr("mecoda_nat.mecoda_nat.API_URL", "https://other.example")
+    extra_info(df_observations.iloc[[0]].copy())
+    assert requests_mock.request_history[-1].url.startswith("https://other.example")
+
+
+def dwc_xml(ids):
+    records = "".join(
+        "<dwr:SimpleDarwinRecord>"
+        f"<dwc:catalogNumber>{id_}</dwc:catalogNumber>"
+        "<dwc:institutionCode>iNaturalist</dwc:institutionCode>"
+        "<dwc:datasetName>iNaturalist research-grade observations</dwc:datasetName>"
+        "</dwr:SimpleDarwinRecord>"
+        for id_ in ids
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<dwr:SimpleDarwinRecordSet'
+        ' xmlns:dwr="http://rs.tdwg.org/dwc/xsd/simpledarwincore/"'
+        ' xmlns:dwc="http://rs.tdwg.org/dwc/terms/">'
+        f"{records}</dwr:SimpleDarwinRecordSet>"
+    )
+
+
+@pytest.mark.parametrize("chunk_size, urls", [
+    (1, ["id=1", "id=2", "id=3", "id=4", "id=5"]),
+    (2, ["id=1,2", "id=3,4", "id=5"]),
+])
+def test_get_dwc_requests_ids_in_chunks(requests_mock, chunk_size, urls) -> None:
+    def answer(request, context):
+        return dwc_xml(request.qs["id"][0].split(","))
+
+    requests_mock.get(f"{API_URL}/observations.dwc", text=answer)
+    observations = [Observation(id=id_) for id_ in range(1, 6)]
+
+    result = get_dwc(observations, chunk_size=chunk_size)
+
+    assert result["catalogNumber"].to_list() == [1, 2, 3, 4, 5]
+    assert (result["institutionCode"] == "Natusfera").all()
+    assert (result["datasetName"] == "Natusfera research-grade observations").all()
+    assert sorted(
+        request.url.split("?")[1] for request in requests_mock.request_history
+    ) == urls
+
+
+def test_get_dwc_from_query_streams_pages_until_a_short_one(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=1",
+        text=dwc_xml(range(200)),
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=2",
+        text=dwc_xml(range(200, 213)),
+    )
+
+    result = get_dwc_from_query(year=2020)
+
+    assert result["catalogNumber"].to_list() == list(range(213))
+    assert (result["institutionCode"] == "Natusfera").all()
+    assert requests_mock.call_count == 2
+    expected = pd.read_xml(io.StringIO(dwc_xml(range(200))), parser="etree")
+    pd.testing.assert_frame_equal(
+        result.iloc[:200], _clean_dwc(expected), check_like=True)
+
+
+def test_get_dwc_from_query_raises_when_a_page_fails(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=1",
+        text=dwc_xml(range(200)),
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=2",
+        status_code=503,
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=3",
+        text=dwc_xml(range(400, 410)),
+    )
+
+    with pytest.raises(requests.HTTPError, match="HTTP 503"):
+        get_dwc_from_query(year=2020)
+
+
+def test_get_dwc_from_query_returns_none_without_records(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=1",
+        text=dwc_xml([]),
+    )
+
+    assert get_dwc_from_query(year=2020) is None
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+def test_get_dwc_from_query_writes_pages_to_file(requests_mock, tmp_path, extension) -> None:
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=1",
+        text=dwc_xml(range(200)),
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.dwc?year=2020&per_page=200&page=2",
+        text=dwc_xml(range(200, 250)),
+    )
+    output = str(tmp_path / f"dwc.{extension}")
+
+    result = get_dwc_from_query(year=2020, output=output)
+
+    assert result == output
+    df = pd.read_csv(output) if extension == "csv" else pd.read_parquet(output)
+    assert df["catalogNumber"].astype(int).to_list() == list(range(250))
+    assert (df["institutionCode"] == "Natusfera").all()
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+def test_dwc_writer_keeps_columns_of_later_pages(tmp_path, extension) -> None:
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+    output = str(tmp_path / f"dwc.{extension}")
+    writer = DwcWriter(output)
+    writer.write(pd.DataFrame({"catalogNumber": [1, 2]}))
+    writer.write(pd.DataFrame({"catalogNumber": [3], "recordedBy": ["ana"]}))
+    writer.close()
+
+    df = pd.read_csv(output) if extension == "csv" else pd.read_parquet(output)
+    assert df.columns.to_list() == ["catalogNumber", "recordedBy"]
+    assert df["recordedBy"].isna().to_list() == [True, True, False]
+    assert os.listdir(tmp_path) == [f"dwc.{extension}"]
+
+
+def legacy_get_dfs(observations):
+    """get_dfs as it was before the columnar conversion, for parity checks."""
+    df = pd.DataFrame([obs.dict() for obs in observations])
+    df["taxon_id"] = df["taxon_id"].astype(float).apply(lambda x: f"{x:.0f}")
+
+    df_observations = df.drop(["photos"], axis=1)
+    for column in ["created_at", "updated_at"]:
+        df_observations[column] = (
+            df_observations[column].apply(lambda x: x.date()).astype("datetime64[ns]"))
+    df_observations["observed_on"] = df_observations["observed_on"].astype(
+        "datetime64[ns]")
+    _get_taxon_columns(df_observations)
+
+    df_photos = df[
+        ["id", "photos", "iconic_taxon", "taxon_name", "user_login", "latitude", "longitude"]
+    ]
+    df_photos = df_photos.explode("photos").reset_index(drop=True)
+    df_photos["photos.id"] = df_photos.photos.str.get("id")
+    df_photos["photos.medium_url"] = df_photos.photos.str.get("medium_url")
+    df_photos = df_photos[[
+        "id", "photos.id", "iconic_taxon", "taxon_name", "photos.medium_url",
+        "user_login", "latitude", "longitude",
+    ]]
+    df_photos["photos.id"] = (
+        df_photos["photos.id"].astype(float).apply(lambda x: f"{x:.0f}"))
+    df_photos["path"] = (
+        df_photos["id"].astype(str) + "_" + df_photos["photos.id"].astype(str) + ".jpg")
+
+    return df_observations, df_photos
+
+
+def raw_observations():
+    photo = {
+        "large_url": "https://natusfera.gbif.es/l.jpg",
+        "medium_url": "https://natusfera.gbif.es/m.jpg",
+        "small_url": "https://natusfera.gbif.es/s.jpg",
+    }
+    return [
+        {
+            "id": 2084,
+            "captive": "false",
+            "created_at": "2016-07-11T00:10:39+02:00",
+            "updated_at": "2016-07-28T23:44:44-10:00",
+            "observed_on": "2016-07-06",
+            "description": "Alga\r\nroja",
+            "iconic_taxon_id": 16,
+            "taxon": {"id": 2850, "name": "Rissoella", "ancestry": "1/2/10/11/82/1049/1048"},
+            "latitude": "41.773743",
+            "longitude": "3.021853",
+            "place_guess": " Girona,\r\nCatalunya ",
+            "quality_grade": "research",
+            "user_id": 626,
+            "user_login": "amxatrac",
+            "photos": [dict(photo, id=1975), dict(photo, id=2075)],
+            "num_identification_agreements": 3,
+            "num_identification_disagreements": 0,
+        },
+        {
+            "id": 2085,
+            "created_at": "2016-07-12T10:10:39+00:00",
+            "updated_at": "2016-07-12T10:10:39+00:00",
+            "observed_on": "2016-07-07",
+            "iconic_taxon_id": 99,
+            "taxon": None,
+            "latitude": None,
+            "longitude": None,
+            "user_id": 7,
+            "photos": [dict(photo, id=3)],
+            "observation_photos": [{"id": 4, "photo": dict(photo, medium_url="op.jpg")}],
+        },
+        {
+            "id": 2086,
+            "created_at": "2017-01-01T10:10:39+01:00",
+            "updated_at": "2017-01-02T10:10:39+01:00",
+            "iconic_taxon_id": 13,
+            "taxon": {"id": 1, "name": "Life", "ancestry": None},
+            "latitude": 40.1,
+            "longitude": -7.5,
+            "user_id": 8,
+            "id_please": True,
+        },
+    ]
+
+
+def test_get_dfs_matches_previous_conversion() -> None:
+    observations = _build_observations(raw_observations())
+
+    result_obs, result_photos = get_dfs(observations)
+    expected_obs, expected_photos = legacy_get_dfs(observations)
+
+    pd.testing.assert_frame_equal(result_obs, expected_obs)
+    pd.testing.assert_frame_equal(result_photos, expected_photos)
+    assert result_obs["taxon_id"].to_list() == ["2850", "nan", "1"]
+    assert result_photos["path"].to_list() == [
+        "2084_1975.jpg", "2084_2075.jpg", "2085_4.jpg", "2086_nan.jpg"]
+
+
+def test_get_dfs_from_raw_observations_matches_models() -> None:
+    raw = raw_observations()
+
+    result_obs, result_photos = get_dfs(raw)
+    expected_obs, expected_photos = get_dfs(_build_observations(raw_observations()))
+
+    pd.testing.assert_frame_equal(result_obs, expected_obs)
+    pd.testing.assert_frame_equal(result_photos, expected_photos)
+    assert result_obs.loc[0, "place_name"] == "Girona, Catalunya"
+    assert result_obs.loc[0, "created_at"] == pd.Timestamp(2016, 7, 11)
+
+
+def test_iter_obs_raw_yields_api_dicts(requests_mock,) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2016&per_page=200",
+        json=raw_observations(),
+    )
+
+    raw = list(iter_obs(year=2016, raw=True))
+
+    assert raw == raw_observations()
+    assert len(get_dfs(raw)[1]) == 4
+
+
+def test_build_observations_does_not_modify_the_data() -> None:
+    raw = raw_observations()
+    raw[0]["observation_photos"] = [{"id": 5, "photo": {"medium_url": "incomplete.jpg"}}]
+    expected = json.loads(json.dumps(raw))
+
+    observations = _build_observations(raw)
+
+    assert raw == expected
+    assert observations[0].place_name == "Girona, Catalunya"
+    assert observations[0].description == "Alga roja"
+    assert [photo.id for photo in observations[0].photos] == [1975, 2075]
+    assert [photo.medium_url for photo in observations[1].photos] == ["op.jpg"]
+    assert observations[1].taxon_id is None and observations[1].iconic_taxon is None
+    assert observations[2].iconic_taxon == "fungi"
+    assert observations[2].taxon_ancestry is None
+
+
+def test_build_observations_without_validation_matches_models() -> None:
+    raw = raw_observations()
+
+    result = _build_observations(raw, validate=False)
+
+    assert raw == raw_observations()
+    assert result == _build_observations(raw_observations())
+    assert [obs.json() for obs in result] == [
+        obs.json() for obs in _build_observations(raw_observations())]
+    assert result[0].captive is False
+    assert result[0].created_at == datetime.datetime(
+        2016, 7, 11, 0, 10, 39, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert result[1].photos == [Photo(id=4, large_url="https://natusfera.gbif.es/l.jpg",
+                                      medium_url="op.jpg", small_url="https://natusfera.gbif.es/s.jpg")]
+
+
+def test_build_observations_without_validation_converts_every_field() -> None:
+    raw = raw_observations()
+    raw[0]["photos"][0] = dict(raw[0]["photos"][0], id="77")
+    raw[1]["user_login"] = 123
+    raw[2]["created_at"] = 1468188639
+
+    result = _build_observations(raw, validate=False)
+
+    assert result == _build_observations(raw)
+    assert result[0].photos[0].id == 77
+    assert result[1].user_login == "123"
+    assert result[2].created_at == datetime.datetime(
+        2016, 7, 10, 22, 10, 39, tzinfo=datetime.timezone.utc)
+
+
+@pytest.mark.parametrize("field, value", [
+    ("id", None),
+    ("latitude", "north"),
+    ("captive", "maybe"),
+    ("observed_on", "2016-13-01"),
+])
+def test_build_observations_without_validation_rejects_invalid_columns(field, value) -> None:
+    raw = raw_observations()
+    raw[1][field] = value
+
+    with pytest.raises(ValueError, match=field):
+        _build_observations(raw, validate=False)
+
+
+def test_get_obs_without_validation(requests_mock) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations.json?year=2016&per_page=200",
+        json=raw_observations(),
+    )
+
+    observations = get_obs(year=2016, validate=False)
+
+    assert [obs.id for obs in observations] == [2084, 2085, 2086]
+    assert observations[1].iconic_taxon is None
+
+
+def test_get_obs_sharded_raises_when_a_window_probe_fails(requests_mock, monkeypatch) -> None:
+    monkeypatch.setattr("mecoda_nat.mecoda_nat.MAX_PAGES", 2)
+    requests_mock.get(re.compile(f"{API_URL}/observations.json"), status_code=502)
+
+    with pytest.raises(requests.HTTPError, match="502"):
+        get_obs_sharded(starts_on="2021-03-01", ends_on="2021-03-10")
+
+
+def test_get_obs_sharded_splits_windows_over_the_page_limit(requests_mock, monkeypatch) -> None:
+    # 100 observations a day over 10 days, with pages of 200 and a limit of
+    # 2 pages per query; the day of id 1000 is repeated to check deduplication
+    monkeypatch.setattr("mecoda_nat.mecoda_nat.MAX_PAGES", 2)
+    days = [datetime.date(2021, 3, 1) + datetime.timedelta(days=id_ // 100) for id_ in range(1000)]
+    observations = [{"id": id_, "observed_on": str(day)} for id_, day in enumerate(days)]
+    observations.append({"id": 999, "observed_on": "2021-03-01"})
+
+    def answer(request, context):
+        d1 = datetime.date.fromisoformat(request.qs["d1"][0])
+        d2 = datetime.date.fromisoformat(request.qs["d2"][0])
+        page = int(request.qs.get("page", ["1"])[0])
+        matches = [
+            obs for obs in observations
+            if d1 <= datetime.date.fromisoformat(obs["observed_on"]) <= d2
+        ]
+        return matches[200 * (page - 1):200 * page]
+
+    requests_mock.get(re.compile(f"{API_URL}/observations.json"), json=answer)
+
+    result = get_obs_sharded(
+        taxon="fungi", starts_on="2021-03-01", ends_on="2021-03-10", max_workers=4)
+
+    assert [obs.id for obs in result] == list(range(999, -1, -1))
+    windows = {
+        (request.qs["d1"][0], request.qs["d2"][0])
+        for request in requests_mock.request_history
+        if "page" not in request.qs
+    }
+    assert all(
+        sum(d1 <= str(day) <= d2 for day in days) <= 400 for d1, d2 in windows)
+    assert all(request.qs["iconic_taxa"] == ["fungi"] for request in requests_mock.request_history)
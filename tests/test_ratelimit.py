@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import time
+
+import pytest
+from urllib3 import HTTPResponse
+from mecoda_nat import Metrics, NatusferaClient, RateLimiter
+from mecoda_nat.ratelimit import LimitedRetry, RequestCancelled
+
+API_URL = "https://natusfera.gbif.es"
+
+
+def test_rate_limiter_grows_with_healthy_answers_and_halves_on_congestion() -> None:
+    limiter = RateLimiter(rate=None, concurrency=2, max_concurrency=3)
+    for _ in range(20):
+        limiter.release(limiter.acquire(), 200)
+    assert limiter.state()["concurrency"] == 3
+
+    limiter.release(limiter.acquire(), 503)
+    assert limiter.state()["concurrency"] == 1
+    limiter.release(limiter.acquire(), 503)
+    assert limiter.concurrency >= 1
+
+
+def test_rate_limiter_pauses_until_retry_after() -> None:
+    limiter = RateLimiter(rate=None)
+    limiter.release(limiter.acquire(), 429, retry_after="0.2")
+    assert limiter.state()["paused_for"] > 0
+
+    start = time.monotonic()
+    limiter.release(limiter.acquire(), 200)
+    assert time.monotonic() - start >= 0.15
+
+
+def test_rate_limiter_waits_for_tokens() -> None:
+    limiter = RateLimiter(rate=20, burst=1, concurrency=8)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.release(limiter.acquire(), 200)
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rate_limiter_drops_waiting_requests_when_cancelled() -> None:
+    limiter = RateLimiter(rate=None, concurrency=1)
+    started = limiter.acquire()
+    stop = threading.Event()
+    threading.Timer(0.1, stop.set).start()
+    with limiter.cancel_on(stop), pytest.raises(RequestCancelled):
+        limiter.acquire()
+    limiter.release(started, 200)
+    assert limiter.state()["in_flight"] == 0
+
+
+def test_rate_limiter_wakes_up_async_waiters_when_a_slot_is_released() -> None:
+    limiter = RateLimiter(rate=None, concurrency=1)
+    checks = []
+    wait = limiter._wait
+    limiter._wait = lambda now: checks.append(now) or wait(now)
+
+    async def main():
+        started = await limiter.acquire_async()
+        threading.Timer(0.3, limiter.release, (started, 200)).start()
+        return await limiter.acquire_async()
+
+    asyncio.run(main())
+
+    assert len(checks) == 3
+    assert limiter.state()["in_flight"] == 1
+
+
+def test_limited_retry_frees_the_slot_while_waiting_to_retry() -> None:
+    limiter = RateLimiter(rate=None, concurrency=4)
+    retry = LimitedRetry(total=3, backoff_factor=0.2, status_forcelist=[503])
+    retry.rate_limiter = limiter
+    for _ in range(2):
+        # the second retry waits 0.4 seconds
+        retry = retry.increment("GET", "/projects/806.json", HTTPResponse(status=503))
+    in_flight = []
+    threading.Timer(0.1, lambda: in_flight.append(limiter.state()["in_flight"])).start()
+
+    with limiter.request() as slot:
+        retry.sleep(HTTPResponse(status=503))
+        assert limiter.state()["in_flight"] == 1
+        slot["status"] = 200
+
+    assert in_flight == [0]
+    assert limiter.state()["concurrency"] == 2
+    assert limiter.state()["in_flight"] == 0
+    assert retry.rate_limiter is limiter
+
+
+def test_client_reports_retried_answers_to_its_rate_limiter(stub_api) -> None:
+    limiter = RateLimiter(rate=None, concurrency=4)
+    client = NatusferaClient(rate_limiter=limiter)
+    stub_api.answers["/projects/1.json"] = [(200, {}, {})]
+    stub_api.answers["/projects/806.json"] = [(503, {"Retry-After": "1"}, {}), (200, {}, {})]
+
+    assert client.get(f"{stub_api.url}/projects/1.json").status_code == 200
+    assert limiter.state()["concurrency"] == 4
+    assert client.get(f"{stub_api.url}/projects/806.json").status_code == 200
+
+    # halved once by the retried 503, the second of Retry-After is not latency
+    assert limiter.state()["concurrency"] == 2
+    assert limiter.state()["in_flight"] == 0
+    assert NatusferaClient(rate_limiter=False).rate_limiter is None
+
+
+def test_client_frees_its_slot_while_waiting_to_retry(stub_api) -> None:
+    client = NatusferaClient(rate_limiter=RateLimiter(rate=None, concurrency=1))
+    stub_api.answers["/projects/806.json"] = [(503, {}, {}), (503, {}, {}), (200, {}, {})]
+    stub_api.pages["/projects/11.json"] = {"id": 11}
+    throttled = threading.Thread(
+        target=client.get, args=(f"{stub_api.url}/projects/806.json",))
+    throttled.start()
+    time.sleep(0.2)
+
+    start = time.perf_counter()
+    assert client.get(f"{stub_api.url}/projects/11.json").json() == {"id": 11}
+    elapsed = time.perf_counter() - start
+    throttled.join()
+
+    # the second retry of the throttled request waits one second
+    assert elapsed < 0.5
+    assert stub_api.requests.count("/projects/806.json") == 3
+
+
+def test_client_head_goes_through_the_rate_limiter_and_metrics(requests_mock) -> None:
+    limiter = RateLimiter(rate=None, concurrency=4)
+    metrics = Metrics()
+    client = NatusferaClient(rate_limiter=limiter, metrics=metrics)
+    requests_mock.head(f"{API_URL}/projects/806.json", status_code=404)
+
+    assert client.head(f"{API_URL}/projects/806.json").status_code == 404
+
+    assert limiter.state()["latency"] is not None
+    assert limiter.state()["in_flight"] == 0
+    assert metrics.as_dict()["requests"]["projects"]["status"] == {404: 1}
+
+
+def test_client_does_not_limit_the_photo_hosts(requests_mock) -> None:
+    limiter = RateLimiter(rate=None, concurrency=4)
+    client = NatusferaClient(rate_limiter=limiter)
+    requests_mock.get("https://static.example.org/photos/1/medium/a.jpg", status_code=503)
+
+    client.get("https://static.example.org/photos/1/medium/a.jpg", stream=True)
+
+    assert limiter.state()["concurrency"] == 4
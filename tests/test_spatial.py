@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+import pytest
+from mecoda_nat import SpatialIndex
+from mecoda_nat.spatial import haversine, points_in_polygon
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "id": np.arange(5000),
+        "latitude": rng.uniform(35, 44, 5000),
+        "longitude": rng.uniform(-10, 4, 5000),
+    })
+    df.loc[::50, "longitude"] = None
+    return df
+
+
+def test_haversine_distance() -> None:
+    # Barcelona - Madrid
+    assert haversine(41.3874, 2.1686, 40.4168, -3.7038) == pytest.approx(505, abs=1)
+
+
+def test_points_in_polygon() -> None:
+    square = [(0, 0), (0, 2), (2, 2), (2, 0)]
+
+    assert points_in_polygon([1, 1, 3, -0.5], [1, 1.9, 1, 1], square).tolist() == [
+        True, True, False, False]
+
+
+def test_spatial_index_bbox_matches_filter(df) -> None:
+    index = SpatialIndex(df, cell_size=0.25)
+
+    result = index.bbox(40, 1, 42, 3)
+
+    expected = df[df.latitude.between(40, 42) & df.longitude.between(1, 3)]
+    pd.testing.assert_frame_equal(result, expected)
+    assert len(index) == 4900
+
+
+def test_spatial_index_radius_matches_haversine(df) -> None:
+    index = SpatialIndex(df)
+
+    result = index.radius(41.39, 2.17, 100)
+
+    expected = df[haversine(41.39, 2.17, df.latitude, df.longitude) <= 100]
+    pd.testing.assert_frame_equal(result, expected)
+    assert len(result) > 0
+
+
+def test_spatial_index_polygon_matches_mask(df) -> None:
+    polygon = [(41, 0.5), (42.5, 1.5), (41.5, 3.5), (41.8, 2.0), (40.5, 2.5)]
+    index = SpatialIndex(df)
+
+    result = index.polygon(polygon)
+
+    expected = df[points_in_polygon(df.latitude, df.longitude, polygon)]
+    pd.testing.assert_frame_equal(result, expected)
+    assert len(result) > 0
+
+
+def test_spatial_index_searches_both_sides_of_the_antimeridian() -> None:
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "latitude": rng.uniform(-90, 90, 20000),
+        "longitude": rng.uniform(-180, 180, 20000),
+    })
+    index = SpatialIndex(df)
+    across = df.latitude.between(-10, 10) & ((df.longitude >= 170) | (df.longitude <= -170))
+
+    radius = index.radius(-52, 175, 1984)
+    bbox = index.bbox(-10, 170, 10, -170)
+    polygon = index.polygon([(-10, 170), (-10, -170), (10, -170), (10, 170)])
+
+    pd.testing.assert_frame_equal(radius, df[haversine(-52, 175, df.latitude, df.longitude) <= 1984])
+    pd.testing.assert_frame_equal(bbox, df[across])
+    pd.testing.assert_frame_equal(polygon, df[across])
+    assert len(bbox) > 0
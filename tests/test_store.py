@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import datetime
+import pytest
+from mecoda_nat import NatusferaClient, Observation, ResponseCache, get_client, set_client
+import sqlite3
+import time
+from mecoda_nat.store import ObservationStore, query_obs, sync_obs, _uncovered
+
+API_URL = "https://natusfera.gbif.es"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ObservationStore(str(tmp_path / "observations.sqlite"))
+    yield store
+    store.close()
+
+
+def test_sync_obs_fetches_only_changes_after_first_sync(requests_mock, store) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations/project/806.json?per_page=200",
+        json=[
+            {"id": id_, "updated_at": f"2021-03-1{id_}T10:00:00+02:00"}
+            for id_ in range(3)
+        ],
+    )
+
+    first = sync_obs(store, id_project=806)
+
+    assert [obs.id for obs in first] == [0, 1, 2]
+    assert len(store) == 3
+    watermark = store.watermark(f"{API_URL}/observations/project/806.json?&per_page=200")
+    assert watermark["updated_at"] == "2021-03-12T10:00:00+02:00"
+
+    changes = requests_mock.get(
+        f"{API_URL}/observations/project/806.json?per_page=200"
+        "&updated_since=2021-03-12T10%3A00%3A00%2B02%3A00",
+        json=[
+            {"id": 3, "updated_at": "2021-04-01T09:00:00+02:00"},
+            {"id": 1, "description": "corrected", "updated_at": "2021-04-02T09:00:00+02:00"},
+        ],
+    )
+
+    second = sync_obs(store, id_project=806)
+
+    assert changes.called_once
+    assert [obs.id for obs in second] == [3, 1]
+    assert len(store) == 4
+    assert store.get(1).description == "corrected"
+    assert [obs.id for obs in store.observations()] == [3, 2, 1, 0]
+    assert store.watermark(
+        f"{API_URL}/observations/project/806.json?&per_page=200"
+    )["updated_at"] == "2021-04-02T09:00:00+02:00"
+
+
+def test_sync_obs_keeps_the_watermark_when_the_limit_is_reached(
+    requests_mock, store, monkeypatch
+) -> None:
+    monkeypatch.setattr("mecoda_nat.store.MAX_PAGES", 1)
+    url = f"{API_URL}/observations.json?year=2021&per_page=200"
+    requests_mock.get(url, json=[
+        {"id": id_, "updated_at": "2021-03-10T10:00:00" if id_ else "2021-03-11T10:00:00Z"}
+        for id_ in range(200)
+    ])
+    requests_mock.get(f"{url}&page=2", json=[])
+
+    sync_obs(store, year=2021)
+    assert store.watermark(url) is None
+
+    requests_mock.get(url, json=[
+        {"id": 1, "updated_at": "2021-03-10T10:00:00"},
+        {"id": 2, "updated_at": "2021-03-11T10:00:00+02:00"},
+        {"id": 3, "updated_at": "2021-03-10T23:00:00Z"},
+    ])
+    sync_obs(store, year=2021)
+    assert store.watermark(url)["updated_at"] == "2021-03-11T10:00:00+02:00"
+
+
+def test_sync_obs_requests_the_api_and_drops_removed_members_on_full_syncs(
+    requests_mock, store, tmp_path
+) -> None:
+    previous = get_client()
+    set_client(NatusferaClient(cache=ResponseCache(str(tmp_path / "responses.sqlite"))))
+    url = f"{API_URL}/observations/project/806.json?per_page=200"
+    try:
+        requests_mock.get(url, json=[observation(id_, "2021-03-02") for id_ in [3, 2, 1]])
+        sync_obs(store, id_project=806)
+        requests_mock.get(url, json=[observation(id_, "2021-03-02") for id_ in [3, 1]])
+
+        sync_obs(store, id_project=806, full=True)
+    finally:
+        set_client(previous)
+
+    assert requests_mock.call_count == 2
+    assert [obs.id for obs in query_obs(store, id_project=806, offline=True)] == [3, 1]
+    assert len(store) == 3
+
+
+def test_query_obs_downloads_up_to_num_max(requests_mock, store) -> None:
+    url = f"{API_URL}/observations.json?year=2021&per_page=200"
+    requests_mock.get(url, json=[observation(id_, "2021-03-02") for id_ in range(400, 200, -1)])
+    second = requests_mock.get(f"{url}&page=2", json=[observation(1, "2021-03-02")])
+
+    result = query_obs(store, year=2021, num_max=2)
+
+    assert [obs.id for obs in result] == [400, 399]
+    assert not second.called
+    assert store.coverage() == []
+
+
+def test_store_upsert_replaces_by_id(store) -> None:
+    store.upsert([Observation(id=1, taxon_name="Quercus"), Observation(id=2)])
+    store.upsert([Observation(
+        id=1,
+        taxon_name="Quercus ilex",
+        updated_at=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+    )])
+
+    assert len(store) == 2
+    assert store.get(1).taxon_name == "Quercus ilex"
+    assert store.get(3) is None
+
+
+def observation(id_, observed_on, iconic_taxon_id=13, ancestry="48460/47170", user="ana"):
+    return {
+        "id": id_,
+        "observed_on": observed_on,
+        "created_at": f"{observed_on}T10:00:00+02:00",
+        "iconic_taxon_id": iconic_taxon_id,
+        "taxon": {"id": 1000 + id_, "name": "Boletus", "ancestry": ancestry},
+        "user_login": user,
+        "latitude": 41.4,
+        "longitude": 2.1,
+    }
+
+
+def test_query_obs_downloads_only_uncovered_ranges(requests_mock, store) -> None:
+    march = requests_mock.get(
+        f"{API_URL}/observations.json?d1=2021-03-01&d2=2021-03-31&per_page=200",
+        json=[observation(2, "2021-03-20"), observation(1, "2021-03-02", user="joan")],
+    )
+    april = requests_mock.get(
+        f"{API_URL}/observations.json?d1=2021-04-01&d2=2021-04-30&per_page=200",
+        json=[observation(3, "2021-04-10", iconic_taxon_id=3)],
+    )
+
+    first = query_obs(store, starts_on="2021-03-01", ends_on="2021-03-31")
+    second = query_obs(store, starts_on="2021-03-15", ends_on="2021-04-30")
+    fungi = query_obs(store, taxon="fungi", starts_on="2021-03-01", ends_on="2021-04-30")
+
+    assert [obs.id for obs in first] == [2, 1]
+    assert [obs.id for obs in second] == [3, 2]
+    assert [obs.id for obs in fungi] == [2, 1]
+    assert march.call_count == april.call_count == 1
+    assert requests_mock.call_count == 2
+    assert [obs.id for obs in query_obs(
+        store, user="joan", starts_on="2021-03-01", ends_on="2021-03-31")] == [1]
+    assert [obs.id for obs in query_obs(
+        store, taxon_id=47170, starts_on="2021-03-01", ends_on="2021-04-30")] == [3, 2, 1]
+    assert query_obs(store, starts_on="2021-05-01", ends_on="2021-05-31", offline=True) == []
+
+
+def test_query_obs_downloads_again_old_or_refreshed_ranges(requests_mock, store) -> None:
+    url = f"{API_URL}/observations.json?d1=2021-03-01&d2=2021-03-31&per_page=200"
+    march = requests_mock.get(url, json=[observation(1, "2021-03-02")])
+    query = {"starts_on": "2021-03-01", "ends_on": "2021-03-31"}
+
+    query_obs(store, **query)
+    query_obs(store, **query, max_age=3600)
+    assert march.call_count == 1
+    time.sleep(0.05)
+    query_obs(store, **query, max_age=0.01)
+    assert march.call_count == 2
+    march = requests_mock.get(url, json=[observation(1, "2021-03-02", user="joan")])
+    assert query_obs(store, **query, refresh=True)[0].user_login == "joan"
+    assert march.call_count == 1
+    assert len(store.coverage()) == 1
+
+
+def test_query_obs_answers_from_a_synced_project(requests_mock, store) -> None:
+    requests_mock.get(
+        f"{API_URL}/observations/project/806.json?per_page=200",
+        json=[observation(2, "2021-03-20"), observation(1, "2020-03-02", iconic_taxon_id=3)],
+    )
+    requests_mock.get(
+        f"{API_URL}/observations.json?per_page=200",
+        json=[observation(5, "2021-03-20")],
+    )
+    sync_obs(store, id_project=806)
+    query_obs(store)
+
+    result = query_obs(store, id_project=806, taxon="fungi", year=2021)
+
+    assert [obs.id for obs in result] == [2]
+    assert [obs.id for obs in query_obs(store, id_project=806)] == [2, 1]
+    assert requests_mock.call_count == 2
+
+
+def test_uncovered_ranges() -> None:
+    day = datetime.date
+    coverage = [
+        ({"taxon": "Fungi"}, day(2021, 1, 10), day(2021, 1, 20)),
+        ({}, day(2021, 1, 25), day(2021, 1, 31)),
+        ({"id_project": 806}, None, None),
+    ]
+
+    assert _uncovered(coverage, {"taxon": "Fungi"}, day(2021, 1, 1), day(2021, 2, 5)) == [
+        (day(2021, 1, 1), day(2021, 1, 9)),
+        (day(2021, 1, 21), day(2021, 1, 24)),
+        (day(2021, 2, 1), day(2021, 2, 5)),
+    ]
+    assert _uncovered(coverage, {}, day(2021, 1, 26), day(2021, 1, 30)) == []
+    assert _uncovered(coverage, {}, None, None) == [(None, None)]
+    assert _uncovered(coverage, {"id_project": 806, "user": "ana"}, None, None) == []
+
+
+def test_store_migrates_previous_schema(tmp_path) -> None:
+    path = str(tmp_path / "observations.sqlite")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE observations (id INTEGER PRIMARY KEY, updated_at TEXT, data TEXT)")
+    db.execute(
+        "INSERT INTO observations VALUES (1, NULL, ?)",
+        (Observation(id=1, taxon_id=7, user_login="ana").json(),),
+    )
+    db.commit()
+    db.close()
+
+    store = ObservationStore(path)
+
+    assert [obs.id for obs in store.select({"user": "ana"})] == [1]
+    assert store.select({"taxon_id": 7})[0].taxon_id == 7
+    store.close()
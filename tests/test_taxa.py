@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+import mecoda_nat
+from mecoda_nat.taxa import TaxonTree, build_taxon_tree, load_taxon_tree
+
+DATA = os.path.join(os.path.dirname(mecoda_nat.__file__), "data")
+
+
+def test_shipped_taxon_tree_matches_the_csv(tmp_path) -> None:
+    path = str(tmp_path / "taxon_tree.npz")
+    build_taxon_tree(os.path.join(DATA, "taxon_tree.csv"), path)
+
+    with np.load(path) as built, np.load(os.path.join(DATA, "taxon_tree.npz")) as shipped:
+        assert sorted(built.files) == sorted(shipped.files)
+        for name in built.files:
+            np.testing.assert_array_equal(built[name], shipped[name])
+
+
+def test_taxon_tree_lookups(tmp_path) -> None:
+    csv = tmp_path / "taxon_tree.csv"
+    csv.write_text(
+        "id,name,rank,ancestry\n"
+        "1,Life,,\n"
+        "2,Animalia,kingdom,1\n"
+        "3,Chordata,phylum,1/2\n"
+        "5,Arthropoda,phylum,1/2\n"
+        "7,Aves,class,1/2/3\n"
+        "9,Orphan,species,1/2/8\n"
+    )
+    build_taxon_tree(str(csv), str(tmp_path / "taxon_tree.npz"))
+    with np.load(str(tmp_path / "taxon_tree.npz")) as arrays:
+        tree = TaxonTree({name: arrays[name] for name in arrays.files})
+
+    assert len(tree) == 6
+    assert tree.names == ["Life", "Animalia", "Chordata", "Arthropoda", "Aves", "Orphan"]
+    assert tree.name(7) == "Aves"
+    assert tree.rank(1) is None
+    assert tree.ranks([3, 4, 1]).tolist() == ["phylum", None, None]
+    assert tree.ancestors(7) == [1, 2, 3]
+    assert tree.descendants(1) == [2, 3, 7, 5]
+    assert tree.descendants(2) == [3, 7, 5]
+    assert tree.descendants(7) == []
+    assert tree.descendants(9) == []
+    assert tree.rank_at_level(7, "phylum") == 3
+    assert tree.rank_at_level(7, "class") == 7
+    assert tree.rank_at_level(7, "genus") is None
+    assert 4 not in tree
+
+
+def test_load_taxon_tree() -> None:
+    tree = load_taxon_tree()
+
+    assert tree is load_taxon_tree()
+    assert tree.name(2) == "Animalia"
+    assert tree.rank(2) == "kingdom"
+    assert tree.ancestors(7083) == [1, 2, 4, 8, 818, 7084]
+    assert tree.name(tree.rank_at_level(7083, "kingdom")) == "Animalia"
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import re
+
+import pytest
+import pandas as pd
+
+folium = pytest.importorskip("folium")
+from mecoda_nat.views import create_heatmap, create_markercluster, grid_bins
+
+pytestmark = pytest.mark.filterwarnings("ignore:CartoDB tiles")
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        "latitude": [41.1, 41.2, None, 2.0],
+        "longitude": [2.1, 2.15, 1.0, 3.0],
+        "id_old": [1, 2, 3, 4],
+        "species_guess": ["Boletus edulis", None, "Amanita", "Thalassoma pavo"],
+    })
+
+
+def test_grid_bins_counts_points_per_cell() -> None:
+    lats, lons, counts = grid_bins([41.1, 41.2, 2.0], [2.1, 2.15, 3.0], 1)
+
+    assert counts.tolist() == [1, 2]
+    assert lats.tolist() == pytest.approx([2.0, 41.15])
+    assert lons.tolist() == pytest.approx([3.0, 2.125])
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({"fast": True}, '[[41.1, 2.1, "1", "Boletus edulis"], [41.2, 2.15, "2", ""], '
+                     '[2.0, 3.0, "4", "Thalassoma pavo"]]'),
+    ({"cell_size": 1}, "[[2.0, 3.0, 1.0, 4.0], [41.15, 2.125, 2.0, 4.9]]"),
+])
+def test_create_markercluster_sends_compact_arrays(df, kwargs, expected) -> None:
+    original = df.copy()
+
+    html = create_markercluster(df, **kwargs).get_root().render()
+
+    assert f"var data = {expected};" in html
+    pd.testing.assert_frame_equal(df, original)
+
+
+def test_create_markercluster_fast_escapes_popup_text(df) -> None:
+    df.loc[0, "species_guess"] = "<img src=x onerror=alert(1)>"
+
+    html = create_markercluster(df, fast=True).get_root().render()
+
+    assert "<img src=x" not in html
+    assert "lt;img src=x onerror=alert(1)\\u0026gt;" in html
+
+
+def test_create_heatmap_binned_sends_weighted_cells(df) -> None:
+    original = df.copy()
+
+    html = create_heatmap(df, binned=True, zoom=0).get_root().render()
+
+    # cells of 5 pixels at zoom 0 measure about 7 degrees
+    assert "[[2.0, 3.0, 0.5], [41.15, 2.125, 1.0]]" in html
+    pd.testing.assert_frame_equal(df, original)
+
+
+@pytest.mark.parametrize("binned", [False, True])
+def test_create_heatmap_without_coordinates_is_empty(df, binned) -> None:
+    df["latitude"] = None
+
+    html = create_heatmap(df, binned=binned).get_root().render()
+
+    assert re.search(r"L\.heatLayer\(\s*\[\],", html)